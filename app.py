@@ -1,36 +1,76 @@
-from flask import Flask, jsonify, request, render_template, send_from_directory
+from flask import Flask, Response, jsonify, request, render_template, send_from_directory, stream_with_context
 from flask_cors import CORS
 import os
-import requests
+import csv
+import io
 import json
+import logging
 import os
 import sqlite3
 from datetime import datetime
 import socket
 import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # no leader election; every process runs the background jobs
+    fcntl = None
+
+from cache import TTLCache
+from cachebackend import MemoryBackend
+import db
+import metrics
+from catalog import StationCatalog
+from clicks import ClickQueue, DUPLICATE, FULL
+from favicons import FaviconCache
+from facets import FacetIndex, filters_from_args, station_matches
+from favorites import ADDED, REMOVED, STATION_UUID, FavoritesStore, validate_favorite
+from nowplaying import NowPlayingService
+from prober import StreamProber
+from rediscache import RedisCache
+from relay import RelayError, StreamRelay
+from resolver import StreamResolver
+import responses
+from servers import OPEN, ServerManager
+from sharedcache import SharedCache
+from singleflight import SingleFlight
+from snapshot import StationSnapshot
+from suggest import SuggestIndex
+from static_assets import IMMUTABLE, StaticAsset, content_hash
+import streaming
+from trigram import TrigramIndex
+from upstream import UpstreamClient, UpstreamUnavailable
+from warmup import Warmer
+
+# NERV9_LOG_LEVEL=off silences logging entirely; per-request lines are DEBUG
+LOG_LEVEL = os.environ.get('NERV9_LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=logging.INFO if LOG_LEVEL == 'OFF' else LOG_LEVEL,
+                    format='%(asctime)s level=%(levelname)s logger=%(name)s %(message)s')
+# The development server's access log would otherwise stay at INFO
+logging.getLogger('werkzeug').setLevel(logging.getLogger().level)
+if LOG_LEVEL == 'OFF':
+    logging.disable(logging.CRITICAL)
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for mobile access
+# Installed before compression so the route timings include it
+metrics.install(app)
+metrics.TRACES.threshold = float(os.environ.get('NERV9_SLOW_REQUEST_SECONDS', 1.0))
+metrics.TRACES.sample_rate = float(os.environ.get('NERV9_TRACE_SAMPLE_RATE', 0.1))
+responses.install(app, min_size=int(os.environ.get('NERV9_COMPRESS_MIN_SIZE', 1024)))
 
-# Database setup for favorites
+# Database setup for favorites and the station mirror
 def init_db():
-    conn = sqlite3.connect('nerv9_radio.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS favorites
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id TEXT,
-                  station_uuid TEXT,
-                  station_name TEXT,
-                  station_url TEXT,
-                  country TEXT,
-                  language TEXT,
-                  tags TEXT,
-                  favicon TEXT,
-                  added_date TEXT)''')
-    conn.commit()
-    conn.close()
-
-# Backup radio stations when radio-browser.info is down
+    FAVORITES.init_schema()
+    CATALOG.init_schema()
+    FAVICONS.init_schema()
+    PROBER.init_schema()
+    WARMER.init_schema()
+
+# Seed for the station snapshot before radio-browser.info has ever answered
 BACKUP_STATIONS = [
     {
         'uuid': 'backup-1',
@@ -130,29 +170,254 @@ BACKUP_STATIONS = [
     }
 ]
 
-# Get available radio-browser.info servers
+# Known radio-browser.info servers, used when DNS discovery fails
+FALLBACK_SERVERS = [
+    "https://de2.api.radio-browser.info",
+    "https://api.radio-browser.info"
+]
+
+# Get available radio-browser.info servers, best first
 def get_radio_browser_servers():
-    # Try the specific working server first, then fallback to main API
-    return [
-        "https://de2.api.radio-browser.info",
-        "https://api.radio-browser.info"
-    ]
+    return SERVERS.ranked_urls()
 
 # Headers for radio-browser.info API
 HEADERS = {
     'User-Agent': 'NERV9-Radio/1.0'
 }
 
-@app.route('/')
-def home():
-    return '''<!DOCTYPE html>
+# Keep-alive connection pools shared by every radio-browser call
+UPSTREAM = UpstreamClient(
+    headers=HEADERS,
+    pool_connections=int(os.environ.get('NERV9_UPSTREAM_POOLS', 10)),
+    pool_maxsize=int(os.environ.get('NERV9_UPSTREAM_POOL_SIZE', 32)),
+    retries=int(os.environ.get('NERV9_UPSTREAM_RETRIES', 1)),
+    backoff_factor=float(os.environ.get('NERV9_UPSTREAM_BACKOFF', 0.3))
+)
+
+# Mirror discovery, latency ranking and circuit breakers
+SERVERS = ServerManager(
+    UPSTREAM, FALLBACK_SERVERS,
+    static_servers=[url.strip() for url in os.environ.get('NERV9_RADIO_BROWSER_SERVERS', '').split(',') if url.strip()]
+)
+
+# Overall time budget for one upstream station query, across servers
+UPSTREAM_DEADLINE = float(os.environ.get('NERV9_UPSTREAM_DEADLINE', 8))
+
+# Local mirror of the station catalog, answers search and popular once synced
+CATALOG = StationCatalog(db.DB_PATH, get_radio_browser_servers, UPSTREAM)
+
+FAVORITES = FavoritesStore(db.DB_PATH)
+
+# Largest number of favorites accepted by one batch request
+MAX_FAVORITES_BATCH = int(os.environ.get('NERV9_FAVORITES_MAX_BATCH', 1000))
+
+# Column order for CSV exports
+EXPORT_FIELDS = ['id', 'station_uuid', 'station_name', 'station_url', 'country',
+                 'language', 'tags', 'favicon', 'added_date']
+
+def send_click(station_uuid):
+    response = SERVERS.request(f"/json/url/{station_uuid}", timeout=5, deadline=10)
+    if response.status_code != 200:
+        raise UpstreamUnavailable(f"Click rejected with status {response.status_code}")
+
+# Station clicks are recorded in the background so play requests never wait on upstream
+CLICKS = ClickQueue(
+    send_click,
+    maxsize=int(os.environ.get('NERV9_CLICK_QUEUE_SIZE', 1000)),
+    workers=int(os.environ.get('NERV9_CLICK_WORKERS', 2)),
+    dedupe_window=int(os.environ.get('NERV9_CLICK_DEDUPE_WINDOW', 60))
+)
+
+# Recently served stations by uuid, for endpoints that are only given a uuid
+KNOWN_STATIONS = TTLCache(maxsize=50000, ttl=86400, stale_ttl=0)
+
+# Favicon servers are arbitrary third parties too, kept apart from the radio-browser pools
+FAVICON_HOSTS = UpstreamClient(
+    headers=HEADERS,
+    pool_connections=int(os.environ.get('NERV9_FAVICON_HOST_POOLS', 50)),
+    pool_maxsize=4,
+    retries=0,
+    timeout=5,
+    aggregate_as='favicon hosts'
+)
+
+# Thumbnails of station favicons, fetched once and stored by content hash
+FAVICONS = FaviconCache(
+    os.environ.get('NERV9_FAVICON_DIR', 'favicon_cache'), FAVICON_HOSTS,
+    max_bytes=int(os.environ.get('NERV9_FAVICON_CACHE_BYTES', 64 * 1024 * 1024))
+)
+
+FAVICON_PLACEHOLDER = StaticAsset(
+    '<svg xmlns="http://www.w3.org/2000/svg" width="64" height="64" viewBox="0 0 64 64">'
+    '<rect width="64" height="64" rx="12" fill="#111"/>'
+    '<circle cx="32" cy="36" r="6" fill="#dc2626"/>'
+    '<path d="M18 22a20 20 0 0 1 28 0M23 27a13 13 0 0 1 18 0" stroke="#dc2626" stroke-width="4" fill="none" stroke-linecap="round"/>'
+    '</svg>', 'image/svg+xml')
+
+# Last-known-good stations on disk, serving search and popular while upstream is down
+SNAPSHOT = StationSnapshot(
+    os.environ.get('NERV9_SNAPSHOT_PATH', 'nerv9_stations.snapshot'),
+    max_stations=int(os.environ.get('NERV9_SNAPSHOT_MAX_STATIONS', 20000)),
+    max_age=int(os.environ.get('NERV9_SNAPSHOT_MAX_AGE', 30 * 86400))
+)
+
+def probe_targets():
+    """Stations worth probing: recently served, favorited and the snapshot's most popular"""
+    targets = [(station['uuid'], station['url']) for station in KNOWN_STATIONS.values()]
+    try:
+        targets.extend(FAVORITES.station_urls(PROBER.max_targets))
+    except sqlite3.Error as e:
+        log.warning("Could not list favorite streams error=%r", str(e))
+    targets.extend((station['uuid'], station['url']) for station in SNAPSHOT.popular(100))
+    return targets
+
+# Measures connect time, time to first byte, codec and bitrate of station streams
+PROBER = StreamProber(
+    probe_targets,
+    interval=int(os.environ.get('NERV9_PROBE_INTERVAL', 300)),
+    recheck=int(os.environ.get('NERV9_PROBE_RECHECK', 900)),
+    concurrency=int(os.environ.get('NERV9_PROBE_CONCURRENCY', 20)),
+    probe_timeout=float(os.environ.get('NERV9_PROBE_TIMEOUT', 5)),
+    cycle_budget=float(os.environ.get('NERV9_PROBE_CYCLE_BUDGET', 60))
+)
+
+# Station stream hosts are arbitrary third parties: their own pools, no retries,
+# and counted as a whole rather than per host
+STREAM_HOSTS = UpstreamClient(
+    headers=HEADERS,
+    pool_connections=int(os.environ.get('NERV9_STREAM_HOST_POOLS', 50)),
+    pool_maxsize=4,
+    retries=0,
+    timeout=5,
+    aggregate_as='stream hosts'
+)
+
+# Final stream URLs behind redirects and PLS/M3U playlists, resolved in the
+# background when a station is played
+RESOLVER = StreamResolver(
+    STREAM_HOSTS,
+    ttl=int(os.environ.get('NERV9_RESOLVE_TTL', 3600)),
+    workers=int(os.environ.get('NERV9_RESOLVE_WORKERS', 4))
+)
+
+# Optional fan-out relay, so listeners of one station share a single upstream connection
+RELAY_ENABLED = os.environ.get('NERV9_RELAY', '0') == '1'
+RELAY = StreamRelay(
+    buffer_chunks=int(os.environ.get('NERV9_RELAY_BUFFER_CHUNKS', 256)),
+    idle_timeout=int(os.environ.get('NERV9_RELAY_IDLE_TIMEOUT', 30)),
+    max_channels=int(os.environ.get('NERV9_RELAY_MAX_STATIONS', 200))
+)
+
+# Relayed audio and now-playing events keep their request open while the client
+# listens. Under a gevent worker that costs a greenlet; under a threaded server
+# it pins a thread, so at most NERV9_MAX_STREAMS are admitted per process
+STREAM_SLOTS = streaming.StreamSlots(
+    int(os.environ['NERV9_MAX_STREAMS']) if os.environ.get('NERV9_MAX_STREAMS')
+    else None if streaming.cooperative() else 4
+)
+
+# One ICY metadata poller per station that someone is listening to
+NOW_PLAYING = NowPlayingService(
+    linger=int(os.environ.get('NERV9_NOWPLAYING_LINGER', 10)),
+    max_pollers=int(os.environ.get('NERV9_NOWPLAYING_MAX_STATIONS', 200))
+)
+
+# Columnar index with facet bitmaps over the mirrored (or recently served) stations
+FACETS = FacetIndex()
+
+def load_station_index():
+    """Rebuild the in-memory station index from the mirror, or the snapshot until there is one"""
+    if CATALOG.is_ready():
+        try:
+            FACETS.load(CATALOG.iter_stations())
+            return
+        except sqlite3.Error as e:
+            log.error("Could not load the station index error=%r", str(e))
+    FACETS.upsert(SNAPSHOT.stations())
+
+def on_catalog_sync(changed, removed):
+    if changed is None:
+        load_station_index()
+    else:
+        FACETS.upsert(changed)
+        FACETS.remove(removed)
+
+CATALOG.listeners.append(on_catalog_sync)
+
+# Search-box completions over station names, tags and countries
+SUGGEST = SuggestIndex()
+
+# Typo-tolerant ranking over station names and tags
+TRIGRAMS = TrigramIndex()
+
+def start_search_index_rebuilds(interval=60):
+    """Rebuild SUGGEST and TRIGRAMS from FACETS in the background whenever it has changed"""
+    def run():
+        built_version = None
+        while True:
+            try:
+                version = FACETS.version()
+                if version != built_version:
+                    stations = FACETS.stations()
+                    SUGGEST.rebuild(stations)
+                    TRIGRAMS.rebuild(stations)
+                    built_version = version
+            except Exception:
+                log.exception("Search index rebuild failed")
+            time.sleep(interval)
+    
+    thread = threading.Thread(target=run, name='search-index-rebuild', daemon=True)
+    thread.start()
+    return thread
+
+# Concurrent identical station queries share one fetch
+STATION_FLIGHTS = SingleFlight()
+
+def make_cache_backend(name):
+    """The second-level station cache named by NERV9_CACHE_BACKEND, or None"""
+    compress_min_size = int(os.environ.get('NERV9_CACHE_COMPRESS_MIN_SIZE', 1024))
+    if name == 'memory':
+        return MemoryBackend(compress_min_size)
+    if name == 'shared':
+        return SharedCache(
+            os.environ.get('NERV9_SHARED_CACHE_PATH') or None,
+            maxsize=int(os.environ.get('NERV9_SHARED_CACHE_SIZE', 8192)),
+            compress_min_size=compress_min_size
+        )
+    if name == 'redis':
+        return RedisCache(
+            os.environ.get('NERV9_REDIS_URL', 'redis://127.0.0.1:6379/0'),
+            prefix=os.environ.get('NERV9_REDIS_PREFIX', 'nerv9:'),
+            timeout=float(os.environ.get('NERV9_REDIS_TIMEOUT', 0.5)),
+            compress_min_size=compress_min_size
+        )
+    if name:
+        raise ValueError(f"Unknown NERV9_CACHE_BACKEND {name!r} (memory, shared or redis)")
+    return None
+
+# Search and popular results, keyed on (endpoint, normalized query, limit), with
+# an optional second level: 'shared' across the workers of a host (serve.py
+# picks it for multiple workers through NERV9_SHARED_CACHE=1) or 'redis' across nodes
+SHARED_CACHE = make_cache_backend(os.environ.get(
+    'NERV9_CACHE_BACKEND', 'shared' if os.environ.get('NERV9_SHARED_CACHE', '0') == '1' else ''))
+STATION_CACHE = TTLCache(
+    maxsize=int(os.environ.get('NERV9_CACHE_SIZE', 1024)),
+    ttl=int(os.environ.get('NERV9_CACHE_TTL', 300)),
+    stale_ttl=int(os.environ.get('NERV9_CACHE_STALE_TTL', 900)),
+    shared=SHARED_CACHE,
+    # Cached lists may come from another worker or node; index them here too
+    on_fill=lambda stations: index_stations(stations)
+)
+
+# App shell; __MANIFEST_URL__ and __RELAY__ are filled in by build_shell()
+HOME_HTML = '''<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>NERV9 RADIO</title>
     <meta name="theme-color" content="#000000">
-    <link rel="manifest" href="/manifest.json">
+    <link rel="manifest" href="__MANIFEST_URL__">
     <style>
         * { margin: 0; padding: 0; box-sizing: border-box; }
         body { background: #000000; color: #dc2626; font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', system-ui, sans-serif; overflow-x: hidden; min-height: 100vh; }
@@ -171,6 +436,7 @@ def home():
         .now-playing { text-align: center; margin-bottom: 20px; }
         .station-name { font-size: 1.2rem; font-weight: bold; margin-bottom: 5px; }
         .station-info { font-size: 0.9rem; opacity: 0.7; }
+        .track-title { font-size: 0.85rem; color: #dc2626; margin-top: 5px; min-height: 1em; }
         .player-controls { display: flex; justify-content: center; align-items: center; gap: 20px; margin-bottom: 15px; }
         .play-btn { width: 60px; height: 60px; border-radius: 50%; background: #dc2626; color: #000; border: none; font-size: 24px; cursor: pointer; transition: all 0.3s ease; display: flex; align-items: center; justify-content: center; }
         .play-btn:hover { background: #b91c1c; transform: scale(1.1); }
@@ -186,6 +452,8 @@ def home():
         .stations-list { margin-bottom: 20px; }
         .station-item { background: #111; border-radius: 10px; padding: 15px; margin-bottom: 10px; border: 1px solid #333; cursor: pointer; transition: all 0.3s ease; display: flex; justify-content: space-between; align-items: center; }
         .station-item:hover { border-color: #dc2626; background: #1a1a1a; }
+        .station-icon { width: 40px; height: 40px; border-radius: 8px; margin-right: 12px; flex-shrink: 0; object-fit: cover; background: #000; }
+        .station-details { flex: 1; min-width: 0; }
         .station-details h3 { font-size: 1rem; margin-bottom: 5px; }
         .station-details p { font-size: 0.8rem; opacity: 0.7; }
         .station-actions { display: flex; gap: 10px; align-items: center; }
@@ -206,7 +474,8 @@ def home():
             <div class="subtitle">RADIO TERMINAL</div>
         </header>
         <div class="search-container">
-            <input type="text" class="search-input" placeholder="Search radio stations..." id="searchInput">
+            <input type="text" class="search-input" placeholder="Search radio stations..." id="searchInput" list="searchSuggestions" autocomplete="off">
+            <datalist id="searchSuggestions"></datalist>
         </div>
         <div class="controls">
             <button class="btn" id="searchBtn">Search</button>
@@ -217,6 +486,7 @@ def home():
             <div class="now-playing">
                 <div class="station-name" id="currentStation">No Station Selected</div>
                 <div class="station-info" id="currentInfo">Select a station to begin</div>
+                <div class="track-title" id="currentTrack"></div>
             </div>
             <div class="player-controls">
                 <button class="play-btn" id="playBtn">▶</button>
@@ -249,7 +519,21 @@ def home():
     <script>
         const API_BASE = window.location.origin;
         const USER_ID = 'user_' + Math.random().toString(36).substr(2, 9);
-        let currentStationData = null; let isPlaying = false; let stations = []; let favorites = [];
+        const RELAY = __RELAY__;
+        function streamUrl(uuid, url) { return RELAY ? `${API_BASE}/api/stream/${uuid}` : url; }
+        let nowPlayingSource = null;
+        function watchNowPlaying(uuid) {
+            if (nowPlayingSource) nowPlayingSource.close();
+            document.getElementById('currentTrack').textContent = '';
+            if (!window.EventSource) return;
+            nowPlayingSource = new EventSource(`${API_BASE}/api/nowplaying/stream?uuid=${encodeURIComponent(uuid)}`);
+            nowPlayingSource.addEventListener('nowplaying', (e) => {
+                const info = JSON.parse(e.data);
+                document.getElementById('currentTrack').textContent = info.title ? `♪ ${info.title}` : '';
+                if (!info.supported) { nowPlayingSource.close(); nowPlayingSource = null; }
+            });
+        }
+        let currentStationData = null; let isPlaying = false; let stations = []; let favorites = []; let favoritesVersion = 0;
         document.addEventListener('DOMContentLoaded', function() { loadFavorites(); setupEventListeners(); loadPopularStations(); });
         function setupEventListeners() {
             document.getElementById('searchBtn').addEventListener('click', searchStations);
@@ -258,6 +542,10 @@ def home():
             document.getElementById('playBtn').addEventListener('click', togglePlay);
             document.getElementById('volumeSlider').addEventListener('input', setVolume);
             document.getElementById('searchInput').addEventListener('keypress', function(e) { if (e.key === 'Enter') searchStations(); });
+            document.getElementById('searchInput').addEventListener('input', function(e) {
+                clearTimeout(suggestTimer);
+                suggestTimer = setTimeout(() => loadSuggestions(e.target.value.trim()), 150);
+            });
             document.getElementById('stationsTab').addEventListener('click', () => switchTab('stations'));
             document.getElementById('favoritesTab').addEventListener('click', () => switchTab('favorites'));
             const audioPlayer = document.getElementById('audioPlayer');
@@ -280,6 +568,19 @@ def home():
                 document.getElementById('stationsContent').classList.remove('active');
             }
         }
+        let suggestTimer = null; let suggestController = null;
+        async function loadSuggestions(prefix) {
+            const list = document.getElementById('searchSuggestions');
+            if (!prefix) { list.innerHTML = ''; return; }
+            // Only the latest keystroke's request matters
+            if (suggestController) suggestController.abort();
+            suggestController = new AbortController();
+            try {
+                const response = await fetch(`${API_BASE}/api/stations/suggest?prefix=${encodeURIComponent(prefix)}`, { signal: suggestController.signal });
+                const data = await response.json();
+                list.innerHTML = data.suggestions.map(s => `<option value="${s.text.replace(/"/g, '&quot;')}">${s.type}</option>`).join('');
+            } catch (error) { if (error.name !== 'AbortError') console.log('Failed to load suggestions'); }
+        }
         async function searchStations() {
             const query = document.getElementById('searchInput').value.trim();
             if (!query) { showStatus('Please enter a search term'); return; }
@@ -313,6 +614,7 @@ def home():
         function renderStations(stationsList_data) {
             document.getElementById('stationsList').innerHTML = stationsList_data.map(station => `
                 <div class="station-item" onclick="selectStation('${station.uuid}')">
+                    ${station.favicon ? `<img class="station-icon" src="${station.favicon}" loading="lazy" alt="">` : ''}
                     <div class="station-details">
                         <h3>${station.name}</h3>
                         <p>${station.country} • ${station.language} • ${station.bitrate}k</p>
@@ -331,13 +633,12 @@ def home():
             currentStationData = station;
             document.getElementById('currentStation').textContent = station.name || station.station_name;
             document.getElementById('currentInfo').textContent = `${station.country} • ${station.language}`;
-            try {
-                await fetch(`${API_BASE}/api/stations/click`, {
-                    method: 'POST', headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ uuid: station.uuid || station.station_uuid })
-                });
-            } catch (error) { console.log('Failed to record click'); }
-            document.getElementById('audioPlayer').src = station.url || station.station_url;
+            watchNowPlaying(station.uuid || station.station_uuid);
+            fetch(`${API_BASE}/api/stations/click`, {
+                method: 'POST', headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ uuid: station.uuid || station.station_uuid, user_id: USER_ID })
+            }).catch(() => console.log('Failed to record click'));
+            document.getElementById('audioPlayer').src = streamUrl(station.uuid || station.station_uuid, station.url_resolved || station.url || station.station_url);
             document.getElementById('audioPlayer').load();
             showStatus('Station selected');
         }
@@ -380,8 +681,13 @@ def home():
         }
         async function loadFavorites() {
             try {
-                const response = await fetch(`${API_BASE}/api/favorites?user_id=${USER_ID}`);
-                const data = await response.json(); favorites = data.favorites || []; renderFavorites();
+                const response = await fetch(`${API_BASE}/api/favorites?user_id=${USER_ID}&since=${favoritesVersion}`);
+                const data = await response.json();
+                const changed = data.favorites || [];
+                const dropped = new Set((data.deleted || []).concat(changed.map(f => f.id)));
+                favorites = changed.concat(favorites.filter(f => !dropped.has(f.id)));
+                favorites.sort((a, b) => (b.added_date || '').localeCompare(a.added_date || ''));
+                favoritesVersion = data.version || favoritesVersion; renderFavorites();
             } catch (error) { console.log('Failed to load favorites'); }
         }
         function renderFavorites() {
@@ -390,6 +696,7 @@ def home():
             }
             document.getElementById('favoritesList').innerHTML = favorites.map(favorite => `
                 <div class="station-item" onclick="selectFavoriteStation('${favorite.station_uuid}')">
+                    ${favorite.favicon ? `<img class="station-icon" src="${favorite.favicon}" loading="lazy" alt="">` : ''}
                     <div class="station-details">
                         <h3>${favorite.station_name}</h3>
                         <p>${favorite.country} • ${favorite.language}</p>
@@ -403,10 +710,11 @@ def home():
         }
         function selectFavoriteStation(uuid) {
             const favorite = favorites.find(f => f.station_uuid === uuid); if (!favorite) return;
-            currentStationData = { uuid: favorite.station_uuid, name: favorite.station_name, url: favorite.station_url, country: favorite.country, language: favorite.language };
+            currentStationData = { uuid: favorite.station_uuid, name: favorite.station_name, url: favorite.station_url, url_resolved: favorite.url_resolved, country: favorite.country, language: favorite.language };
             document.getElementById('currentStation').textContent = favorite.station_name;
             document.getElementById('currentInfo').textContent = `${favorite.country} • ${favorite.language}`;
-            document.getElementById('audioPlayer').src = favorite.station_url; document.getElementById('audioPlayer').load();
+            watchNowPlaying(favorite.station_uuid);
+            document.getElementById('audioPlayer').src = streamUrl(favorite.station_uuid, favorite.url_resolved || favorite.station_url); document.getElementById('audioPlayer').load();
             showStatus('Favorite station selected');
         }
         async function removeFavorite(favoriteId) {
@@ -427,36 +735,33 @@ def home():
 </body>
 </html>'''
 
-@app.route('/manifest.json')
-def manifest():
-    return jsonify({
-        "name": "NERV9 RADIO",
-        "short_name": "NERV9",
-        "start_url": "/",
-        "display": "standalone",
-        "background_color": "#000000",
-        "theme_color": "#dc2626",
-        "icons": [
-            {
-                "src": "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMTkyIiBoZWlnaHQ9IjE5MiIgZmlsbD0ibm9uZSIgdmlld0JveD0iMCAwIDMyIDMyIj48cGF0aCBmaWxsPSIjZGMyNjI2IiBkPSJNMTYgMmExNCAxNCAwIDAgMC0xNCAxNHY2YTE1IDE1IDAgMCAwIDE1IDE1aDNhMTQgMTQgMCAwIDAgMTMtMTRWMTZBMTMgMTMgMCAwIDAgMzEgNEgxNmExNCAxNCAwIDAgMC0xNCAxNHYyYTE1IDE1IDAgMCAwIDE1IDE1aDNhMTQgMTQgMCAwIDAgMTMtMTRWMTZBMTYgMTYgMCAwIDAgMzEgNEgxNnoiLz48L3N2Zz4=",
-                "sizes": "192x192",
-                "type": "image/svg+xml"
-            },
-            {
-                "src": "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNTEyIiBoZWlnaHQ9IjUxMiIgZmlsbD0ibm9uZSIgdmlld0JveD0iMCAwIDMyIDMyIj48cGF0aCBmaWxsPSIjZGMyNjI2IiBkPSJNMTYgMmExNCAxNCAwIDAgMC0xNCAxNHY2YTE1IDE1IDAgMCAwIDE1IDE1aDNhMTQgMTQgMCAwIDAgMTMtMTRWMTZBMTMgMTMgMCAwIDAgMzEgNEgxNmExNCAxNCAwIDAgMC0xNCAxNHYyYTE1IDE1IDAgMCAwIDE1IDE1aDNhMTQgMTQgMCAwIDAgMTMtMTRWMTZBMTYgMTYgMCAwIDAgMzEgNEgxNnoiLz48L3N2Zz4=",
-                "sizes": "512x512",
-                "type": "image/svg+xml"
-            }
-        ]
-    })
+MANIFEST = {
+    "name": "NERV9 RADIO",
+    "short_name": "NERV9",
+    "start_url": "/",
+    "display": "standalone",
+    "background_color": "#000000",
+    "theme_color": "#dc2626",
+    "icons": [
+        {
+            "src": "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMTkyIiBoZWlnaHQ9IjE5MiIgZmlsbD0ibm9uZSIgdmlld0JveD0iMCAwIDMyIDMyIj48cGF0aCBmaWxsPSIjZGMyNjI2IiBkPSJNMTYgMmExNCAxNCAwIDAgMC0xNCAxNHY2YTE1IDE1IDAgMCAwIDE1IDE1aDNhMTQgMTQgMCAwIDAgMTMtMTRWMTZBMTMgMTMgMCAwIDAgMzEgNEgxNmExNCAxNCAwIDAgMC0xNCAxNHYyYTE1IDE1IDAgMCAwIDE1IDE1aDNhMTQgMTQgMCAwIDAgMTMtMTRWMTZBMTYgMTYgMCAwIDAgMzEgNEgxNnoiLz48L3N2Zz4=",
+            "sizes": "192x192",
+            "type": "image/svg+xml"
+        },
+        {
+            "src": "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNTEyIiBoZWlnaHQ9IjUxMiIgZmlsbD0ibm9uZSIgdmlld0JveD0iMCAwIDMyIDMyIj48cGF0aCBmaWxsPSIjZGMyNjI2IiBkPSJNMTYgMmExNCAxNCAwIDAgMC0xNCAxNHY2YTE1IDE1IDAgMCAwIDE1IDE1aDNhMTQgMTQgMCAwIDAgMTMtMTRWMTZBMTMgMTMgMCAwIDAgMzEgNEgxNmExNCAxNCAwIDAgMC0xNCAxNHYyYTE1IDE1IDAgMCAwIDE1IDE1aDNhMTQgMTQgMCAwIDAgMTMtMTRWMTZBMTYgMTYgMCAwIDAgMzEgNEgxNnoiLz48L3N2Zz4=",
+            "sizes": "512x512",
+            "type": "image/svg+xml"
+        }
+    ]
+}
 
-@app.route('/sw.js')
-def service_worker():
-    return '''
-const CACHE_NAME = 'nerv9-radio-v1';
+# Service worker; the cache name changes with every shell build so deploys evict old caches
+SERVICE_WORKER_JS = '''
+const CACHE_NAME = 'nerv9-radio-__SHELL_HASH__';
 const urlsToCache = [
     '/',
-    '/manifest.json'
+    '__MANIFEST_URL__'
 ];
 
 self.addEventListener('install', function(event) {
@@ -480,236 +785,554 @@ self.addEventListener('fetch', function(event) {
         )
     );
 });
-''', {'Content-Type': 'application/javascript'}
+
+self.addEventListener('activate', function(event) {
+    event.waitUntil(
+        caches.keys().then(function(names) {
+            return Promise.all(names
+                .filter(function(name) { return name !== CACHE_NAME; })
+                .map(function(name) { return caches.delete(name); }));
+        })
+    );
+});
+'''
+
+def build_shell():
+    """Encode the home page, manifest and service worker once, keyed by content hash"""
+    manifest_asset = StaticAsset(json.dumps(MANIFEST, separators=(',', ':')), 'application/manifest+json')
+    manifest_url = f"/manifest.{manifest_asset.etag}.json"
+    home_html = HOME_HTML.replace('__MANIFEST_URL__', manifest_url).replace('__RELAY__', 'true' if RELAY_ENABLED else 'false')
+    home_asset = StaticAsset(home_html, 'text/html; charset=utf-8')
+    shell_hash = content_hash(home_asset.etag.encode(), manifest_asset.etag.encode())
+    service_worker_asset = StaticAsset(
+        SERVICE_WORKER_JS.replace('__SHELL_HASH__', shell_hash).replace('__MANIFEST_URL__', manifest_url),
+        'application/javascript; charset=utf-8')
+    return {
+        'hash': shell_hash,
+        'home': home_asset,
+        'manifest': manifest_asset,
+        'service_worker': service_worker_asset
+    }
+
+SHELL = build_shell()
+
+@app.route('/')
+def home():
+    return SHELL['home'].response(request)
+
+@app.route('/manifest.json')
+def manifest():
+    return SHELL['manifest'].response(request)
+
+@app.route('/manifest.<digest>.json')
+def hashed_manifest(digest):
+    if digest != SHELL['manifest'].etag:
+        return jsonify({"error": "Unknown manifest version"}), 404
+    return SHELL['manifest'].response(request, cache_control=IMMUTABLE)
+
+@app.route('/sw.js')
+def service_worker():
+    return SHELL['service_worker'].response(request)
+
+def format_station(station):
+    """Convert a radio-browser station record into our API shape"""
+    return {
+        'uuid': station.get('stationuuid', ''),
+        'name': station.get('name', 'Unknown Station'),
+        'url': station.get('url', ''),
+        'country': station.get('country', ''),
+        'language': station.get('language', ''),
+        'tags': station.get('tags', ''),
+        'favicon': station.get('favicon', ''),
+        'bitrate': station.get('bitrate', 0),
+        'codec': station.get('codec', ''),
+        'votes': station.get('votes', 0)
+    }
+
+def fetch_stations(path, params):
+    """Fetch a station list from the best radio-browser server, hedging slow ones"""
+    try:
+        response = SERVERS.request(path, params, timeout=15, deadline=UPSTREAM_DEADLINE, hedge=True)
+        if response.status_code != 200:
+            raise UpstreamUnavailable(f"{path} returned {response.status_code}")
+        stations = response.json()
+    except (UpstreamUnavailable, ValueError) as e:
+        log.warning("Upstream request failed path=%s error=%r", path, str(e))
+        raise UpstreamUnavailable(str(e))
+    log.debug("Upstream answered path=%s stations=%d", path, len(stations))
+    
+    # Only include stations with working URLs
+    stations = [format_station(station) for station in stations
+                if station.get('url') and station.get('name')]
+    SNAPSHOT.merge(stations)
+    return stations
+
+def parse_station_uuid(value):
+    """``value`` as a lowercase station uuid, or None if it is not one"""
+    if not isinstance(value, str) or not STATION_UUID.fullmatch(value.lower()):
+        return None
+    return value.lower()
+
+def local_station(uuid):
+    """Find a station by uuid in recent results, the local mirror or the snapshot, without asking upstream"""
+    station = KNOWN_STATIONS.get(uuid)
+    if station is not None:
+        return station
+    if CATALOG.is_ready():
+        try:
+            station = CATALOG.get(uuid)
+        except sqlite3.Error:
+            station = None
+        if station is not None:
+            return station
+    return SNAPSHOT.get(uuid)
+
+def lookup_station(uuid):
+    """Find a station by uuid locally or, failing that, upstream"""
+    station = local_station(uuid)
+    if station is not None:
+        return station
+    try:
+        response = SERVERS.request('/json/stations/byuuid', {'uuids': uuid}, timeout=5, deadline=5)
+        if response.status_code != 200:
+            return None
+        stations = response.json()
+    except (UpstreamUnavailable, ValueError):
+        return None
+    if not stations:
+        return None
+    station = format_station(stations[0])
+    KNOWN_STATIONS.set(uuid, station)
+    return station
+
+def index_stations(stations):
+    """Remember stations by uuid and add them to the facet index"""
+    FACETS.upsert(stations)
+    for station in stations:
+        KNOWN_STATIONS.set(station['uuid'], station)
+
+def proxy_favicons(stations):
+    """Copies of ``stations`` with their favicons pointed at our proxy"""
+    return [dict(station, favicon=f"/api/favicon/{station['uuid']}") if station.get('favicon') else station
+            for station in stations]
+
+def publish_stations(stations):
+    """Remember and index stations by uuid, and point their favicons at our proxy"""
+    index_stations(stations)
+    return proxy_favicons(stations)
+
+def fuzzy_matches(query, limit, exclude=()):
+    """Typo-tolerant matches for ``query`` among the indexed stations"""
+    stations = []
+    for uuid, _ in TRIGRAMS.search(query, limit + len(exclude)):
+        if uuid in exclude:
+            continue
+        station = FACETS.get(uuid)
+        if station is not None:
+            stations.append(station)
+    return stations[:limit]
+
+def fetch_search_results(query, limit):
+    stations = None
+    if CATALOG.is_ready():
+        try:
+            stations = CATALOG.search(query, limit)
+        except sqlite3.Error as e:
+            log.error("Local catalog search failed error=%r", str(e))
+    
+    if stations is None:
+        # Use the search endpoint instead of byname
+        stations = fetch_stations('/json/stations/search', {
+            'name': query,
+            'limit': limit,
+            'hidebroken': 'true',
+            'order': 'votes',
+            'reverse': 'true'
+        })
+    
+    # Exact matches first, then close spellings ("bbc radoi") to fill the page
+    if len(stations) < limit:
+        stations += fuzzy_matches(query, limit - len(stations), {station['uuid'] for station in stations})
+    return stations
+
+def fetch_popular_stations(limit):
+    if CATALOG.is_ready():
+        try:
+            return CATALOG.popular(limit)
+        except sqlite3.Error as e:
+            log.error("Local catalog query failed error=%r", str(e))
+    
+    return fetch_stations('/json/stations/topvote', {
+        'limit': limit,
+        'hidebroken': 'true'
+    })
+
+def apply_stream_health(stations, uuid_key='uuid'):
+    """Honor ?healthy=1 (drop streams whose last probe failed) and ?sort=startup"""
+    return PROBER.filter_and_rank(stations, uuid_key,
+                                  drop_dead=request.args.get('healthy') == '1',
+                                  rank=request.args.get('sort') == 'startup')
+
+def with_facets(payload, matches):
+    """Add facet counts over the ``matches`` bitmap when ?facets=1"""
+    if request.args.get('facets') == '1':
+        payload['facets'] = FACETS.facets(matches)
+    return payload
+
+def cache_key(endpoint, query='', limit=0):
+    """Normalize a station query into a cache key"""
+    return (endpoint, ' '.join(query.lower().split()), limit)
+
+def station_loader(key):
+    """Function fetching the stations for a cache key, sharing concurrent fetches"""
+    endpoint, query, limit = key
+    if endpoint == 'search':
+        fetch = lambda: fetch_search_results(query, limit)
+    else:
+        fetch = lambda: fetch_popular_stations(limit)
+    return lambda: STATION_FLIGHTS.do(key, fetch)
+
+# Loads the popular lists and the most requested queries before the app reports
+# ready, then refreshes them ahead of expiry
+WARMER = Warmer(
+    STATION_CACHE, station_loader, probe=SERVERS.probe,
+    popular_limits=[int(limit) for limit in os.environ.get('NERV9_WARMUP_POPULAR_LIMITS', '20,50,100').split(',')],
+    top_queries=int(os.environ.get('NERV9_WARMUP_TOP_QUERIES', 50)),
+    max_rows=int(os.environ.get('NERV9_HOT_QUERIES_MAX_ROWS', 5000)),
+    timeout=float(os.environ.get('NERV9_WARMUP_TIMEOUT', 30)),
+    refresh_ahead=float(os.environ.get('NERV9_REFRESH_AHEAD', 0.2)),
+    jitter=float(os.environ.get('NERV9_REFRESH_JITTER', 0.1))
+)
+
+# Largest station list one request may ask for
+MAX_STATIONS_LIMIT = 500
+
+def limit_from_args(default, maximum=MAX_STATIONS_LIMIT):
+    """?limit= clamped to 1..maximum, so no request can fetch (and cache) the whole catalog"""
+    return max(1, min(request.args.get('limit', default, type=int), maximum))
 
 @app.route('/api/stations/search', methods=['GET'])
 def search_stations():
     """Search radio stations"""
     query = request.args.get('q', '')
-    limit = request.args.get('limit', 50, type=int)
+    limit = limit_from_args(50)
+    filters = filters_from_args(request.args)
     
     if not query:
         return jsonify({"error": "Search query required"}), 400
     
-    servers = get_radio_browser_servers()
-    print(f"🔍 Searching for '{query}' on {len(servers)} servers...")
+    try:
+        # Filtering discards matches, so fetch a deeper list to fill the page
+        fetch_limit = min(limit * 5, MAX_STATIONS_LIMIT) if filters else limit
+        key = cache_key('search', query, fetch_limit)
+        WARMER.record(key)
+        formatted_stations = STATION_CACHE.get_or_load(key, station_loader(key))
+        formatted_stations = proxy_favicons(FACETS.restrict(formatted_stations, filters)[:limit])
+        formatted_stations = RESOLVER.annotate(apply_stream_health(formatted_stations))
+        log.debug("search query=%r results=%d", query, len(formatted_stations))
+        return jsonify(with_facets({
+            "stations": formatted_stations,
+            "count": len(formatted_stations)
+        }, FACETS.select_uuids(station['uuid'] for station in formatted_stations)))
+    except UpstreamUnavailable:
+        pass
     
-    for i, server in enumerate(servers):
-        try:
-            print(f"⏳ Trying server {i+1}: {server}")
-            
-            # Use the search endpoint instead of byname
-            url = f"{server}/json/stations/search"
-            params = {
-                'name': query,
-                'limit': limit,
-                'hidebroken': 'true',
-                'order': 'votes',
-                'reverse': 'true'
-            }
-            
-            response = requests.get(url, headers=HEADERS, params=params, timeout=15)
-            print(f"📡 Response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                stations = response.json()
-                print(f"✅ Found {len(stations)} stations")
-                
-                # Clean and format the response
-                formatted_stations = []
-                for station in stations:
-                    # Only include stations with working URLs
-                    if station.get('url') and station.get('name'):
-                        formatted_stations.append({
-                            'uuid': station.get('stationuuid', ''),
-                            'name': station.get('name', 'Unknown Station'),
-                            'url': station.get('url', ''),
-                            'country': station.get('country', ''),
-                            'language': station.get('language', ''),
-                            'tags': station.get('tags', ''),
-                            'favicon': station.get('favicon', ''),
-                            'bitrate': station.get('bitrate', 0),
-                            'codec': station.get('codec', ''),
-                            'votes': station.get('votes', 0)
-                        })
-                
-                print(f"🎵 Returning {len(formatted_stations)} valid stations")
-                return jsonify({
-                    "stations": formatted_stations,
-                    "count": len(formatted_stations)
-                })
-                
-        except Exception as e:
-            print(f"❌ Server {server} failed: {str(e)}")
-            continue
-    
-    # Fallback to searching backup stations if API is down
-    print(f"🔄 Radio-browser.info is down, searching backup stations for '{query}'")
-    query_lower = query.lower()
-    matching_stations = []
-    
-    for station in BACKUP_STATIONS:
-        if (query_lower in station['name'].lower() or 
-            query_lower in station['tags'].lower()):
-            matching_stations.append(station)
-    
-    if not matching_stations:
-        # If no matches, return all backup stations
-        matching_stations = BACKUP_STATIONS
+    # Fallback to the last-known-good snapshot if API is down
+    log.info("Upstream down, searching the station snapshot query=%r", query)
+    fetch_limit = min(limit * 5, MAX_STATIONS_LIMIT) if filters else limit
+    matching_stations = SNAPSHOT.search(query, fetch_limit)
+    if len(matching_stations) < fetch_limit:
+        matching_stations += fuzzy_matches(query, fetch_limit - len(matching_stations),
+                                           {station['uuid'] for station in matching_stations})
+    matching_stations = publish_stations([station for station in matching_stations
+                                          if station_matches(station, filters)])
     
+    matching_stations = RESOLVER.annotate(apply_stream_health(matching_stations))
     result_limit = min(limit, len(matching_stations))
     return jsonify({
         "stations": matching_stations[:result_limit],
         "count": result_limit
     })
 
+@app.route('/api/stations/suggest', methods=['GET'])
+def suggest_stations():
+    """Typeahead completions for ?prefix=, weighted by votes"""
+    prefix = request.args.get('prefix', '')
+    limit = limit_from_args(10, SUGGEST.k)
+    response = jsonify({"prefix": prefix, "suggestions": SUGGEST.suggest(prefix, limit)})
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
 @app.route('/api/stations/popular', methods=['GET'])
 def popular_stations():
     """Get popular stations"""
-    limit = request.args.get('limit', 20, type=int)
+    limit = limit_from_args(20)
+    filters = filters_from_args(request.args)
     
-    servers = get_radio_browser_servers()
-    print(f"🔥 Loading popular stations from {len(servers)} servers...")
+    if filters and len(FACETS):
+        # Filtered listings come straight from the in-memory index
+        matches = FACETS.select(filters)
+        formatted_stations = RESOLVER.annotate(apply_stream_health(publish_stations(FACETS.top(matches, limit))))
+        return jsonify(with_facets({
+            "stations": formatted_stations,
+            "count": len(formatted_stations),
+            "total": matches.bit_count()
+        }, matches))
     
-    for i, server in enumerate(servers):
-        try:
-            print(f"⏳ Trying server {i+1}: {server}")
-            url = f"{server}/json/stations/topvote"
-            params = {
-                'limit': limit,
-                'hidebroken': 'true'
-            }
-            
-            response = requests.get(url, headers=HEADERS, params=params, timeout=15)
-            print(f"📡 Response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                stations = response.json()
-                print(f"✅ Found {len(stations)} popular stations")
-                
-                formatted_stations = []
-                for station in stations:
-                    if station.get('url') and station.get('name'):
-                        formatted_stations.append({
-                            'uuid': station.get('stationuuid', ''),
-                            'name': station.get('name', 'Unknown Station'),
-                            'url': station.get('url', ''),
-                            'country': station.get('country', ''),
-                            'language': station.get('language', ''),
-                            'tags': station.get('tags', ''),
-                            'favicon': station.get('favicon', ''),
-                            'bitrate': station.get('bitrate', 0),
-                            'codec': station.get('codec', ''),
-                            'votes': station.get('votes', 0)
-                        })
-                
-                print(f"🎵 Returning {len(formatted_stations)} valid stations")
-                return jsonify({
-                    "stations": formatted_stations,
-                    "count": len(formatted_stations)
-                })
-                
-        except Exception as e:
-            print(f"❌ Server {server} failed: {str(e)}")
-            continue
+    try:
+        key = cache_key('popular', limit=limit)
+        WARMER.record(key)
+        formatted_stations = proxy_favicons(STATION_CACHE.get_or_load(key, station_loader(key)))
+        formatted_stations = RESOLVER.annotate(apply_stream_health(formatted_stations))
+        log.debug("popular results=%d", len(formatted_stations))
+        return jsonify(with_facets({
+            "stations": formatted_stations,
+            "count": len(formatted_stations)
+        }, FACETS.select_uuids(station['uuid'] for station in formatted_stations)))
+    except UpstreamUnavailable:
+        pass
     
-    # Fallback to backup stations if API is down
-    print("🔄 Radio-browser.info is down, using backup stations")
-    backup_limit = min(limit, len(BACKUP_STATIONS))
+    # Fallback to the last-known-good snapshot if API is down
+    log.info("Upstream down, serving popular stations from the snapshot")
+    snapshot_stations = publish_stations([station for station in SNAPSHOT.popular(min(limit * 5, MAX_STATIONS_LIMIT) if filters else limit)
+                                          if station_matches(station, filters)])
+    snapshot_stations = RESOLVER.annotate(apply_stream_health(snapshot_stations))
+    snapshot_limit = min(limit, len(snapshot_stations))
     return jsonify({
-        "stations": BACKUP_STATIONS[:backup_limit],
-        "count": backup_limit
+        "stations": snapshot_stations[:snapshot_limit],
+        "count": snapshot_limit
     })
 
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Station cache hit/miss/stale counters"""
+    stats = STATION_CACHE.stats()
+    if SHARED_CACHE is not None:
+        stats['shared'] = SHARED_CACHE.stats()
+    return jsonify(stats)
+
+@app.route('/api/warmup/stats', methods=['GET'])
+def warmup_stats():
+    """Startup time, warm-up coverage and scheduled refresh lag of the station cache"""
+    return jsonify(WARMER.stats())
+
+@app.route('/api/upstream/stats', methods=['GET'])
+def upstream_stats():
+    """Upstream request latency, connection reuse and request coalescing"""
+    return jsonify(dict(UPSTREAM.stats_snapshot(), singleflight=STATION_FLIGHTS.stats()))
+
+@app.route('/api/upstream/servers', methods=['GET'])
+def upstream_servers():
+    """Per-mirror latency, error rate and breaker state"""
+    return jsonify(SERVERS.stats())
+
+@app.route('/api/responses/stats', methods=['GET'])
+def response_stats():
+    """JSON encode time, payload sizes and compression ratio for /api/* responses"""
+    return jsonify(responses.STATS.snapshot())
+
+@app.route('/api/favicon/stats', methods=['GET'])
+def favicon_stats():
+    """Favicon cache hits, fetches, failures and disk usage"""
+    return jsonify(dict(FAVICONS.stats(), http=FAVICON_HOSTS.stats_snapshot()))
+
+@app.route('/api/streams/health/stats', methods=['GET'])
+def stream_health_stats():
+    """Stream prober coverage and cycle timings"""
+    return jsonify(PROBER.stats())
+
+@app.route('/api/streams/resolver/stats', methods=['GET'])
+def stream_resolver_stats():
+    """Stream URL resolution cache and background queue counters"""
+    return jsonify(dict(RESOLVER.stats(), http=STREAM_HOSTS.stats_snapshot()))
+
+def streams_full():
+    """503 for a streaming request beyond this process's STREAM_SLOTS"""
+    return jsonify({"error": "Too many open streams on this worker, try again later"}), 503, {'Retry-After': '30'}
+
+@app.route('/api/stream/<uuid>', methods=['GET'])
+def relay_stream(uuid):
+    """Station audio through the shared fan-out relay"""
+    if not RELAY_ENABLED:
+        return jsonify({"error": "Stream relay is disabled"}), 404
+    uuid = parse_station_uuid(uuid)
+    if uuid is None:
+        return jsonify({"error": "Invalid station UUID"}), 400
+    
+    station = lookup_station(uuid)
+    if not station or not station.get('url'):
+        return jsonify({"error": "Unknown station"}), 404
+    
+    if not STREAM_SLOTS.acquire():
+        return streams_full()
+    try:
+        upstream_headers, chunks = RELAY.listen(uuid, RESOLVER.peek(uuid, station['url']) or station['url'])
+    except RelayError as e:
+        STREAM_SLOTS.release()
+        return jsonify({"error": f"Stream unavailable: {str(e)}"}), 502
+    
+    headers = dict(upstream_headers, **{'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+    return Response(STREAM_SLOTS.wrap(chunks), headers=headers, direct_passthrough=True)
+
+
+@app.route('/api/stream/stats', methods=['GET'])
+def relay_stats():
+    """Relayed stations, listeners and byte counters"""
+    return jsonify(dict(RELAY.stats(), enabled=RELAY_ENABLED, slots=STREAM_SLOTS.stats()))
+
+@app.route('/api/nowplaying/stream', methods=['GET'])
+def now_playing_stream():
+    """Server-Sent Events with the current track title of ?uuid=<station>"""
+    uuid = parse_station_uuid(request.args.get('uuid', ''))
+    if uuid is None:
+        return jsonify({"error": "Invalid station UUID"}), 400
+    station = lookup_station(uuid)
+    if not station or not station.get('url'):
+        return jsonify({"error": "Unknown station"}), 404
+    
+    if not STREAM_SLOTS.acquire():
+        return streams_full()
+    url = RESOLVER.peek(uuid, station['url']) or station['url']
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(STREAM_SLOTS.wrap(NOW_PLAYING.subscribe(uuid, url)), mimetype='text/event-stream', headers=headers)
+
+@app.route('/api/nowplaying/stats', methods=['GET'])
+def now_playing_stats():
+    """Active metadata pollers, subscribers and title changes"""
+    return jsonify(dict(NOW_PLAYING.stats(), slots=STREAM_SLOTS.stats()))
+
+@app.route('/api/stations/index/stats', methods=['GET'])
+def station_index_stats():
+    """Size, memory per station and rebuild timings of the facet index"""
+    return jsonify(FACETS.stats())
+
+@app.route('/api/stations/suggest/stats', methods=['GET'])
+def suggest_stats():
+    """Size and rebuild timings of the completion index"""
+    return jsonify(SUGGEST.stats())
+
+@app.route('/api/stations/fuzzy/stats', methods=['GET'])
+def fuzzy_stats():
+    """Size and rebuild timings of the trigram index"""
+    return jsonify(TRIGRAMS.stats())
+
+@app.route('/api/stations/snapshot/stats', methods=['GET'])
+def snapshot_stats():
+    """Size, age and flush counters of the last-known-good snapshot"""
+    return jsonify(SNAPSHOT.stats())
+
+@app.route('/api/catalog/stats', methods=['GET'])
+def catalog_stats():
+    """Local station mirror size and sync status"""
+    return jsonify(CATALOG.stats())
+
 @app.route('/api/stations/click', methods=['POST'])
 def click_station():
-    """Record a station click to radio-browser.info"""
-    data = request.get_json()
+    """Queue a station click for radio-browser.info"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
     station_uuid = data.get('uuid')
     
     if not station_uuid:
         return jsonify({"error": "Station UUID required"}), 400
+    if not isinstance(station_uuid, str) or not STATION_UUID.fullmatch(station_uuid.lower()):
+        return jsonify({"error": "Invalid station UUID"}), 400
+    station_uuid = station_uuid.lower()
+    # Only stations this server has listed are sent upstream, so clients cannot relay arbitrary ids
+    station = local_station(station_uuid)
+    if station is None:
+        return jsonify({"error": "Unknown station"}), 404
     
-    servers = get_radio_browser_servers()
-    
-    for server in servers:
-        try:
-            url = f"{server}/json/url/{station_uuid}"
-            response = requests.get(url, headers=HEADERS, timeout=5)
-            
-            if response.status_code == 200:
-                return jsonify({"success": True, "message": "Click recorded"})
-                
-        except Exception as e:
-            continue
+    status = CLICKS.submit(data.get('user_id') or request.remote_addr, station_uuid)
+    # A play is a good moment to re-check where the stream actually lives
+    RESOLVER.refresh(station_uuid, station['url'])
+    if status == FULL:
+        return jsonify({"success": False, "message": "Click queue full, try again later"}), 503, {'Retry-After': '5'}
+    if status == DUPLICATE:
+        return jsonify({"success": True, "message": "Click already recorded"}), 202
+    return jsonify({"success": True, "message": "Click queued"}), 202
+
+@app.route('/api/stations/click/stats', methods=['GET'])
+def click_stats():
+    """Click queue depth, dedupe and drop counters"""
+    return jsonify(CLICKS.stats())
+
+@app.route('/api/favicon/<uuid>', methods=['GET'])
+def station_favicon(uuid):
+    """Station icon as a small cached thumbnail, or a placeholder"""
+    # Checked first: every unknown uuid costs an upstream lookup
+    uuid = parse_station_uuid(uuid)
+    if uuid is None:
+        return jsonify({"error": "Invalid station UUID"}), 400
+    station = lookup_station(uuid)
+    icon = FAVICONS.get(uuid, station.get('favicon', '') if station else '')
+    if icon is None:
+        return FAVICON_PLACEHOLDER.response(request, cache_control='public, max-age=3600')
     
-    return jsonify({"success": False, "message": "Unable to record click"})
+    body, content_type, digest = icon
+    headers = {'Cache-Control': 'public, max-age=604800'}
+    if request.if_none_match.contains_weak(digest[:32]):
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(body, content_type=content_type, headers=headers)
+    response.set_etag(digest[:32])
+    return response
 
 @app.route('/api/favorites', methods=['GET'])
 def get_favorites():
-    """Get user favorites"""
+    """Get user favorites, or only the changes after ?since=<version>"""
     user_id = request.args.get('user_id', 'default_user')
+    since = request.args.get('since', type=int)
     
-    conn = sqlite3.connect('nerv9_radio.db')
-    c = conn.cursor()
-    
-    c.execute("SELECT * FROM favorites WHERE user_id=? ORDER BY added_date DESC", (user_id,))
-    favorites = c.fetchall()
-    
-    conn.close()
-    
-    formatted_favorites = []
-    for fav in favorites:
-        formatted_favorites.append({
-            'id': fav[0],
-            'station_uuid': fav[2],
-            'station_name': fav[3],
-            'station_url': fav[4],
-            'country': fav[5],
-            'language': fav[6],
-            'tags': fav[7],
-            'favicon': fav[8],
-            'added_date': fav[9]
+    # The per-user version changes on every write, so it doubles as the ETag
+    version = FAVORITES.version(user_id)
+    etag = f"fav-{version}" if since is None else f"fav-{version}-since-{since}"
+    if request.args.get('healthy') or request.args.get('sort'):
+        # Filtered listings change with probe results, not just with writes
+        etag += f"-{request.args.get('healthy', '')}-{request.args.get('sort', '')}-{PROBER.cycles}"
+    # Weak comparison, since a compressed response carries a weak ETag
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    elif since is None:
+        formatted_favorites = RESOLVER.annotate(apply_stream_health(FAVORITES.list(user_id), 'station_uuid'),
+                                                'station_uuid', 'station_url')
+        response = jsonify({
+            "favorites": formatted_favorites,
+            "count": len(formatted_favorites),
+            "version": version
+        })
+    else:
+        changed, deleted = FAVORITES.changes(user_id, since)
+        changed = RESOLVER.annotate(changed, 'station_uuid', 'station_url')
+        response = jsonify({
+            "favorites": changed,
+            "deleted": deleted,
+            "count": len(changed),
+            "version": version
         })
     
-    return jsonify({
-        "favorites": formatted_favorites,
-        "count": len(formatted_favorites)
-    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/favorites', methods=['POST'])
 def add_favorite():
     """Add station to favorites"""
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
     user_id = data.get('user_id', 'default_user')
+    if not isinstance(user_id, str):
+        return jsonify({"error": "user_id must be a string"}), 400
     
-    required_fields = ['station_uuid', 'station_name', 'station_url']
-    for field in required_fields:
-        if not data.get(field):
-            return jsonify({"error": f"{field} is required"}), 400
-    
-    conn = sqlite3.connect('nerv9_radio.db')
-    c = conn.cursor()
+    error = validate_favorite(data)
+    if error:
+        return jsonify({"error": error}), 400
     
-    # Check if already exists
-    c.execute("SELECT id FROM favorites WHERE user_id=? AND station_uuid=?", 
-              (user_id, data['station_uuid']))
-    
-    if c.fetchone():
-        conn.close()
+    if not FAVORITES.add(user_id, data):
         return jsonify({"error": "Station already in favorites"}), 409
     
-    # Add new favorite
-    c.execute("""INSERT INTO favorites 
-                 (user_id, station_uuid, station_name, station_url, country, language, tags, favicon, added_date)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-              (user_id, data['station_uuid'], data['station_name'], data['station_url'],
-               data.get('country', ''), data.get('language', ''), data.get('tags', ''),
-               data.get('favicon', ''), datetime.now().isoformat()))
-    
-    conn.commit()
-    conn.close()
-    
     return jsonify({"success": True, "message": "Station added to favorites"})
 
 @app.route('/api/favorites/<int:favorite_id>', methods=['DELETE'])
@@ -717,41 +1340,268 @@ def remove_favorite(favorite_id):
     """Remove station from favorites"""
     user_id = request.args.get('user_id', 'default_user')
     
-    conn = sqlite3.connect('nerv9_radio.db')
-    c = conn.cursor()
+    if not FAVORITES.remove(user_id, favorite_id):
+        return jsonify({"error": "Favorite not found"}), 404
     
-    c.execute("DELETE FROM favorites WHERE id=? AND user_id=?", (favorite_id, user_id))
+    return jsonify({"success": True, "message": "Favorite removed"})
+
+@app.route('/api/favorites/batch', methods=['POST'])
+def add_favorites_batch():
+    """Add many stations to favorites in one transaction"""
+    if request.mimetype == 'application/x-ndjson':
+        # Accepts the output of /api/favorites/export as-is
+        user_id = request.args.get('user_id', 'default_user')
+        try:
+            items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            return jsonify({"error": "Invalid NDJSON body"}), 400
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        user_id = data.get('user_id', 'default_user')
+        items = data.get('favorites')
     
-    if c.rowcount == 0:
-        conn.close()
-        return jsonify({"error": "Favorite not found"}), 404
+    if not isinstance(user_id, str):
+        return jsonify({"error": "user_id must be a string"}), 400
+    if not isinstance(items, list):
+        return jsonify({"error": "favorites must be an array"}), 400
+    if len(items) > MAX_FAVORITES_BATCH:
+        return jsonify({"error": f"At most {MAX_FAVORITES_BATCH} favorites per batch"}), 413
     
-    conn.commit()
-    conn.close()
+    results = FAVORITES.add_many(user_id, items)
+    return jsonify({
+        "success": True,
+        "added": sum(1 for result in results if result["status"] == ADDED),
+        "results": results
+    })
+
+@app.route('/api/favorites/batch', methods=['DELETE'])
+def remove_favorites_batch():
+    """Remove many favorites in one transaction"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    user_id = data.get('user_id', 'default_user')
+    ids = data.get('ids')
     
-    return jsonify({"success": True, "message": "Favorite removed"})
+    if not isinstance(ids, list) or not all(isinstance(favorite_id, int) for favorite_id in ids):
+        return jsonify({"error": "ids must be an array of integers"}), 400
+    if len(ids) > MAX_FAVORITES_BATCH:
+        return jsonify({"error": f"At most {MAX_FAVORITES_BATCH} favorites per batch"}), 413
+    
+    results = FAVORITES.remove_many(user_id, ids)
+    return jsonify({
+        "success": True,
+        "removed": sum(1 for result in results if result["status"] == REMOVED),
+        "results": results
+    })
+
+@app.route('/api/favorites/export', methods=['GET'])
+def export_favorites():
+    """Stream user favorites as NDJSON or CSV"""
+    user_id = request.args.get('user_id', 'default_user')
+    export_format = request.args.get('format', 'ndjson')
+    
+    if export_format == 'csv':
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            for favorite in FAVORITES.iter_export(user_id):
+                writer.writerow(favorite)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        mimetype = 'text/csv'
+    elif export_format == 'ndjson':
+        def generate():
+            for favorite in FAVORITES.iter_export(user_id):
+                yield json.dumps(favorite) + '\n'
+        mimetype = 'application/x-ndjson'
+    else:
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="nerv9-favorites.{export_format}"'
+    })
+
+def collect_gauges():
+    """Point-in-time values for /api/metrics"""
+    cache = STATION_CACHE.stats()
+    warmup = WARMER.stats()
+    return [
+        ('nerv9_upstream_breaker_open', 'gauge', 'Whether the circuit breaker of a radio-browser.info server is open',
+         [({'server': url}, int(state == OPEN)) for url, state in SERVERS.breaker_states().items()]),
+        ('nerv9_station_cache_lookups_total', 'counter', 'Station cache lookups by result',
+         [({'result': result}, cache[result]) for result in ('hits', 'shared_hits', 'misses', 'stale')]),
+        ('nerv9_station_index_stations', 'gauge', 'Stations in the in-memory index', [({}, len(FACETS))]),
+        ('nerv9_snapshot_stations', 'gauge', 'Stations in the last-known-good snapshot', [({}, len(SNAPSHOT))]),
+        ('nerv9_click_queue_depth', 'gauge', 'Clicks waiting to be sent upstream',
+         [({}, CLICKS.stats()['queue_depth'])]),
+        ('nerv9_warmup_ready', 'gauge', 'Whether the startup cache warm-up has finished', [({}, int(warmup['ready']))]),
+        ('nerv9_warmup_coverage', 'gauge', 'Share of hot station lists loaded by the warm-up',
+         [({}, warmup['coverage'] or 0)]),
+        ('nerv9_warmup_startup_seconds', 'gauge', 'Seconds from import to the end of the warm-up',
+         [({}, warmup['startup_seconds'] or 0)])
+    ]
+
+metrics.REGISTRY.add_collector(collect_gauges)
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Latency histograms and counters in Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics/slow', methods=['GET'])
+def slow_requests():
+    """Recent sampled requests slower than NERV9_SLOW_REQUEST_SECONDS, with their upstream and DB spans"""
+    return jsonify({"threshold_seconds": metrics.TRACES.threshold, "requests": metrics.TRACES.recent()})
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Readiness: the database answers and stations can be served from upstream, the mirror or the snapshot"""
+    checks = {}
+    started = time.perf_counter()
+    try:
+        db.get_connection().execute('SELECT 1').fetchone()
+        checks['database'] = {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+    except sqlite3.Error as e:
+        checks['database'] = {"ok": False, "error": str(e)}
+    
+    breakers = SERVERS.breaker_states()
+    # Before discovery there is nothing to judge by, so assume upstream is reachable
+    upstream_ok = not breakers or any(state != OPEN for state in breakers.values())
+    checks['upstream'] = {"ok": upstream_ok, "breakers": breakers}
+    checks['catalog'] = {"ok": CATALOG.is_ready()}
+    checks['snapshot'] = {"ok": len(SNAPSHOT) > 0, "stations": len(SNAPSHOT)}
+    warmup = WARMER.stats()
+    checks['warmup'] = {"ok": warmup['ready'], "coverage": warmup['coverage']}
+    
+    can_serve = upstream_ok or checks['catalog']['ok'] or checks['snapshot']['ok']
+    # Not ready until the hot station lists are cached, so no user waits on a cold fetch
+    ready = checks['database']['ok'] and can_serve and checks['warmup']['ok']
+    if not ready:
+        status = "unhealthy"
+    elif upstream_ok:
+        status = "healthy"
+    else:
+        status = "degraded"
     return jsonify({
-        "status": "healthy",
+        "status": status,
+        "ready": ready,
+        "checks": checks,
         "timestamp": datetime.now().isoformat(),
         "service": "NERV9 Radio Backend"
-    })
+    }), 200 if ready else 503
 
-if __name__ == '__main__':
-    # Initialize database
+# Held for the life of the process by the one worker that syncs the catalog and probes streams
+LEADER_LOCK_PATH = os.environ.get('NERV9_LEADER_LOCK_PATH', f"{db.DB_PATH}.leader")
+_leader_lock = None
+_jobs_lock = threading.Lock()
+_jobs_started = False
+
+def try_become_leader():
+    """Take the host-wide leader lock without waiting; True if this process holds it"""
+    global _leader_lock
+    if _leader_lock is not None:
+        return True
+    if fcntl is None:
+        _leader_lock = True
+        return True
+    lock_file = open(LEADER_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _leader_lock = lock_file
+    return True
+
+def start_leader_jobs():
+    # Keep the local station mirror in sync with radio-browser.info
+    if os.environ.get('NERV9_CATALOG_SYNC', '1') == '1':
+        CATALOG.start_background_sync(
+            interval=int(os.environ.get('NERV9_CATALOG_SYNC_INTERVAL', 600)),
+            full_interval=int(os.environ.get('NERV9_CATALOG_FULL_SYNC_INTERVAL', 86400)))
+    
+    # Probe station streams in the background
+    if os.environ.get('NERV9_PROBER', '1') == '1':
+        PROBER.start()
+
+def start_following(interval=30):
+    """Pick up the leader's catalog syncs and probe results, and take over if it exits"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                if try_become_leader():
+                    log.info("Took over as leader worker pid=%d", os.getpid())
+                    start_leader_jobs()
+                    return
+                if CATALOG.changed_elsewhere():
+                    load_station_index()
+                PROBER.reload()
+            except Exception:
+                log.exception("Following the leader worker failed")
+    
+    thread = threading.Thread(target=run, name='leader-follow', daemon=True)
+    thread.start()
+    return thread
+
+def start_background_jobs():
+    """Prepare storage and indexes and start background work; once per process, any server"""
+    global _jobs_started
+    # Held throughout, so concurrent first requests wait for the tables instead of racing past
+    with _jobs_lock:
+        if _jobs_started:
+            return
+        _start_background_jobs()
+        _jobs_started = True
+
+def _start_background_jobs():
     init_db()
+    # The backups only seed a snapshot file on first start
+    SNAPSHOT.load(seed=BACKUP_STATIONS)
+    SNAPSHOT.start_background_flush(interval=int(os.environ.get('NERV9_SNAPSHOT_FLUSH_INTERVAL', 60)))
+    load_station_index()
+    CATALOG.changed_elsewhere()
+    start_search_index_rebuilds(interval=int(os.environ.get('NERV9_SEARCH_INDEX_REBUILD_INTERVAL', 60)))
     
-    # Get port from environment variable (for deployment) or default to 5000
-    port = int(os.environ.get('PORT', 5000))
+    # With several workers only one syncs and probes; the others follow its results
+    if try_become_leader():
+        start_leader_jobs()
+    else:
+        start_following(interval=int(os.environ.get('NERV9_FOLLOW_INTERVAL', 30)))
     
-    # Run the server
-    print("🎵 NERV9 RADIO Backend Starting...")
-    print("📡 Checking radio-browser.info connectivity...")
+    if STREAM_SLOTS.limit is not None:
+        log.warning("Threaded server: each relay listener and now-playing subscriber holds a request thread, "
+                    "so at most %d streams are served per process; raise --threads or NERV9_MAX_STREAMS for more",
+                    STREAM_SLOTS.limit)
     
-    servers = get_radio_browser_servers()
-    print(f"✅ Found {len(servers)} radio-browser.info servers")
+    servers = SERVERS.discover()
+    SERVERS.start_background_discovery()
+    # Every process warms its own cache; with a shared one, whoever loads a key first fills it for the rest
+    if os.environ.get('NERV9_WARMUP', '1') == '1':
+        WARMER.start()
+    else:
+        WARMER.ready.set()
+    log.info("Background jobs started pid=%d leader=%s servers=%d",
+             os.getpid(), _leader_lock is not None, len(servers))
+
+@app.before_request
+def ensure_background_jobs():
+    # serve.py and __main__ start the jobs up front; any other WSGI server
+    # (e.g. plain `gunicorn app:app`) gets them on its first request
+    if not _jobs_started:
+        start_background_jobs()
+
+if __name__ == '__main__':
+    # Development server; use serve.py in production
+    start_background_jobs()
     
-    app.run(host='0.0.0.0', port=port, debug=False)
+    # Get port from environment variable (for deployment) or default to 5000
+    port = int(os.environ.get('PORT', 5000))
+    log.info("NERV9 RADIO Backend starting port=%d", port)
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
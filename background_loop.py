@@ -0,0 +1,22 @@
+"""Shared asyncio event loop for background I/O, run in a daemon thread"""
+import asyncio
+import threading
+
+_lock = threading.Lock()
+_loop = None
+
+
+def get_loop():
+    """Return the background loop, starting its thread on first use"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='asyncio-background', daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def submit(coro):
+    """Schedule ``coro`` on the background loop; returns a concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
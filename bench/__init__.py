@@ -0,0 +1 @@
+"""Load-testing harness: a local radio-browser.info stand-in and a load driver"""
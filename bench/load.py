@@ -0,0 +1,326 @@
+"""Load driver for the backend: throughput and latency percentiles per route and concurrency.
+
+Against a running backend:
+
+    python -m bench.load --base-url http://127.0.0.1:5000 --concurrency 1,8,32 --duration 10 --out results.json
+
+Fully self-contained: start the stub radio-browser and the backend (with a
+throwaway database) as subprocesses, run, and stop them:
+
+    python -m bench.load --spawn --stub-latency-ms 40 --out results.json
+
+Compare two result files; exits 1 if any scenario regressed:
+
+    python -m bench.load --compare baseline.json results.json --tolerance 0.10
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+from bench.stub_server import WORDS
+
+SCENARIOS = ('search', 'popular', 'click', 'favorites')
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Client:
+    """One keep-alive connection, reopened after errors"""
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.timeout = timeout
+        self._conn = None
+
+    def request(self, method, path, body=None):
+        """(status, parsed JSON or None)"""
+        if self._conn is None:
+            self._conn = self.connection_class(self.host, self.port, timeout=self.timeout)
+        headers = {'Accept-Encoding': 'identity'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self._conn.request(method, path, body=body, headers=headers)
+            response = self._conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self._conn.close()
+            self._conn = None
+            raise
+        payload = None
+        if response.getheader('Content-Type', '').startswith('application/json'):
+            payload = json.loads(data)
+        return response.status, payload
+
+
+class Workload:
+    """Request sequences for each scenario, deterministic for a given seed"""
+
+    def __init__(self, seed=9):
+        self.seed = seed
+        self.click_uuids = []
+
+    def prepare(self, client):
+        """Collect station uuids to click from a popular listing"""
+        status, payload = client.request('GET', '/api/stations/popular?limit=200')
+        if status == 200 and payload:
+            self.click_uuids = [station['uuid'] for station in payload['stations']]
+
+    def steps(self, scenario, worker, rng):
+        """Yield (method, path, body, check) forever; ``check`` sees the previous response"""
+        if scenario == 'search':
+            while True:
+                # Mostly one- or two-word queries over the catalog vocabulary, some with typos
+                query = ' '.join(rng.choice(WORDS) for _ in range(rng.choice((1, 1, 2))))
+                if rng.random() < 0.1:
+                    position = rng.randrange(len(query))
+                    query = query[:position] + query[position + 1:]
+                yield 'GET', f"/api/stations/search?q={quote(query)}&limit=50", None
+        elif scenario == 'popular':
+            while True:
+                yield 'GET', f"/api/stations/popular?limit={rng.choice((20, 20, 50, 100))}", None
+        elif scenario == 'click':
+            uuids = self.click_uuids or ['bench-station']
+            while True:
+                yield 'POST', '/api/stations/click', {'uuid': rng.choice(uuids), 'user_id': f"bench-{worker}-{rng.random()}"}
+        elif scenario == 'favorites':
+            # Add, list and remove, per worker so users do not collide
+            user_id = f"bench-{self.seed}-{worker}"
+            number = 0
+            while True:
+                number += 1
+                station_uuid = f"bench-{worker}-{number}"
+                yield 'POST', '/api/favorites', {
+                    'user_id': user_id, 'station_uuid': station_uuid, 'station_name': f"Bench {number}",
+                    'station_url': f"http://stream.invalid/{station_uuid}", 'tags': 'bench'}
+                status, payload = yield 'GET', f"/api/favorites?user_id={user_id}", None
+                for favorite in (payload or {}).get('favorites', []):
+                    yield 'DELETE', f"/api/favorites/{favorite['id']}?user_id={user_id}", None
+        else:
+            raise ValueError(f"Unknown scenario {scenario!r}")
+
+
+def run_scenario(base_url, workload, scenario, concurrency, duration, seed):
+    """Drive ``scenario`` from ``concurrency`` threads for ``duration`` seconds"""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    statuses = {}
+    statuses_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        client = Client(base_url)
+        rng = random.Random(seed * 1000 + index)
+        steps = workload.steps(scenario, index, rng)
+        step = next(steps)
+        while time.perf_counter() < deadline:
+            method, path, body = step
+            started = time.perf_counter()
+            try:
+                status, payload = client.request(method, path, body)
+            except (OSError, http.client.HTTPException, ValueError):
+                status, payload = 'error', None
+            latencies[index].append(time.perf_counter() - started)
+            if status == 'error' or status >= 500:
+                errors[index] += 1
+            with statuses_lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            step = steps.send((status, payload))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latency for worker_latencies in latencies for latency in worker_latencies)
+    requests = len(ordered)
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": requests,
+        "errors": sum(errors),
+        "error_rate": round(sum(errors) / requests, 4) if requests else 0.0,
+        "throughput_rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": ms(percentile(ordered, 0.50)),
+        "p95_ms": ms(percentile(ordered, 0.95)),
+        "p99_ms": ms(percentile(ordered, 0.99)),
+        "max_ms": ms(ordered[-1] if ordered else None),
+        "statuses": statuses
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_until_up(url, timeout=120):
+    client = Client(url, timeout=5)
+    expires = time.monotonic() + timeout
+    while time.monotonic() < expires:
+        try:
+            client.request('GET', urlsplit(url).path or '/')
+            return
+        except (OSError, http.client.HTTPException, ValueError):
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def spawn(args, workdir):
+    """Start the stub and the backend; returns (base_url, processes)"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    stub = subprocess.Popen(
+        [sys.executable, '-m', 'bench.stub_server', '--port', str(args.stub_port),
+         '--stations', str(args.stations), '--latency-ms', str(args.stub_latency_ms),
+         '--jitter-ms', str(args.stub_jitter_ms), '--error-rate', str(args.stub_error_rate)],
+        cwd=root)
+    wait_until_up(f"http://127.0.0.1:{args.stub_port}/json/stats")
+    env = dict(os.environ,
+               PORT=str(args.app_port),
+               NERV9_RADIO_BROWSER_SERVERS=f"http://127.0.0.1:{args.stub_port}",
+               NERV9_DB_PATH=os.path.join(workdir, 'bench.db'),
+               NERV9_SNAPSHOT_PATH=os.path.join(workdir, 'bench.snapshot'),
+               NERV9_CATALOG_SYNC='1' if args.catalog_sync else '0',
+               NERV9_PROBER='0',
+               NERV9_LOG_LEVEL=os.environ.get('NERV9_LOG_LEVEL', 'warning'))
+    backend = subprocess.Popen([sys.executable, 'app.py'], cwd=root, env=env)
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    wait_until_up(f"{base_url}/api/health")
+    return base_url, [backend, stub]
+
+
+def compare(baseline, current, tolerance):
+    """Lines describing each scenario, and whether any regressed beyond ``tolerance``"""
+    before = {(result['scenario'], result['concurrency']): result for result in baseline['results']}
+    lines = []
+    regressed = False
+    for result in current['results']:
+        key = (result['scenario'], result['concurrency'])
+        old = before.get(key)
+        if old is None:
+            lines.append(f"{key[0]:<10} c={key[1]:<4} (no baseline)")
+            continue
+        problems = []
+        for field in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if old[field] and result[field] and result[field] > old[field] * (1 + tolerance):
+                problems.append(f"{field} {old[field]} -> {result[field]}")
+        if old['throughput_rps'] and result['throughput_rps'] < old['throughput_rps'] * (1 - tolerance):
+            problems.append(f"throughput {old['throughput_rps']} -> {result['throughput_rps']}")
+        if result['error_rate'] > old['error_rate'] + 0.01:
+            problems.append(f"error_rate {old['error_rate']} -> {result['error_rate']}")
+        regressed = regressed or bool(problems)
+        change = (f"p95 {old['p95_ms']} -> {result['p95_ms']} ms, "
+                  f"rps {old['throughput_rps']} -> {result['throughput_rps']}")
+        lines.append(f"{key[0]:<10} c={key[1]:<4} {'REGRESSED' if problems else 'ok':<9} {change}"
+                     + (f"  [{'; '.join(problems)}]" if problems else ''))
+    return lines, regressed
+
+
+def print_table(results):
+    print(f"{'scenario':<10} {'conc':>4} {'requests':>9} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+    for result in results:
+        print(f"{result['scenario']:<10} {result['concurrency']:>4} {result['requests']:>9} "
+              f"{result['throughput_rps']:>9} {result['p50_ms']!s:>9} {result['p95_ms']!s:>9} "
+              f"{result['p99_ms']!s:>9} {result['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,8,32', help='comma-separated levels')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario and level')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds of untimed load before each scenario')
+    parser.add_argument('--seed', type=int, default=9)
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--label', default='', help='free-form note stored with the results')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'))
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative slowdown in --compare')
+    parser.add_argument('--spawn', action='store_true', help='start the stub and the backend for the run')
+    parser.add_argument('--app-port', type=int, default=5055)
+    parser.add_argument('--stub-port', type=int, default=8081)
+    parser.add_argument('--stations', type=int, default=50000)
+    parser.add_argument('--stub-latency-ms', type=float, default=0.0)
+    parser.add_argument('--stub-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    parser.add_argument('--catalog-sync', action='store_true', help='let the backend mirror the stub catalog')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        lines, regressed = compare(baseline, current, args.tolerance)
+        print('\n'.join(lines))
+        sys.exit(1 if regressed else 0)
+
+    processes = []
+    workdir = tempfile.mkdtemp(prefix='nerv9-bench-')
+    try:
+        base_url = args.base_url
+        if args.spawn:
+            base_url, processes = spawn(args, workdir)
+        workload = Workload(args.seed)
+        workload.prepare(Client(base_url))
+
+        results = []
+        for scenario in args.scenarios.split(','):
+            for concurrency in (int(level) for level in args.concurrency.split(',')):
+                if args.warmup:
+                    run_scenario(base_url, workload, scenario, concurrency, args.warmup, args.seed + 1)
+                result = run_scenario(base_url, workload, scenario, concurrency, args.duration, args.seed)
+                results.append(result)
+                print_table([result])
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "label": args.label,
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "base_url": base_url,
+        "settings": {name: getattr(args, name) for name in (
+            'duration', 'warmup', 'seed', 'spawn', 'stations', 'stub_latency_ms', 'stub_jitter_ms',
+            'stub_error_rate', 'catalog_sync')},
+        "results": results
+    }
+    print()
+    print_table(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
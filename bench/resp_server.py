@@ -0,0 +1,218 @@
+"""Local stand-in for a Redis server, enough for the 'redis' station cache backend.
+
+    python -m bench.resp_server --port 6380
+
+Point the backend at it with NERV9_CACHE_BACKEND=redis NERV9_REDIS_URL=redis://127.0.0.1:6380/0.
+Supports PING, GET, SET (EX/PX/NX), DEL, EXISTS, PUBLISH, SUBSCRIBE, DBSIZE and
+FLUSHALL, with expiry, in one process; nothing is persisted.
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class RespError(Exception):
+    pass
+
+
+class Store:
+    """Keys with optional expiry, plus pub/sub channels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}  # key -> (value, expires_at or None)
+        self._channels = {}  # channel -> set of handlers
+        self.commands = 0
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            return None if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None, only_new=False):
+        now = time.monotonic()
+        with self._lock:
+            if only_new and self._live(key, now) is not None:
+                return False
+            self._data[key] = (value, None if ttl is None else now + ttl)
+            return True
+
+    def delete(self, keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def exists(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return sum(self._live(key, now) is not None for key in keys)
+
+    def size(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(self._live(key, now) is not None for key in list(self._data))
+
+    def flush(self):
+        with self._lock:
+            self._data.clear()
+
+    def subscribe(self, channel, handler):
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(handler)
+
+    def unsubscribe(self, handler):
+        with self._lock:
+            for handlers in self._channels.values():
+                handlers.discard(handler)
+
+    def publish(self, channel, message):
+        with self._lock:
+            handlers = list(self._channels.get(channel, ()))
+        delivered = 0
+        for handler in handlers:
+            if handler.push([b'message', channel, message]):
+                delivered += 1
+        return delivered
+
+
+def encode(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, RespError):
+        return b'-ERR %s\r\n' % str(reply).encode('utf-8')
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, str):
+        return b'+%s\r\n' % reply.encode('utf-8')
+    if isinstance(reply, list):
+        return b'*%d\r\n' % len(reply) + b''.join(encode(item) for item in reply)
+    return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """One client connection: read commands, write replies"""
+
+    def setup(self):
+        super().setup()
+        self._write_lock = threading.Lock()
+
+    def push(self, reply):
+        try:
+            with self._write_lock:
+                self.wfile.write(encode(reply))
+                self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, e.g. from telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        store = self.server.store
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    return
+                if not args:
+                    continue
+                store.commands += 1
+                try:
+                    reply = self.execute(store, args[0].upper().decode('ascii'), args[1:])
+                except (RespError, ValueError, IndexError) as e:
+                    reply = RespError(str(e) or 'syntax error')
+                if reply is not NotImplemented:
+                    self.push(reply)
+        except OSError:
+            pass
+        finally:
+            store.unsubscribe(self)
+
+    def execute(self, store, name, args):
+        if name == 'PING':
+            return args[0] if args else 'PONG'
+        if name in ('AUTH', 'SELECT'):
+            return 'OK'
+        if name == 'GET':
+            return store.get(args[0])
+        if name == 'SET':
+            ttl, only_new = None, False
+            options = [arg.upper() for arg in args[2:]]
+            for i, option in enumerate(options):
+                if option == b'EX':
+                    ttl = float(args[2 + i + 1])
+                elif option == b'PX':
+                    ttl = float(args[2 + i + 1]) / 1000
+                elif option == b'NX':
+                    only_new = True
+            return 'OK' if store.set(args[0], args[1], ttl, only_new) else None
+        if name == 'DEL':
+            return store.delete(args)
+        if name == 'EXISTS':
+            return store.exists(args)
+        if name == 'DBSIZE':
+            return store.size()
+        if name == 'FLUSHALL':
+            store.flush()
+            return 'OK'
+        if name == 'PUBLISH':
+            return store.publish(args[0], args[1])
+        if name == 'SUBSCRIBE':
+            for count, channel in enumerate(args, 1):
+                store.subscribe(channel, self)
+                self.push([b'subscribe', channel, count])
+            return NotImplemented
+        raise RespError(f"unknown command '{name}'")
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, Handler)
+        self.store = Store()
+
+
+def serve(port=6380, host='127.0.0.1'):
+    """Start the stand-in in a background thread; returns the server (call shutdown() to stop)"""
+    server = RespServer((host, port))
+    threading.Thread(target=server.serve_forever, name='stub-redis', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6380)
+    args = parser.parse_args()
+
+    server = serve(args.port, args.host)
+    print(f"Stub Redis on redis://{args.host}:{server.server_address[1]}/0", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""Local stand-in for the radio-browser.info API, serving a synthetic catalog.
+
+    python -m bench.stub_server --port 8081 --stations 50000 --latency-ms 40 --error-rate 0.01
+
+Point the backend at it with NERV9_RADIO_BROWSER_SERVERS=http://127.0.0.1:8081.
+Faults can also be changed while running, e.g. to simulate an outage:
+
+    curl 'http://127.0.0.1:8081/_control?outage=1'
+    curl 'http://127.0.0.1:8081/_control?outage=0&latency_ms=200&jitter_ms=50&error_rate=0.05'
+"""
+import argparse
+import functools
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+WORDS = ['radio', 'fm', 'jazz', 'rock', 'classic', 'news', 'talk', 'pop', 'dance', 'chill',
+         'lounge', 'metal', 'indie', 'country', 'blues', 'soul', 'hits', 'deep', 'house', 'salsa',
+         'public', 'city', 'college', 'community', 'gold', 'oldies', 'latino', 'ambient', 'groove', 'sky']
+COUNTRIES = [('Germany', 'DE', 'german'), ('United States', 'US', 'english'), ('France', 'FR', 'french'),
+             ('United Kingdom', 'GB', 'english'), ('Spain', 'ES', 'spanish'), ('Brazil', 'BR', 'portuguese'),
+             ('Italy', 'IT', 'italian'), ('Netherlands', 'NL', 'dutch'), ('Poland', 'PL', 'polish'),
+             ('Japan', 'JP', 'japanese')]
+CODECS = [('MP3', 128), ('MP3', 192), ('AAC', 64), ('AAC+', 48), ('OGG', 160), ('FLAC', 1411)]
+
+
+def make_catalog(count=50000, seed=9):
+    """``count`` radio-browser station records, the same ones for the same seed, by votes"""
+    rng = random.Random(seed)
+    stations = []
+    for i in range(count):
+        country, countrycode, language = COUNTRIES[min(int(rng.expovariate(0.4)), len(COUNTRIES) - 1)]
+        codec, bitrate = rng.choice(CODECS)
+        name = ' '.join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 3)))
+        stations.append({
+            'changeuuid': str(uuid.UUID(int=rng.getrandbits(128))),
+            'stationuuid': str(uuid.UUID(int=rng.getrandbits(128))),
+            'name': f"{name} {i}",
+            'url': f"http://stream.invalid/{i}.{codec.lower().rstrip('+')}",
+            'url_resolved': f"http://stream.invalid/{i}.{codec.lower().rstrip('+')}",
+            'homepage': '',
+            'favicon': '',
+            'tags': ','.join(rng.sample(WORDS, rng.randint(0, 4))),
+            'country': country,
+            'countrycode': countrycode,
+            'language': language,
+            'votes': int(rng.paretovariate(1.2)) - 1,
+            'codec': codec,
+            'bitrate': bitrate,
+            'lastcheckok': 1 if rng.random() > 0.05 else 0,
+            'clickcount': rng.randint(0, 5000)
+        })
+    stations.sort(key=lambda station: station['votes'], reverse=True)
+    return stations
+
+
+class Faults:
+    """Latency, error rate and outage switch applied to every API request"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, outage=False):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.outage = outage
+        self.requests = 0
+        self.errors = 0
+
+    def update(self, params):
+        for name in ('latency_ms', 'jitter_ms', 'error_rate'):
+            if name in params:
+                setattr(self, name, float(params[name]))
+        if 'outage' in params:
+            self.outage = params['outage'] in ('1', 'true')
+
+    def snapshot(self):
+        return {name: getattr(self, name)
+                for name in ('latency_ms', 'jitter_ms', 'error_rate', 'outage', 'requests', 'errors')}
+
+
+class StubAPI:
+    """The radio-browser endpoints the backend uses, answered from memory"""
+
+    def __init__(self, stations, faults):
+        self.stations = stations
+        self.faults = faults
+        self.by_uuid = {station['stationuuid']: station for station in stations}
+        self.names = [station['name'].lower() for station in stations]
+        self.clicks = 0
+        self._lock = threading.Lock()
+        # Scanning 50k names costs more than the backend work being measured, so repeat queries are cached
+        self._matching = functools.lru_cache(maxsize=4096)(self._scan)
+
+    def _scan(self, name, hide_broken):
+        # The catalog is already ordered by votes, which is the order the backend asks for
+        return tuple(station for station, station_name in zip(self.stations, self.names)
+                     if name in station_name and not (hide_broken and not station['lastcheckok']))
+
+    def search(self, params):
+        limit = int(params.get('limit', 100000))
+        offset = int(params.get('offset', 0))
+        matches = self._matching(params.get('name', '').lower(), params.get('hidebroken') == 'true')
+        return list(matches[offset:offset + limit])
+
+    def topvote(self, params, limit=None):
+        limit = int(limit or params.get('limit', 100))
+        hide_broken = params.get('hidebroken') == 'true'
+        return [station for station in self.stations
+                if not (hide_broken and not station['lastcheckok'])][:limit]
+
+    def route(self, path, params):
+        """(status, payload) for an API path"""
+        if path == '/json/stations/search':
+            return 200, self.search(params)
+        if path.startswith('/json/stations/byname/'):
+            return 200, self.search(dict(params, name=unquote(path.rsplit('/', 1)[1])))
+        if path == '/json/stations/topvote':
+            return 200, self.topvote(params)
+        if path.startswith('/json/stations/topvote/'):
+            return 200, self.topvote(params, path.rsplit('/', 1)[1])
+        if path == '/json/stations/byuuid':
+            uuids = params.get('uuids', '').split(',')
+            return 200, [self.by_uuid[station_uuid] for station_uuid in uuids if station_uuid in self.by_uuid]
+        if path.startswith('/json/url/'):
+            station = self.by_uuid.get(path.rsplit('/', 1)[1])
+            if station is None:
+                return 404, {'ok': False, 'message': 'station not found'}
+            with self._lock:
+                self.clicks += 1
+            return 200, {'ok': True, 'message': 'retrieved station url', 'url': station['url']}
+        if path == '/json/stations':
+            return 200, self.stations
+        if path == '/json/stations/changed':
+            # The synthetic catalog never changes
+            return 200, []
+        if path == '/json/stats':
+            return 200, {'stations': len(self.stations), 'clicks_received': self.clicks,
+                         'faults': self.faults.snapshot()}
+        return 404, {'error': 'unknown endpoint'}
+
+
+def make_handler(api):
+    faults = api.faults
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+            if parts.path == '/_control':
+                faults.update(params)
+                return self._send(200, faults.snapshot())
+
+            faults.requests += 1
+            if faults.outage:
+                # Drop the connection without an answer, like an unreachable mirror
+                self.close_connection = True
+                self.connection.close()
+                return
+            delay = faults.latency_ms + random.uniform(-faults.jitter_ms, faults.jitter_ms)
+            if delay > 0:
+                time.sleep(delay / 1000)
+            if faults.error_rate and random.random() < faults.error_rate:
+                faults.errors += 1
+                return self._send(503, {'error': 'injected failure'})
+            self._send(*api.route(parts.path, params))
+
+        do_POST = do_GET
+
+    return Handler
+
+
+def serve(port=8081, stations=50000, seed=9, faults=None, host='127.0.0.1'):
+    """Start the stub in a background thread; returns the server (call shutdown() to stop)"""
+    api = StubAPI(make_catalog(stations, seed), faults or Faults())
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-radio-browser', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--stations', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=9)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--outage', action='store_true', help='start with every request dropped')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    server = serve(args.port, args.stations, args.seed,
+                   Faults(args.latency_ms, args.jitter_ms, args.error_rate, args.outage), args.host)
+    print(f"Stub radio-browser with {args.stations} stations on http://{args.host}:{server.server_port} "
+          f"(ready in {time.perf_counter() - started:.1f}s)", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""In-process response cache for station lists"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after ``ttl`` seconds.
+
+    Once an entry is older than ``ttl`` it is still served for up to
+    ``stale_ttl`` more seconds while one background refresh replaces it.
+    With a ``shared`` second level (a cachebackend.CacheBackend), local
+    misses are looked up there, keeping their age, stored values and
+    deletes are written through, so other processes and nodes can use
+    them, and keys the backend reports as changed elsewhere are dropped.
+
+    ``on_fill(value)`` is called for every value that enters this cache,
+    from a loader or from the second level, so side effects of loading
+    happen in each process however the value got there.
+    """
+
+    def __init__(self, maxsize=512, ttl=300, stale_ttl=900, shared=None, on_fill=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.shared = shared
+        self.on_fill = on_fill
+        self._data = OrderedDict()  # key -> (value, stored_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.stale = 0
+        self.evictions = 0
+        self.refresh_errors = 0
+        self.invalidations = 0
+        if shared is not None:
+            shared.subscribe(self._invalidated)
+
+    def get(self, key):
+        """Return a fresh value for ``key`` or None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def peek(self, key):
+        """Return (value, fresh) without loading, including stale entries, or None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            age = time.monotonic() - entry[1]
+            if age >= self.ttl + self.stale_ttl:
+                return None
+            return entry[0], age < self.ttl
+
+    def age(self, key):
+        """Seconds since ``key`` was stored, or None if it is not held"""
+        with self._lock:
+            entry = self._data.get(key)
+            return None if entry is None else time.monotonic() - entry[1]
+
+    def prefetch(self, key, loader, max_age=0):
+        """Load ``key`` ahead of any request unless a copy younger than ``max_age`` is
+        held here or in the second level; True if ``loader`` was called"""
+        age = self.age(key)
+        if age is not None and age < max_age:
+            return False
+        if self.shared is not None:
+            found = self.shared.get(key)
+            if found is not None and found[1] < max_age:
+                self._store(key, found[0], time.monotonic() - found[1])
+                return False
+        self.set(key, loader())
+        return True
+
+    def _store(self, key, value, stored_at):
+        if self.on_fill is not None:
+            self.on_fill(value)
+        with self._lock:
+            self._data[key] = (value, stored_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def set(self, key, value):
+        self._store(key, value, time.monotonic())
+        if self.shared is not None:
+            self.shared.set(key, value, self.ttl + self.stale_ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def _invalidated(self, key):
+        """Drop the local copy of a key changed in another process (None: everything)"""
+        with self._lock:
+            self.invalidations += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def values(self):
+        """Snapshot of every value currently held, fresh or stale"""
+        with self._lock:
+            return [value for value, _ in self._data.values()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for ``key``, calling ``loader()`` on a miss.
+
+        Stale entries are returned immediately and refreshed in a background
+        thread. Exceptions from ``loader`` propagate on a miss only.
+        """
+        refresh = False
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                age = time.monotonic() - stored_at
+                if age < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if age < self.ttl + self.stale_ttl:
+                    self._data.move_to_end(key)
+                    self.stale += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        refresh = True
+                else:
+                    del self._data[key]
+                    entry = None
+
+        if entry is None and self.shared is not None:
+            found = self.shared.get(key)
+            if found is not None and found[1] < self.ttl + self.stale_ttl:
+                value, age = found
+                self._store(key, value, time.monotonic() - age)
+                with self._lock:
+                    self.shared_hits += 1
+                    if age < self.ttl:
+                        return value
+                    self.stale += 1
+                    refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                entry = (value, age)
+
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            value = loader()
+            self.set(key, value)
+            return value
+
+        if refresh:
+            threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+        return value
+
+    def _refresh(self, key, loader):
+        try:
+            self.set(key, loader())
+        except Exception as e:
+            self.refresh_errors += 1
+            log.warning("Background refresh failed key=%r error=%r", key, str(e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        return {
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "refresh_errors": self.refresh_errors,
+            "invalidations": self.invalidations
+        }
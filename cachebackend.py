@@ -0,0 +1,137 @@
+"""Second-level cache backends shared by TTLCache instances across processes and nodes"""
+import json
+import threading
+import time
+import zlib
+
+# First byte of an encoded value
+RAW = b'j'
+COMPRESSED = b'z'
+
+
+def encode_key(key):
+    return json.dumps(key, separators=(',', ':'))
+
+
+def decode_key(text):
+    """The key ``encode_key`` was given; JSON arrays come back as the tuples cache keys are"""
+    def tuples(value):
+        return tuple(tuples(item) for item in value) if isinstance(value, list) else value
+    return tuples(json.loads(text))
+
+
+def pack(data, compress_min_size=1024, level=1):
+    """``data`` zlib-compressed when at least ``compress_min_size`` long, behind a one-byte tag"""
+    if len(data) >= compress_min_size:
+        compressed = zlib.compress(data, level)
+        if len(compressed) < len(data):
+            return COMPRESSED + compressed
+    return RAW + data
+
+
+def decode_value(data):
+    tag, payload = data[:1], data[1:]
+    if tag == COMPRESSED:
+        payload = zlib.decompress(payload)
+    elif tag != RAW:
+        raise ValueError(f"Unknown cache value encoding {tag!r}")
+    return json.loads(payload)
+
+
+class CacheBackend:
+    """What TTLCache needs from a second level.
+
+    ``get`` returns (value, age in seconds) or None; ``set`` stores with a
+    time to live; ``delete`` removes a key everywhere. Backends that span
+    processes or nodes tell the others when a key is written or deleted, by
+    calling the callbacks registered with ``subscribe`` there, so their
+    in-process copies are dropped instead of served until they expire.
+    Backend failures count as misses and are never raised to callers.
+    """
+
+    name = 'base'
+
+    def __init__(self, compress_min_size=1024):
+        self.compress_min_size = compress_min_size
+        self._subscribers = []
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    def encode(self, value):
+        raw = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        data = pack(raw, self.compress_min_size)
+        self.raw_bytes += len(raw)
+        self.stored_bytes += len(data)
+        return data
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def subscribe(self, callback):
+        """Call ``callback(key)`` when another process or node changes ``key`` (None: everything)"""
+        self._subscribers.append(callback)
+
+    def _notify(self, key):
+        for callback in self._subscribers:
+            callback(key)
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "compression_ratio": self.stored_bytes / self.raw_bytes if self.raw_bytes else 1.0
+        }
+
+
+class MemoryBackend(CacheBackend):
+    """In-process backend: a dict of encoded values, shared by the caches of one process.
+
+    Mostly useful in tests and benchmarks, where it behaves like the
+    distributed backends (encoding, expiry) without a server.
+    """
+
+    name = 'memory'
+
+    def __init__(self, compress_min_size=1024):
+        super().__init__(compress_min_size)
+        self._lock = threading.Lock()
+        self._data = {}  # encoded key -> (encoded value, stored_at, expires_at)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(encode_key(key))
+        if entry is None or entry[2] <= now:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode_value(entry[0]), max(now - entry[1], 0.0)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        data = self.encode(value)
+        with self._lock:
+            self._data[encode_key(key)] = (data, now, now + ttl)
+            if len(self._data) % 256 == 0:
+                self._data = {k: entry for k, entry in self._data.items() if entry[2] > now}
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(encode_key(key), None)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats["size"] = len(self._data)
+        return stats
@@ -0,0 +1,399 @@
+"""Local SQLite mirror of the radio-browser.info station catalog"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import db
+import metrics
+
+log = logging.getLogger(__name__)
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS stations
+       (uuid TEXT PRIMARY KEY,
+        name TEXT,
+        url TEXT,
+        country TEXT,
+        countrycode TEXT,
+        language TEXT,
+        tags TEXT,
+        favicon TEXT,
+        bitrate INTEGER,
+        codec TEXT,
+        votes INTEGER,
+        lastcheckok INTEGER,
+        changeuuid TEXT,
+        sync_gen INTEGER)''',
+    'CREATE INDEX IF NOT EXISTS idx_stations_votes ON stations (votes DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_stations_country ON stations (country)',
+    'CREATE INDEX IF NOT EXISTS idx_stations_language ON stations (language)',
+    'CREATE INDEX IF NOT EXISTS idx_stations_codec ON stations (codec)',
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS stations_fts USING fts5
+       (name, tags, content='stations', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2')''',
+    '''CREATE TRIGGER IF NOT EXISTS stations_ai AFTER INSERT ON stations BEGIN
+         INSERT INTO stations_fts (rowid, name, tags) VALUES (new.rowid, new.name, new.tags);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS stations_ad AFTER DELETE ON stations BEGIN
+         INSERT INTO stations_fts (stations_fts, rowid, name, tags)
+         VALUES ('delete', old.rowid, old.name, old.tags);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS stations_au AFTER UPDATE OF name, tags ON stations BEGIN
+         INSERT INTO stations_fts (stations_fts, rowid, name, tags)
+         VALUES ('delete', old.rowid, old.name, old.tags);
+         INSERT INTO stations_fts (rowid, name, tags) VALUES (new.rowid, new.name, new.tags);
+       END''',
+    'CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT)'
+]
+
+UPSERT_SQL = '''INSERT INTO stations
+    (uuid, name, url, country, countrycode, language, tags, favicon,
+     bitrate, codec, votes, lastcheckok, changeuuid, sync_gen)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (uuid) DO UPDATE SET
+        name=excluded.name, url=excluded.url, country=excluded.country,
+        countrycode=excluded.countrycode, language=excluded.language,
+        tags=excluded.tags, favicon=excluded.favicon, bitrate=excluded.bitrate,
+        codec=excluded.codec, votes=excluded.votes,
+        lastcheckok=excluded.lastcheckok, changeuuid=excluded.changeuuid,
+        sync_gen=excluded.sync_gen'''
+
+STATION_COLUMNS = ("stations.uuid, stations.name, url, country, language, stations.tags, "
+                   "favicon, bitrate, codec, votes")
+
+
+def iter_json_array(chunks):
+    """Yield the elements of a top-level JSON array from an iterable of text chunks.
+
+    Only the current partial element is held in memory, so arbitrarily
+    large arrays can be consumed in constant space. Raises ValueError if
+    the chunks run out before the closing bracket, e.g. on a dropped
+    connection, so a truncated list is never taken for the whole one.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    started = False
+    for chunk in chunks:
+        buf += chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Element is split across chunks, wait for more data
+                break
+            if end == len(buf):
+                # A number at the end of the buffer may continue in the next chunk
+                break
+            yield item
+            pos = end
+        buf = buf[pos:]
+    raise ValueError("JSON array ended before its closing bracket")
+
+
+def station_row(station, sync_gen):
+    return (
+        station.get('stationuuid', ''),
+        station.get('name', ''),
+        station.get('url', ''),
+        station.get('country', ''),
+        station.get('countrycode', ''),
+        station.get('language', ''),
+        station.get('tags', ''),
+        station.get('favicon', ''),
+        station.get('bitrate') or 0,
+        station.get('codec', ''),
+        station.get('votes') or 0,
+        station.get('lastcheckok', 1),
+        station.get('changeuuid', ''),
+        sync_gen
+    )
+
+
+def row_record(row):
+    """API record for a ``station_row`` tuple"""
+    return {
+        'uuid': row[0],
+        'name': row[1],
+        'url': row[2],
+        'country': row[3],
+        'language': row[5],
+        'tags': row[6],
+        'favicon': row[7],
+        'bitrate': row[8],
+        'codec': row[9],
+        'votes': row[10]
+    }
+
+
+def is_searchable(row):
+    """Whether a ``station_row`` tuple passes the filters search and popular apply"""
+    return bool(row[11] and row[2] and row[1])
+
+
+def fts_query(query):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    words = query.split()
+    return ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+class StationCatalog:
+    """Mirror of the radio-browser station list, searchable with FTS5.
+
+    ``full_sync`` streams ``/json/stations`` into the database in batched
+    transactions; ``incremental_sync`` applies ``/json/stations/changed``
+    since the last seen change uuid. Callables in ``listeners`` are called
+    after each sync with ``(changed, removed)``: lists of changed station
+    records and removed uuids, or ``(None, None)`` after a full sync.
+    """
+
+    def __init__(self, db_path, get_servers, http, batch_size=1000):
+        self.db_path = db_path
+        self.get_servers = get_servers
+        self.http = http
+        self.batch_size = batch_size
+        self._sync_lock = threading.Lock()
+        self._ready = None
+        self.last_sync = None
+        self.last_sync_error = None
+        self.listeners = []
+        self._marker = None
+
+    def _conn(self):
+        return db.get_connection(self.db_path)
+
+    def init_schema(self):
+        conn = self._conn()
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    def _get_meta(self, key):
+        row = self._conn().execute("SELECT value FROM catalog_meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO catalog_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def is_ready(self):
+        """True once a full sync has completed"""
+        if self._ready is None:
+            try:
+                self._ready = self._get_meta('last_full_sync') is not None
+            except sqlite3.Error:
+                return False
+        return self._ready
+
+    def changed_elsewhere(self):
+        """True if the mirror has been synced (by any process) since the previous call.
+
+        The first call only records where the mirror stands.
+        """
+        marker = (self._get_meta('last_full_sync'), self._get_meta('last_change_uuid'))
+        previous, self._marker = self._marker, marker
+        if previous is None or marker == previous:
+            return False
+        self._ready = None
+        return True
+
+    def _stream(self, path, params=None):
+        """Yield station records from the first server that answers ``path``"""
+        last_error = None
+        for server in self.get_servers():
+            try:
+                response = self.http.get(f"{server}{path}", params=params, timeout=60, stream=True)
+                if response.status_code != 200:
+                    response.close()
+                    last_error = f"{server} returned {response.status_code}"
+                    continue
+                return self._iter_response(response)
+            except Exception as e:
+                last_error = f"{server} failed: {str(e)}"
+        raise RuntimeError(last_error or "No radio-browser servers available")
+
+    def _iter_response(self, response):
+        response.encoding = 'utf-8'
+        try:
+            yield from iter_json_array(response.iter_content(chunk_size=65536, decode_unicode=True))
+        finally:
+            response.close()
+
+    def _notify(self, changed, removed):
+        for listener in self.listeners:
+            try:
+                listener(changed, removed)
+            except Exception:
+                log.exception("Catalog listener failed")
+
+    @metrics.timed_db('catalog.apply')
+    def _apply(self, stations, sync_gen, changed=None):
+        """Upsert streamed stations in batched transactions; returns the count and last change uuid.
+
+        Each row is also appended to ``changed``, if given.
+        """
+        conn = self._conn()
+        count = 0
+        last_change = None
+        batch = []
+        for station in stations:
+            if not station.get('stationuuid'):
+                continue
+            row = station_row(station, sync_gen)
+            batch.append(row)
+            if changed is not None:
+                changed.append(row)
+            last_change = station.get('changeuuid') or last_change
+            if len(batch) >= self.batch_size:
+                with conn:
+                    conn.executemany(UPSERT_SQL, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            with conn:
+                conn.executemany(UPSERT_SQL, batch)
+            count += len(batch)
+        return count, last_change
+
+    def full_sync(self):
+        """Replace the mirror with the complete upstream station list"""
+        with self._sync_lock:
+            started = time.time()
+            sync_gen = int(self._get_meta('sync_gen') or 0) + 1
+            # A truncated list raises here, before stations it did not include are deleted
+            count, last_change = self._apply(self._stream('/json/stations'), sync_gen)
+            conn = self._conn()
+            with conn:
+                # Stations missing from the full list were deleted upstream
+                conn.execute("DELETE FROM stations WHERE sync_gen < ?", (sync_gen,))
+                self._set_meta(conn, 'sync_gen', sync_gen)
+                self._set_meta(conn, 'last_full_sync', time.time())
+                if last_change:
+                    self._set_meta(conn, 'last_change_uuid', last_change)
+            self._ready = True
+            self.last_sync = time.time()
+            log.info("Catalog full sync stations=%d seconds=%.1f", count, time.time() - started)
+        self._notify(None, None)
+        return count
+
+    def incremental_sync(self):
+        """Apply upstream changes since the last seen change uuid"""
+        last_change = self._get_meta('last_change_uuid')
+        if not last_change:
+            return self.full_sync()
+        with self._sync_lock:
+            sync_gen = int(self._get_meta('sync_gen') or 0)
+            stations = self._stream('/json/stations/changed', {'lastchangeuuid': last_change})
+            rows = [] if self.listeners else None
+            count, new_last_change = self._apply(stations, sync_gen, rows)
+            if new_last_change:
+                conn = self._conn()
+                with conn:
+                    self._set_meta(conn, 'last_change_uuid', new_last_change)
+            self.last_sync = time.time()
+            if count:
+                log.info("Catalog incremental sync changed=%d", count)
+        if rows:
+            changed = [row_record(row) for row in rows if is_searchable(row)]
+            removed = [row[0] for row in rows if not is_searchable(row)]
+            self._notify(changed, removed)
+        return count
+
+    def sync(self, full_interval=86400):
+        """Run a full sync when the mirror is empty or old, otherwise an incremental one"""
+        last_full = float(self._get_meta('last_full_sync') or 0)
+        if time.time() - last_full >= full_interval:
+            return self.full_sync()
+        return self.incremental_sync()
+
+    def start_background_sync(self, interval=600, full_interval=86400):
+        def run():
+            while True:
+                try:
+                    self.sync(full_interval)
+                    self.last_sync_error = None
+                except Exception as e:
+                    self.last_sync_error = str(e)
+                    log.exception("Catalog sync failed")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name='catalog-sync', daemon=True)
+        thread.start()
+        return thread
+
+    def _rows(self, cursor):
+        return [{
+            'uuid': row[0],
+            'name': row[1],
+            'url': row[2],
+            'country': row[3],
+            'language': row[4],
+            'tags': row[5],
+            'favicon': row[6],
+            'bitrate': row[7],
+            'codec': row[8],
+            'votes': row[9]
+        } for row in cursor]
+
+    def iter_stations(self):
+        """Every searchable station, as API records, read in one pass"""
+        cursor = self._conn().execute(
+            f"""SELECT {STATION_COLUMNS} FROM stations
+                WHERE lastcheckok=1 AND url != '' AND name != ''""")
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            yield from self._rows(rows)
+
+    @metrics.timed_db('catalog.search')
+    def search(self, query, limit):
+        """Stations whose name or tags match every word of ``query``, by votes"""
+        match = fts_query(query)
+        if not match:
+            return []
+        cursor = self._conn().execute(
+            f"""SELECT {STATION_COLUMNS} FROM stations_fts
+                JOIN stations ON stations.rowid = stations_fts.rowid
+                WHERE stations_fts MATCH ?
+                  AND lastcheckok=1 AND url != '' AND stations.name != ''
+                ORDER BY votes DESC LIMIT ?""",
+            (match, limit))
+        return self._rows(cursor)
+
+    @metrics.timed_db('catalog.popular')
+    def popular(self, limit):
+        cursor = self._conn().execute(
+            f"""SELECT {STATION_COLUMNS} FROM stations
+                WHERE lastcheckok=1 AND url != '' AND name != ''
+                ORDER BY votes DESC LIMIT ?""",
+            (limit,))
+        return self._rows(cursor)
+
+    @metrics.timed_db('catalog.get')
+    def get(self, uuid):
+        cursor = self._conn().execute(f"SELECT {STATION_COLUMNS} FROM stations WHERE uuid=?", (uuid,))
+        rows = self._rows(cursor)
+        return rows[0] if rows else None
+
+    def stats(self):
+        count = self._conn().execute("SELECT COUNT(*) FROM stations").fetchone()[0]
+        return {
+            "stations": count,
+            "ready": self.is_ready(),
+            "last_sync": self.last_sync,
+            "last_sync_error": self.last_sync_error
+        }
@@ -0,0 +1,106 @@
+"""Background, batched click recording for radio-browser.info"""
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+DUPLICATE = 'duplicate'
+FULL = 'full'
+
+
+class ClickQueue:
+    """Bounded queue of station clicks drained by worker threads.
+
+    Repeated (user, uuid) clicks inside ``dedupe_window`` seconds are dropped
+    at submit time. Workers drain up to ``batch_size`` clicks at once and
+    send each distinct station uuid in the batch only once, since
+    radio-browser counts clicks per source address anyway.
+    """
+
+    def __init__(self, send, maxsize=1000, workers=2, dedupe_window=60, batch_size=25):
+        self.send = send
+        self.workers = workers
+        self.dedupe_window = dedupe_window
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self.accepted = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f'click-worker-{i}', daemon=True).start()
+
+    def _seen_recently(self, key, now):
+        with self._lock:
+            last = self._recent.get(key)
+            if last is not None and now - last < self.dedupe_window:
+                return True
+            self._recent[key] = now
+            if len(self._recent) > 4 * self._queue.maxsize:
+                cutoff = now - self.dedupe_window
+                self._recent = {k: t for k, t in self._recent.items() if t >= cutoff}
+            return False
+
+    def submit(self, user_id, station_uuid):
+        """Queue a click; returns QUEUED, DUPLICATE or FULL"""
+        self.start()
+        now = time.monotonic()
+        key = (user_id, station_uuid)
+        if self._seen_recently(key, now):
+            self.deduplicated += 1
+            return DUPLICATE
+        try:
+            self._queue.put_nowait(station_uuid)
+        except queue.Full:
+            with self._lock:
+                # Let the user retry once the burst has drained
+                self._recent.pop(key, None)
+            self.dropped += 1
+            return FULL
+        self.accepted += 1
+        return QUEUED
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.batches += 1
+            for station_uuid in dict.fromkeys(batch):
+                try:
+                    self.send(station_uuid)
+                    self.sent += 1
+                except Exception as e:
+                    self.failed += 1
+                    log.warning("Click not recorded uuid=%s error=%r", station_uuid, str(e))
+            for _ in batch:
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "accepted": self.accepted,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "failed": self.failed,
+            "batches": self.batches
+        }
@@ -0,0 +1,37 @@
+"""SQLite connection handling shared by the favorites store and the catalog"""
+import os
+import sqlite3
+import threading
+
+DB_PATH = os.environ.get('NERV9_DB_PATH', 'nerv9_radio.db')
+
+# Applied to every connection; journal_mode is persistent but cheap to repeat
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456'
+]
+
+_local = threading.local()
+
+
+def connect(path=DB_PATH):
+    """Open a new tuned connection"""
+    conn = sqlite3.connect(path, timeout=30)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection(path=DB_PATH):
+    """Return this thread's connection to ``path``, opening it on first use"""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = connect(path)
+    return conn
@@ -0,0 +1,450 @@
+"""In-memory columnar station index with bitmap facets"""
+import heapq
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+DIMENSIONS = ('country', 'language', 'codec', 'tag')
+FIELDS = ('uuid', 'name', 'url', 'country', 'language', 'tags', 'favicon', 'codec')
+
+# Offsets of the set bits in each byte value, for turning a bitmap into slot numbers
+BYTE_BITS = tuple(tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256))
+NONZERO_BYTE = re.compile(b'[^\x00]')
+
+# Attributes replaced as a whole when the index is rebuilt
+STATE = ('_slots', '_free', '_columns', '_votes', '_bitrate', '_values', '_pairs', '_postings',
+         '_alive', '_by_votes', '_votes_sorted', '_by_bitrate', '_bitrate_sorted',
+         '_bitrate_bitmaps', '_top_values')
+
+
+def normalize(value):
+    # Interned, so the many stations sharing a value share one string
+    return sys.intern(' '.join(str(value).lower().split()))
+
+
+def split_values(field):
+    """Normalized values of a comma-separated field such as tags or language"""
+    return {normalize(value) for value in (field or '').split(',') if value.strip()}
+
+
+def station_values(station):
+    """(dimension, value) pairs a station is indexed under"""
+    values = []
+    if station.get('country'):
+        values.append(('country', normalize(station['country'])))
+    if station.get('codec'):
+        values.append(('codec', normalize(station['codec'])))
+    values.extend(('language', value) for value in sorted(split_values(station.get('language'))))
+    values.extend(('tag', value) for value in sorted(split_values(station.get('tags'))))
+    return tuple(values)
+
+
+def bitmap_of(slots, size):
+    data = bytearray((size + 7) // 8)
+    for slot in slots:
+        data[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_slots(bitmap):
+    """Slot numbers of the set bits, in ascending order"""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for match in NONZERO_BYTE.finditer(data):
+        base = match.start() * 8
+        for bit in BYTE_BITS[data[match.start()]]:
+            yield base + bit
+
+
+def filters_from_args(args):
+    """Facet filters from query parameters.
+
+    ``country``, ``language``, ``codec`` and ``tag`` may be repeated or
+    comma-separated; values of one dimension are alternatives, and
+    different dimensions must all match. ``min_bitrate`` is in kbps.
+    """
+    filters = {}
+    for dimension in DIMENSIONS:
+        values = set()
+        for raw in args.getlist(dimension):
+            values |= split_values(raw)
+        if values:
+            filters[dimension] = values
+    min_bitrate = args.get('min_bitrate', type=int)
+    if min_bitrate:
+        filters['min_bitrate'] = min_bitrate
+    return filters
+
+
+def station_matches(station, filters):
+    """``filters`` applied to a single station record, for stations outside the index"""
+    values = set(station_values(station))
+    for dimension in DIMENSIONS:
+        if filters.get(dimension) and not any((dimension, value) in values for value in filters[dimension]):
+            return False
+    return (station.get('bitrate') or 0) >= filters.get('min_bitrate', 0)
+
+
+class FacetIndex:
+    """Stations held column-wise, with a posting per facet value.
+
+    Each station occupies a slot: string fields live in per-field lists and
+    votes and bitrate in ``array`` columns. Every (dimension, value) pair
+    has a posting. For common values that is a Python int with bit ``slot``
+    set for each station carrying it; for values held by fewer than one
+    station in ``sparse_ratio`` it is an array of slots, which costs far less
+    than a bitmap as wide as the whole index. Filters are ANDs/ORs over those
+    ints. Results are ordered by a votes-sorted slot array, and
+    ``min_bitrate`` comes from a bitrate-sorted one.
+
+    ``upsert`` and ``remove`` touch only the changed stations: bits are
+    flipped and sorted arrays spliced in place. Large batches and ``load``
+    build a fresh index aside and swap it in.
+    """
+
+    def __init__(self, sparse_ratio=32, facet_candidates=64, exact_facet_limit=1000,
+                 max_bitrate_bitmaps=16):
+        self.sparse_ratio = sparse_ratio
+        self.facet_candidates = facet_candidates
+        self.exact_facet_limit = exact_facet_limit
+        self.max_bitrate_bitmaps = max_bitrate_bitmaps
+        # Readers and writers share _lock; _write_lock keeps writers (and rebuilds) in sequence
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._reset()
+        self.loads = 0
+        self.updates = 0
+        self.last_rebuild_ms = None
+
+    def _reset(self):
+        # Keep in step with STATE
+        self._slots = {}
+        self._free = []
+        self._columns = {field: [] for field in FIELDS}
+        self._votes = array('l')
+        self._bitrate = array('l')
+        self._values = []
+        self._pairs = {}
+        self._postings = {dimension: {} for dimension in DIMENSIONS}
+        self._alive = 0
+        self._by_votes = array('l')
+        self._votes_sorted = array('l')  # negated, so the array ascends as votes descend
+        self._by_bitrate = array('l')
+        self._bitrate_sorted = array('l')
+        self._bitrate_bitmaps = {}
+        self._top_values = {dimension: [] for dimension in DIMENSIONS}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def version(self):
+        """Changes whenever the indexed stations do"""
+        return self.loads, self.updates
+
+    def get(self, uuid):
+        with self._lock:
+            slot = self._slots.get(uuid)
+            return self._station(slot) if slot is not None else None
+
+    def stations(self):
+        """Every indexed station, as API records"""
+        with self._lock:
+            return [self._station(slot) for slot in self._slots.values()]
+
+    def _station(self, slot):
+        station = {field: self._columns[field][slot] for field in FIELDS}
+        station['bitrate'] = self._bitrate[slot]
+        station['votes'] = self._votes[slot]
+        return station
+
+    def _write(self, slot, station):
+        for field in FIELDS:
+            value = station.get(field) or ''
+            if slot == len(self._columns[field]):
+                self._columns[field].append(value)
+            else:
+                self._columns[field][slot] = value
+        votes = station.get('votes') or 0
+        bitrate = station.get('bitrate') or 0
+        # Shared (dimension, value) pairs keep the per-station tuples small
+        values = tuple(self._pairs.setdefault(pair, pair) for pair in station_values(station))
+        if slot == len(self._votes):
+            self._votes.append(votes)
+            self._bitrate.append(bitrate)
+            self._values.append(values)
+        else:
+            self._votes[slot] = votes
+            self._bitrate[slot] = bitrate
+            self._values[slot] = values
+
+    def _bitmap(self, posting):
+        return posting if isinstance(posting, int) else bitmap_of(posting, len(self._votes))
+
+    def _build(self, stations):
+        slots_by_value = {dimension: {} for dimension in DIMENSIONS}
+        for station in stations:
+            uuid = station.get('uuid')
+            if not uuid or uuid in self._slots:
+                continue
+            slot = len(self._votes)
+            self._slots[uuid] = slot
+            self._write(slot, station)
+            for dimension, value in self._values[slot]:
+                slots_by_value[dimension].setdefault(value, []).append(slot)
+
+        size = len(self._votes)
+        sparse_limit = size // self.sparse_ratio
+        for dimension, values in slots_by_value.items():
+            # Facet counts on large result sets are taken over the globally commonest
+            # values, which therefore always get bitmaps
+            top = heapq.nlargest(self.facet_candidates, values, key=lambda value: len(values[value]))
+            self._top_values[dimension] = top
+            dense = set(top)
+            self._postings[dimension] = {
+                value: bitmap_of(slots, size) if len(slots) >= sparse_limit or value in dense
+                else array('l', slots)
+                for value, slots in values.items()}
+        self._alive = (1 << size) - 1
+
+        self._by_votes = array('l', sorted(range(size), key=self._votes.__getitem__, reverse=True))
+        self._votes_sorted = array('l', (-self._votes[slot] for slot in self._by_votes))
+        self._by_bitrate = array('l', sorted(range(size), key=self._bitrate.__getitem__))
+        self._bitrate_sorted = array('l', (self._bitrate[slot] for slot in self._by_bitrate))
+
+    def load(self, stations):
+        """Replace the index contents with ``stations``, built aside and swapped in"""
+        with self._write_lock:
+            self._load(stations)
+
+    def _load(self, stations):
+        started = time.perf_counter()
+        fresh = FacetIndex(self.sparse_ratio, self.facet_candidates, self.exact_facet_limit,
+                           self.max_bitrate_bitmaps)
+        fresh._build(stations)
+        with self._lock:
+            for name in STATE:
+                setattr(self, name, getattr(fresh, name))
+            self.loads += 1
+        self.last_rebuild_ms = (time.perf_counter() - started) * 1000
+
+    def upsert(self, stations):
+        """Add or update stations, touching only those whose data changed"""
+        stations = [station for station in stations if station.get('uuid')]
+        with self._write_lock:
+            if len(stations) > max(1000, len(self._slots) // 4):
+                with self._lock:
+                    merged = {uuid: self._station(slot) for uuid, slot in self._slots.items()}
+                merged.update((station['uuid'], station) for station in stations)
+                self._load(merged.values())
+                return
+            with self._lock:
+                changed = False
+                for station in stations:
+                    changed = self._upsert_one(station) or changed
+                if changed:
+                    self.updates += 1
+
+    def _upsert_one(self, station):
+        slot = self._slots.get(station['uuid'])
+        if slot is not None:
+            if (all((station.get(field) or '') == self._columns[field][slot] for field in FIELDS) and
+                    (station.get('votes') or 0) == self._votes[slot] and
+                    (station.get('bitrate') or 0) == self._bitrate[slot]):
+                return False
+            self._unlink(slot)
+        elif self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._votes)
+        self._slots[station['uuid']] = slot
+        self._write(slot, station)
+        self._link(slot)
+        return True
+
+    def remove(self, uuids):
+        with self._write_lock, self._lock:
+            removed = False
+            for uuid in uuids:
+                slot = self._slots.pop(uuid, None)
+                if slot is None:
+                    continue
+                self._unlink(slot)
+                self._values[slot] = ()
+                self._free.append(slot)
+                removed = True
+            if removed:
+                self.updates += 1
+
+    def _link(self, slot):
+        """Add a written slot to the postings and sorted arrays"""
+        bit = 1 << slot
+        self._alive |= bit
+        for dimension, value in self._values[slot]:
+            postings = self._postings[dimension]
+            posting = postings.get(value)
+            if posting is None:
+                postings[value] = array('l', [slot])
+            elif isinstance(posting, int):
+                postings[value] = posting | bit
+            else:
+                posting.append(slot)
+                if len(posting) >= len(self._slots) // self.sparse_ratio:
+                    postings[value] = bitmap_of(posting, len(self._votes))
+
+        position = bisect_right(self._votes_sorted, -self._votes[slot])
+        self._votes_sorted.insert(position, -self._votes[slot])
+        self._by_votes.insert(position, slot)
+        position = bisect_right(self._bitrate_sorted, self._bitrate[slot])
+        self._bitrate_sorted.insert(position, self._bitrate[slot])
+        self._by_bitrate.insert(position, slot)
+        for threshold in self._bitrate_bitmaps:
+            if self._bitrate[slot] >= threshold:
+                self._bitrate_bitmaps[threshold] |= bit
+
+    def _unlink(self, slot):
+        """Remove a slot from the postings and sorted arrays, before it is rewritten or freed"""
+        mask = ~(1 << slot)
+        self._alive &= mask
+        for dimension, value in self._values[slot]:
+            postings = self._postings[dimension]
+            posting = postings[value]
+            if isinstance(posting, int):
+                posting &= mask
+                if posting:
+                    postings[value] = posting
+                else:
+                    del postings[value]
+            else:
+                posting.remove(slot)
+                if not posting:
+                    del postings[value]
+
+        low = bisect_left(self._votes_sorted, -self._votes[slot])
+        position = self._by_votes.index(slot, low)
+        del self._votes_sorted[position], self._by_votes[position]
+        low = bisect_left(self._bitrate_sorted, self._bitrate[slot])
+        position = self._by_bitrate.index(slot, low)
+        del self._bitrate_sorted[position], self._by_bitrate[position]
+        for threshold in self._bitrate_bitmaps:
+            self._bitrate_bitmaps[threshold] &= mask
+
+    def _min_bitrate_bitmap(self, min_bitrate):
+        bitmap = self._bitrate_bitmaps.get(min_bitrate)
+        if bitmap is None:
+            start = bisect_left(self._bitrate_sorted, min_bitrate)
+            bitmap = bitmap_of(self._by_bitrate[start:], len(self._votes))
+            if len(self._bitrate_bitmaps) >= self.max_bitrate_bitmaps:
+                self._bitrate_bitmaps.clear()
+            self._bitrate_bitmaps[min_bitrate] = bitmap
+        return bitmap
+
+    def select(self, filters):
+        """Bitmap of the stations matching ``filters``"""
+        with self._lock:
+            bitmap = self._alive
+            for dimension in DIMENSIONS:
+                values = filters.get(dimension)
+                if not values:
+                    continue
+                union = 0
+                for value in values:
+                    posting = self._postings[dimension].get(value)
+                    if posting is not None:
+                        union |= self._bitmap(posting)
+                bitmap &= union
+                if not bitmap:
+                    return 0
+            if filters.get('min_bitrate'):
+                bitmap &= self._min_bitrate_bitmap(filters['min_bitrate'])
+            return bitmap
+
+    def top(self, bitmap, limit):
+        """Up to ``limit`` stations from ``bitmap``, by votes"""
+        with self._lock:
+            if bitmap.bit_count() <= limit * 8:
+                votes = self._votes
+                slots = heapq.nsmallest(limit, iter_slots(bitmap), key=lambda slot: -votes[slot])
+            else:
+                # Dense result: walk the votes order, which finds ``limit`` hits early
+                data = bitmap.to_bytes((len(self._votes) + 7) // 8, 'little')
+                slots = []
+                for slot in self._by_votes:
+                    if data[slot >> 3] >> (slot & 7) & 1:
+                        slots.append(slot)
+                        if len(slots) >= limit:
+                            break
+            return [self._station(slot) for slot in slots]
+
+    def restrict(self, stations, filters, uuid_key='uuid'):
+        """The stations of a list that match ``filters``, in their original order"""
+        if not filters:
+            return stations
+        bitmap = self.select(filters)
+        with self._lock:
+            slots = self._slots
+            data = bitmap.to_bytes((len(self._votes) + 7) // 8, 'little')
+            matched = []
+            for station in stations:
+                slot = slots.get(station[uuid_key])
+                if slot is not None and data[slot >> 3] >> (slot & 7) & 1:
+                    matched.append(station)
+            return matched
+
+    def select_uuids(self, uuids):
+        """Bitmap of the given stations, for facet counts over an arbitrary result list"""
+        with self._lock:
+            return bitmap_of((self._slots[uuid] for uuid in uuids if uuid in self._slots), len(self._votes))
+
+    def facets(self, bitmap, top=20):
+        """Per dimension, the ``top`` values by number of matching stations"""
+        with self._lock:
+            counts = {dimension: Counter() for dimension in DIMENSIONS}
+            if bitmap.bit_count() <= self.exact_facet_limit:
+                for slot in iter_slots(bitmap):
+                    for dimension, value in self._values[slot]:
+                        counts[dimension][value] += 1
+            else:
+                data = bitmap.to_bytes((len(self._votes) + 7) // 8, 'little')
+                for dimension in DIMENSIONS:
+                    postings = self._postings[dimension]
+                    for value in self._top_values[dimension]:
+                        posting = postings.get(value)
+                        if posting is None:
+                            continue
+                        if isinstance(posting, int):
+                            count = (bitmap & posting).bit_count()
+                        else:
+                            count = sum(data[slot >> 3] >> (slot & 7) & 1 for slot in posting)
+                        if count:
+                            counts[dimension][value] = count
+            return {dimension: counts[dimension].most_common(top) for dimension in DIMENSIONS}
+
+    def memory_bytes(self):
+        with self._lock:
+            total = sys.getsizeof(self._slots) + sum(sys.getsizeof(key) for key in self._slots)
+            for column in self._columns.values():
+                total += sys.getsizeof(column) + sum(sys.getsizeof(value) for value in column)
+            for column in (self._votes, self._bitrate, self._by_votes, self._votes_sorted,
+                           self._by_bitrate, self._bitrate_sorted):
+                total += sys.getsizeof(column)
+            total += sys.getsizeof(self._values) + sum(sys.getsizeof(values) for values in self._values)
+            for postings in self._postings.values():
+                total += sys.getsizeof(postings) + sum(sys.getsizeof(posting) for posting in postings.values())
+            return total
+
+    def stats(self):
+        stations = len(self._slots)
+        memory = self.memory_bytes()
+        return {
+            "stations": stations,
+            "slots": len(self._votes),
+            "values": {dimension: len(self._postings[dimension]) for dimension in DIMENSIONS},
+            "memory_bytes": memory,
+            "bytes_per_station": memory / stations if stations else 0,
+            "loads": self.loads,
+            "updates": self.updates,
+            "last_rebuild_ms": self.last_rebuild_ms
+        }
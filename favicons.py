@@ -0,0 +1,271 @@
+"""Station favicon proxy with a content-addressed on-disk cache"""
+import hashlib
+import io
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+import db
+from singleflight import SingleFlight
+
+# Largest source image decoded; a favicon has no business being bigger
+MAX_PIXELS = 2048 * 2048
+
+try:
+    from PIL import Image
+    # Pillow refuses anything over twice this as a decompression bomb
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+except ImportError:  # without Pillow, small images are cached as-is
+    Image = None
+
+log = logging.getLogger(__name__)
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+def check_public_url(url):
+    """Raise ValueError unless ``url`` is http(s) on a host that resolves only to public addresses.
+
+    Station data is user-submitted, so a favicon URL may point at loopback,
+    private or link-local services of the host running the proxy.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError(f"Unsupported favicon URL {url!r}")
+    try:
+        infos = socket.getaddrinfo(parts.hostname, None, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"Cannot resolve {parts.hostname!r}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if getattr(address, 'ipv4_mapped', None) is not None:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"Favicon host {parts.hostname!r} resolves to non-public address {address}")
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS favicons
+            (uuid TEXT PRIMARY KEY,
+             digest TEXT,
+             content_type TEXT,
+             source_url TEXT,
+             fetched_at REAL)'''
+
+
+class FaviconCache:
+    """Fetches each station favicon once, shrinks it and stores it by content hash.
+
+    Files live at ``<cache_dir>/<digest[:2]>/<digest>``; identical icons
+    shared by many stations are stored once. The ``favicons`` table maps
+    station uuids to digests, with a NULL digest recording a failed fetch
+    that is not retried for ``failure_ttl`` seconds. When the directory
+    grows past ``max_bytes`` the least recently used files are removed.
+
+    Only public hosts are fetched from, including after each of at most
+    ``max_redirects`` redirects, and images over ``max_pixels`` are
+    rejected before they are decoded.
+    """
+
+    def __init__(self, cache_dir, http, db_path=db.DB_PATH, max_bytes=64 * 1024 * 1024,
+                 size=64, max_source_bytes=1024 * 1024, max_raw_bytes=32 * 1024,
+                 failure_ttl=3600, refresh_ttl=7 * 86400, max_redirects=3, max_pixels=MAX_PIXELS):
+        self.cache_dir = cache_dir
+        self.http = http
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.size = size
+        self.max_source_bytes = max_source_bytes
+        self.max_raw_bytes = max_raw_bytes
+        self.failure_ttl = failure_ttl
+        self.refresh_ttl = refresh_ttl
+        self.max_redirects = max_redirects
+        self.max_pixels = max_pixels
+        self._flights = SingleFlight()
+        self._evict_lock = threading.Lock()
+        self._total_bytes = None
+        self.hits = 0
+        self.fetches = 0
+        self.failures = 0
+        self.evicted_files = 0
+
+    def _conn(self):
+        return db.get_connection(self.db_path)
+
+    def init_schema(self):
+        conn = self._conn()
+        with conn:
+            conn.execute(SCHEMA)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def get(self, uuid, source_url):
+        """Return (body, content_type, digest) for the station's icon, or None"""
+        row = self._conn().execute(
+            "SELECT digest, content_type, source_url, fetched_at FROM favicons WHERE uuid=?",
+            (uuid,)).fetchone()
+        if row is not None:
+            digest, content_type, cached_source, fetched_at = row
+            age = time.time() - fetched_at
+            if digest is None:
+                if age < self.failure_ttl and cached_source == source_url:
+                    return None
+            elif cached_source == source_url or not source_url:
+                body = self._read(digest)
+                if body is not None:
+                    self.hits += 1
+                    if age >= self.refresh_ttl and source_url:
+                        threading.Thread(target=self._flights.do, daemon=True,
+                                         args=(uuid, lambda: self._load(uuid, source_url))).start()
+                    return body, content_type, digest
+        if not source_url:
+            return None
+        return self._flights.do(uuid, lambda: self._load(uuid, source_url))
+
+    def _read(self, digest):
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            # mtime doubles as the LRU clock for eviction
+            os.utime(path)
+            return body
+        except OSError:
+            return None
+
+    def _load(self, uuid, source_url):
+        self.fetches += 1
+        try:
+            body, content_type = self._normalize(self._fetch(source_url))
+        except Exception as e:
+            self.failures += 1
+            with self._conn() as conn:
+                conn.execute("INSERT OR REPLACE INTO favicons VALUES (?, NULL, NULL, ?, ?)",
+                             (uuid, source_url, time.time()))
+            log.info("Favicon unavailable uuid=%s error=%r", uuid, str(e))
+            return None
+
+        digest = hashlib.sha256(body).hexdigest()
+        self._store(digest, body)
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO favicons VALUES (?, ?, ?, ?, ?)",
+                         (uuid, digest, content_type, source_url, time.time()))
+        return body, content_type, digest
+
+    def _fetch(self, source_url):
+        url = source_url
+        for _ in range(self.max_redirects + 1):
+            check_public_url(url)
+            # Redirects are followed here, so every hop is checked
+            response = self.http.get(url, timeout=5, stream=True, allow_redirects=False)
+            if response.status_code in REDIRECT_STATUSES and response.headers.get('Location'):
+                url = urljoin(url, response.headers['Location'])
+                response.close()
+                continue
+            return self._read_image(response)
+        raise ValueError("Too many redirects")
+
+    def _read_image(self, response):
+        try:
+            if response.status_code != 200:
+                raise ValueError(f"HTTP {response.status_code}")
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if content_type and not content_type.startswith('image/') and content_type != 'application/octet-stream':
+                raise ValueError(f"Not an image ({content_type})")
+            chunks = []
+            received = 0
+            for chunk in response.iter_content(chunk_size=16384):
+                received += len(chunk)
+                if received > self.max_source_bytes:
+                    raise ValueError("Favicon too large")
+                chunks.append(chunk)
+            return b''.join(chunks), content_type
+        finally:
+            response.close()
+
+    def _normalize(self, fetched):
+        """Shrink the icon to a ``size`` px PNG thumbnail"""
+        body, content_type = fetched
+        if Image is not None:
+            with Image.open(io.BytesIO(body)) as image:
+                # Only the header has been read so far
+                width, height = image.size
+                if width * height > self.max_pixels:
+                    raise ValueError(f"Favicon too large ({width}x{height})")
+                image.load()
+                thumbnail = image.convert('RGBA')
+                thumbnail.thumbnail((self.size, self.size))
+                out = io.BytesIO()
+                thumbnail.save(out, format='PNG', optimize=True)
+                return out.getvalue(), 'image/png'
+        if len(body) > self.max_raw_bytes or not content_type.startswith('image/'):
+            raise ValueError("Cannot shrink favicon without Pillow")
+        return body, content_type
+
+    def _store(self, digest, body):
+        path = self._path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        with self._evict_lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in self._files())
+            else:
+                self._total_bytes += len(body)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        for shard in os.listdir(self.cache_dir):
+            shard_path = os.path.join(self.cache_dir, shard)
+            if not os.path.isdir(shard_path):
+                continue
+            for name in os.listdir(shard_path):
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(shard_path, name))
+                except OSError:
+                    continue
+                yield name, stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        """Delete least recently used files until the cache is at 90% of max_bytes"""
+        files = sorted(self._files(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in files)
+        target = self.max_bytes * 0.9
+        removed = []
+        for digest, _, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                continue
+            total -= size
+            removed.append((digest,))
+        self._total_bytes = total
+        self.evicted_files += len(removed)
+        if removed:
+            with self._conn() as conn:
+                conn.executemany("DELETE FROM favicons WHERE digest=?", removed)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "fetches": self.fetches,
+            "failures": self.failures,
+            "evicted_files": self.evicted_files,
+            "cache_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "thumbnails": Image is not None
+        }
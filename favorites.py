@@ -0,0 +1,263 @@
+"""SQLite storage for user favorites"""
+import logging
+import re
+from datetime import datetime
+
+import db
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Each entry upgrades the schema by one PRAGMA user_version step
+MIGRATIONS = [
+    # 1: one row per (user, station) and an index for the per-user listing
+    [
+        '''DELETE FROM favorites WHERE id NOT IN
+           (SELECT MIN(id) FROM favorites GROUP BY user_id, station_uuid)''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_favorites_user_station ON favorites (user_id, station_uuid)',
+        'CREATE INDEX IF NOT EXISTS idx_favorites_user_added ON favorites (user_id, added_date)'
+    ],
+    # 2: per-user change versions, with deletes kept as tombstones
+    [
+        'ALTER TABLE favorites ADD COLUMN version INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE favorites ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0',
+        'CREATE INDEX IF NOT EXISTS idx_favorites_user_version ON favorites (user_id, version)',
+        '''CREATE TABLE IF NOT EXISTS favorite_versions
+           (user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL)''',
+        'INSERT OR IGNORE INTO favorite_versions (user_id, version) SELECT DISTINCT user_id, 1 FROM favorites'
+    ]
+]
+
+FAVORITE_COLUMNS = 'id, station_uuid, station_name, station_url, country, language, tags, favicon, added_date'
+
+# Inserts a new favorite or revives a tombstone; a live duplicate is left alone
+INSERT_SQL = """INSERT INTO favorites
+    (user_id, station_uuid, station_name, station_url, country, language, tags, favicon, added_date, version, deleted)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+    ON CONFLICT (user_id, station_uuid) DO UPDATE SET
+        station_name=excluded.station_name, station_url=excluded.station_url,
+        country=excluded.country, language=excluded.language, tags=excluded.tags,
+        favicon=excluded.favicon, added_date=excluded.added_date,
+        version=excluded.version, deleted=0
+    WHERE favorites.deleted=1"""
+
+TOMBSTONE_SQL = "UPDATE favorites SET deleted=1, version=? WHERE id=? AND user_id=? AND deleted=0"
+
+REQUIRED_FIELDS = ['station_uuid', 'station_name', 'station_url']
+OPTIONAL_FIELDS = ['country', 'language', 'tags', 'favicon', 'added_date']
+
+# radio-browser station uuids, e.g. 9617a958-0601-11e8-ae97-52543be04c81
+STATION_UUID = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+# Per-item batch statuses
+ADDED = 'added'
+EXISTS = 'exists'
+INVALID = 'invalid'
+REMOVED = 'removed'
+NOT_FOUND = 'not_found'
+
+# Keep IN (...) lists well below SQLite's bound parameter limit
+IN_CHUNK = 500
+
+
+def validate_favorite(data):
+    """Return an error message for an unusable favorite payload, or None"""
+    if not isinstance(data, dict):
+        return "favorite must be an object"
+    for field in REQUIRED_FIELDS:
+        if not data.get(field):
+            return f"{field} is required"
+        if not isinstance(data[field], str):
+            return f"{field} must be a string"
+    for field in OPTIONAL_FIELDS:
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return f"{field} must be a string"
+    if not STATION_UUID.fullmatch(data['station_uuid']):
+        return "station_uuid is not a station UUID"
+    return None
+
+
+def favorite_row(user_id, data, added_date, version):
+    return (user_id, data['station_uuid'], data['station_name'], data['station_url'],
+            data.get('country', ''), data.get('language', ''), data.get('tags', ''),
+            data.get('favicon', ''), data.get('added_date') or added_date, version)
+
+
+def chunks(items, size=IN_CHUNK):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def format_favorite(row):
+    return {
+        'id': row[0],
+        'station_uuid': row[1],
+        'station_name': row[2],
+        'station_url': row[3],
+        'country': row[4],
+        'language': row[5],
+        'tags': row[6],
+        'favicon': row[7],
+        'added_date': row[8]
+    }
+
+
+class FavoritesStore:
+    """Favorites table access over per-thread WAL connections"""
+
+    def __init__(self, db_path=db.DB_PATH):
+        self.db_path = db_path
+
+    def _conn(self):
+        return db.get_connection(self.db_path)
+
+    def init_schema(self):
+        """Create the favorites table and migrate existing databases in place"""
+        conn = self._conn()
+        with conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS favorites
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          user_id TEXT,
+                          station_uuid TEXT,
+                          station_name TEXT,
+                          station_url TEXT,
+                          country TEXT,
+                          language TEXT,
+                          tags TEXT,
+                          favicon TEXT,
+                          added_date TEXT)''')
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            with conn:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version={number}')
+            log.info("Migrated favorites schema version=%d", number)
+
+    @metrics.timed_db('favorites.version')
+    def version(self, user_id):
+        """Current change version of the user's favorites, 0 if never changed"""
+        row = self._conn().execute("SELECT version FROM favorite_versions WHERE user_id=?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _next_version(self, conn, user_id):
+        # The upsert takes the write lock, so concurrent writers serialize here
+        conn.execute("""INSERT INTO favorite_versions (user_id, version) VALUES (?, 1)
+                        ON CONFLICT (user_id) DO UPDATE SET version=version + 1""", (user_id,))
+        return conn.execute("SELECT version FROM favorite_versions WHERE user_id=?", (user_id,)).fetchone()[0]
+
+    @metrics.timed_db('favorites.list')
+    def list(self, user_id):
+        cursor = self._conn().execute(
+            f"SELECT {FAVORITE_COLUMNS} FROM favorites WHERE user_id=? AND deleted=0 ORDER BY added_date DESC",
+            (user_id,))
+        return [format_favorite(row) for row in cursor]
+
+    @metrics.timed_db('favorites.changes')
+    def changes(self, user_id, since):
+        """Favorites added and ids removed after version ``since``"""
+        changed = []
+        deleted = []
+        cursor = self._conn().execute(
+            f"SELECT {FAVORITE_COLUMNS}, deleted FROM favorites WHERE user_id=? AND version > ? ORDER BY version",
+            (user_id, since))
+        for row in cursor:
+            if not row[-1]:
+                changed.append(format_favorite(row))
+            elif since:
+                # A client starting from scratch has nothing to delete
+                deleted.append(row[0])
+        return changed, deleted
+
+    @metrics.timed_db('favorites.add')
+    def add(self, user_id, data):
+        """Insert a favorite; returns False if the user already has the station"""
+        conn = self._conn()
+        with conn:
+            version = self._next_version(conn, user_id)
+            cursor = conn.execute(INSERT_SQL, favorite_row(user_id, data, datetime.now().isoformat(), version))
+            if cursor.rowcount == 0:
+                # Leave the version alone so the ETag stays valid
+                conn.rollback()
+                return False
+        return True
+
+    @metrics.timed_db('favorites.add_many')
+    def add_many(self, user_id, items):
+        """Insert favorites in one transaction; returns a status dict per item"""
+        added_date = datetime.now().isoformat()
+        results = [None] * len(items)
+        pending = {}
+        for index, data in enumerate(items):
+            error = validate_favorite(data)
+            if error:
+                results[index] = {"status": INVALID, "error": error}
+            elif data['station_uuid'] in pending:
+                results[index] = {"station_uuid": data['station_uuid'], "status": EXISTS}
+            else:
+                pending[data['station_uuid']] = index
+
+        conn = self._conn()
+        with conn:
+            existing = set()
+            for uuids in chunks(list(pending)):
+                placeholders = ','.join('?' * len(uuids))
+                existing.update(row[0] for row in conn.execute(
+                    f"""SELECT station_uuid FROM favorites
+                        WHERE user_id=? AND deleted=0 AND station_uuid IN ({placeholders})""",
+                    [user_id] + uuids))
+            if len(existing) < len(pending):
+                version = self._next_version(conn, user_id)
+                conn.executemany(INSERT_SQL, [favorite_row(user_id, items[index], added_date, version)
+                                              for uuid, index in pending.items() if uuid not in existing])
+
+        for uuid, index in pending.items():
+            results[index] = {"station_uuid": uuid, "status": EXISTS if uuid in existing else ADDED}
+        return results
+
+    @metrics.timed_db('favorites.remove')
+    def remove(self, user_id, favorite_id):
+        """Tombstone a favorite; returns False if it does not exist for the user"""
+        conn = self._conn()
+        with conn:
+            version = self._next_version(conn, user_id)
+            cursor = conn.execute(TOMBSTONE_SQL, (version, favorite_id, user_id))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return False
+        return True
+
+    @metrics.timed_db('favorites.remove_many')
+    def remove_many(self, user_id, favorite_ids):
+        """Tombstone favorites by id in one transaction; returns a status dict per id"""
+        ids = list(dict.fromkeys(favorite_ids))
+        conn = self._conn()
+        with conn:
+            existing = set()
+            for id_chunk in chunks(ids):
+                placeholders = ','.join('?' * len(id_chunk))
+                existing.update(row[0] for row in conn.execute(
+                    f"SELECT id FROM favorites WHERE user_id=? AND deleted=0 AND id IN ({placeholders})",
+                    [user_id] + id_chunk))
+            if existing:
+                version = self._next_version(conn, user_id)
+                conn.executemany(TOMBSTONE_SQL, [(version, favorite_id, user_id)
+                                                 for favorite_id in ids if favorite_id in existing])
+        return [{"id": favorite_id, "status": REMOVED if favorite_id in existing else NOT_FOUND}
+                for favorite_id in favorite_ids]
+
+    @metrics.timed_db('favorites.station_urls')
+    def station_urls(self, limit):
+        """Distinct (station_uuid, station_url) pairs across all users' favorites"""
+        return self._conn().execute(
+            "SELECT station_uuid, MAX(station_url) FROM favorites WHERE deleted=0 GROUP BY station_uuid LIMIT ?",
+            (limit,)).fetchall()
+
+    def iter_export(self, user_id):
+        """Yield the user's favorites oldest first without loading them all"""
+        cursor = self._conn().execute(
+            f"SELECT {FAVORITE_COLUMNS} FROM favorites WHERE user_id=? AND deleted=0 ORDER BY added_date",
+            (user_id,))
+        for row in cursor:
+            yield format_favorite(row)
@@ -0,0 +1,58 @@
+"""Minimal asyncio HTTP/ICY client for reading station streams"""
+import asyncio
+from urllib.parse import urljoin, urlsplit
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+async def open_stream(url, ssl_context, user_agent, extra_headers=None, redirects=3):
+    """Connect to ``url`` and read the response head, following redirects.
+
+    Returns (reader, writer, status, headers, connected_at), where headers
+    have lower-cased names and ``connected_at`` is the loop time at which
+    the final hop's TCP/TLS connection was established. The caller owns
+    the writer and must close it.
+    """
+    loop = asyncio.get_running_loop()
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise ValueError(f"Unsupported scheme {parts.scheme!r}")
+    tls = parts.scheme == 'https'
+    host = parts.hostname
+    port = parts.port or (443 if tls else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    reader, writer = await asyncio.open_connection(
+        host, port, ssl=ssl_context if tls else None, server_hostname=host if tls else None)
+    connected_at = loop.time()
+    try:
+        request_head = (f"GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\n"
+                        f"User-Agent: {user_agent}\r\nAccept: */*\r\n")
+        for name, value in (extra_headers or {}).items():
+            request_head += f"{name}: {value}\r\n"
+        writer.write((request_head + "Connection: close\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+        # Shoutcast v1 answers "ICY 200 OK" instead of an HTTP status line
+        status_line = (await reader.readline()).decode('latin-1').split()
+        if len(status_line) < 2 or not status_line[1].isdigit():
+            raise ValueError("Malformed status line")
+        status = int(status_line[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    except BaseException:
+        writer.close()
+        raise
+
+    if status in REDIRECT_STATUSES and 'location' in headers and redirects > 0:
+        writer.close()
+        return await open_stream(urljoin(url, headers['location']), ssl_context, user_agent,
+                                 extra_headers, redirects - 1)
+    return reader, writer, status, headers, connected_at
@@ -0,0 +1,219 @@
+"""Latency histograms, counters and sampled slow-request traces, exposed in Prometheus text format"""
+import functools
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from flask import g, request
+
+log = logging.getLogger(__name__)
+
+# Seconds; roughly doubling from 1ms to 30s
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'nerv9_http_request_duration_seconds': 'Time to produce a response, by route',
+    'nerv9_http_requests_total': 'Responses by route and status class',
+    'nerv9_upstream_request_duration_seconds': 'radio-browser.info request time, by server and outcome',
+    'nerv9_upstream_requests_total': 'radio-browser.info requests by server and outcome',
+    'nerv9_db_operation_duration_seconds': 'SQLite operation time, by operation',
+    'nerv9_db_errors_total': 'SQLite operations that raised, by operation',
+    'nerv9_cache_refresh_lag_seconds': 'How late a scheduled station cache refresh finished, by endpoint',
+}
+
+
+class Histogram:
+    """Cumulative-on-export bucket counts with a running sum"""
+
+    __slots__ = ('counts', 'sum', 'lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+
+class Registry:
+    """Histograms and counters keyed by metric name and label values.
+
+    Series are created on first use under a registry lock; after that an
+    observation only takes the series' own lock for two additions, so
+    concurrent requests on different routes do not contend.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+
+    def _series(self, table, factory, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        series = table.get(key)
+        if series is None:
+            with self._lock:
+                series = table.setdefault(key, factory())
+        return series
+
+    def observe(self, name, seconds, **labels):
+        self._series(self._histograms, Histogram, name, labels).observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        counter = self._series(self._counters, lambda: [0, threading.Lock()], name, labels)
+        with counter[1]:
+            counter[0] += amount
+
+    def add_collector(self, collect):
+        """Register ``collect()``, returning [(name, type, help, [(labels, value)])] at export time"""
+        self._collectors.append(collect)
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        described = set()
+
+        def describe(name, kind, text=None):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {text or HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in histograms:
+            describe(name, 'histogram')
+            with histogram.lock:
+                counts = list(histogram.counts)
+                total = histogram.sum
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        for (name, labels), (value, _) in counters:
+            describe(name, 'counter')
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                log.warning("metrics collector failed error=%r", str(e))
+                continue
+            for name, kind, text, samples in families:
+                describe(name, kind, text)
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+REGISTRY = Registry()
+
+
+class SlowTraces:
+    """The most recent slow requests, with the upstream and DB spans inside them.
+
+    Only a ``sample_rate`` fraction of requests collect spans at all, so the
+    cost for everything else is one random() call.
+    """
+
+    def __init__(self, threshold=1.0, sample_rate=0.1, maxlen=50):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self._traces = deque(maxlen=maxlen)
+
+    def start(self):
+        return [] if self.sample_rate and random.random() < self.sample_rate else None
+
+    def finish(self, spans, route, method, path, status, elapsed):
+        if spans is not None and elapsed >= self.threshold:
+            self._traces.append({
+                "at": time.time(),
+                "route": route,
+                "method": method,
+                "path": path,
+                "status": status,
+                "duration_ms": round(elapsed * 1000, 1),
+                "spans": spans
+            })
+
+    def recent(self):
+        return list(self._traces)
+
+
+TRACES = SlowTraces()
+
+_local = threading.local()
+
+
+def record_span(kind, label, seconds):
+    """Add a span to the current request's trace, if it is being sampled"""
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans.append({"kind": kind, "label": label, "ms": round(seconds * 1000, 2)})
+
+
+def observe_upstream(server, seconds, outcome):
+    REGISTRY.observe('nerv9_upstream_request_duration_seconds', seconds, server=server, outcome=outcome)
+    REGISTRY.inc('nerv9_upstream_requests_total', server=server, outcome=outcome)
+
+
+def timed_db(operation):
+    """Decorator recording the wrapped SQLite operation's duration and failures"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                REGISTRY.inc('nerv9_db_errors_total', operation=operation)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                REGISTRY.observe('nerv9_db_operation_duration_seconds', elapsed, operation=operation)
+                record_span('db', operation, elapsed)
+        return wrapper
+    return decorate
+
+
+def install(app):
+    """Time every request by its route pattern (not its path, which would be unbounded)"""
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        _local.spans = TRACES.start()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REGISTRY.observe('nerv9_http_request_duration_seconds', elapsed, route=route, method=request.method)
+        REGISTRY.inc('nerv9_http_requests_total', route=route, method=request.method,
+                     status=f"{response.status_code // 100}xx")
+        TRACES.finish(_local.spans, route, request.method, request.full_path.rstrip('?'),
+                      response.status_code, elapsed)
+        _local.spans = None
+        return response
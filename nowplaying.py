@@ -0,0 +1,186 @@
+"""Shared ICY metadata pollers for live track titles"""
+import asyncio
+import json
+import logging
+import re
+import ssl
+import threading
+import time
+
+import background_loop
+from icy import open_stream
+
+log = logging.getLogger(__name__)
+
+STREAM_TITLE = re.compile(rb"StreamTitle='(.*?)';", re.S)
+
+
+def parse_stream_title(block):
+    """StreamTitle from an ICY metadata block, or None if it has none"""
+    match = STREAM_TITLE.search(block)
+    if match is None:
+        return None
+    return match.group(1).decode('utf-8', errors='replace').strip()
+
+
+class Poller:
+    """Latest title of one station, plus the subscribers waiting on it"""
+
+    def __init__(self, uuid, url):
+        self.uuid = uuid
+        self.url = url
+        self.title = None
+        self.version = 0
+        self.updated_at = None
+        self.supported = True
+        self.subscribers = 0
+        self.idle_since = time.monotonic()
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    def publish(self, title):
+        with self.cond:
+            if title == self.title:
+                return False
+            self.title = title
+            self.version += 1
+            self.updated_at = time.time()
+            self.cond.notify_all()
+            return True
+
+    def event(self):
+        return {"uuid": self.uuid, "title": self.title, "updated_at": self.updated_at,
+                "supported": self.supported}
+
+
+class NowPlayingService:
+    """Runs one ICY metadata poller per station that has subscribers.
+
+    Pollers live on the shared background asyncio loop and are reference
+    counted: ``subscribe`` starts one on first use, and it stops once it
+    has had no subscribers for ``linger`` seconds (so switching stations
+    and back does not reconnect). Subscribers only see title changes.
+    """
+
+    def __init__(self, linger=10, read_timeout=30, retry_delay=10, max_pollers=200,
+                 heartbeat=15, user_agent='NERV9-Radio/1.0'):
+        self.linger = linger
+        self.read_timeout = read_timeout
+        self.retry_delay = retry_delay
+        self.max_pollers = max_pollers
+        self.heartbeat = heartbeat
+        self.user_agent = user_agent
+        self._ssl = ssl.create_default_context()
+        self._lock = threading.Lock()
+        self._pollers = {}
+        self.pollers_started = 0
+        self.title_changes = 0
+        self.upstream_errors = 0
+        self.events_sent = 0
+
+    def _acquire(self, uuid, url):
+        with self._lock:
+            poller = self._pollers.get(uuid)
+            if poller is None or poller.stopped:
+                if len(self._pollers) >= self.max_pollers:
+                    return None
+                poller = Poller(uuid, url)
+                self._pollers[uuid] = poller
+                self.pollers_started += 1
+                background_loop.submit(self._run(poller))
+            poller.subscribers += 1
+            return poller
+
+    def _release(self, poller):
+        with self._lock:
+            poller.subscribers -= 1
+            if poller.subscribers == 0:
+                poller.idle_since = time.monotonic()
+
+    def _idle(self, poller):
+        return poller.subscribers == 0 and time.monotonic() - poller.idle_since > self.linger
+
+    def subscribe(self, uuid, url):
+        """Server-Sent Events for the station: its current title, then each change"""
+        poller = self._acquire(uuid, url)
+        if poller is None:
+            yield f"event: error\ndata: {json.dumps({'error': 'Too many stations being watched'})}\n\n"
+            return
+        try:
+            seen = -1
+            while True:
+                with poller.cond:
+                    if poller.version == seen and not poller.stopped:
+                        poller.cond.wait(self.heartbeat)
+                    version = poller.version
+                    event = poller.event()
+                    stopped = poller.stopped
+                if version != seen:
+                    seen = version
+                    self.events_sent += 1
+                    yield f"event: nowplaying\ndata: {json.dumps(event)}\n\n"
+                elif stopped:
+                    return
+                else:
+                    # Comment line, keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+        finally:
+            self._release(poller)
+
+    async def _run(self, poller):
+        try:
+            while not self._idle(poller):
+                try:
+                    await self._poll(poller)
+                except Exception as e:
+                    self.upstream_errors += 1
+                    log.warning("Now-playing poller failed uuid=%s error=%r", poller.uuid, str(e) or e.__class__.__name__)
+                if not poller.supported or self._idle(poller):
+                    break
+                await asyncio.sleep(self.retry_delay)
+        finally:
+            with self._lock:
+                if self._pollers.get(poller.uuid) is poller:
+                    del self._pollers[poller.uuid]
+            with poller.cond:
+                poller.stopped = True
+                poller.cond.notify_all()
+
+    async def _poll(self, poller):
+        reader, writer, status, headers, _ = await asyncio.wait_for(
+            open_stream(poller.url, self._ssl, self.user_agent, {'Icy-MetaData': '1'}), self.read_timeout)
+        try:
+            if status != 200:
+                raise ValueError(f"HTTP {status}")
+            metaint = headers.get('icy-metaint', '')
+            if not metaint.isdigit() or int(metaint) <= 0:
+                # The station does not interleave metadata; tell subscribers and stop
+                poller.supported = False
+                with poller.cond:
+                    poller.version += 1
+                    poller.cond.notify_all()
+                return
+            metaint = int(metaint)
+            while not self._idle(poller):
+                # Audio bytes are read and discarded; only the metadata blocks matter
+                await asyncio.wait_for(reader.readexactly(metaint), self.read_timeout)
+                length = (await asyncio.wait_for(reader.readexactly(1), self.read_timeout))[0] * 16
+                if not length:
+                    continue
+                title = parse_stream_title(await asyncio.wait_for(reader.readexactly(length), self.read_timeout))
+                if title is not None and poller.publish(title):
+                    self.title_changes += 1
+        finally:
+            writer.close()
+
+    def stats(self):
+        with self._lock:
+            pollers = list(self._pollers.values())
+        return {
+            "pollers": len(pollers),
+            "subscribers": sum(poller.subscribers for poller in pollers),
+            "pollers_started": self.pollers_started,
+            "title_changes": self.title_changes,
+            "upstream_errors": self.upstream_errors,
+            "events_sent": self.events_sent
+        }
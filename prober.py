@@ -0,0 +1,249 @@
+"""Background stream-health prober for station URLs"""
+import asyncio
+import logging
+import ssl
+import threading
+import time
+
+import background_loop
+import db
+import metrics
+from icy import open_stream
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS stream_health
+            (uuid TEXT PRIMARY KEY,
+             url TEXT,
+             ok INTEGER,
+             status INTEGER,
+             connect_ms REAL,
+             ttfb_ms REAL,
+             codec TEXT,
+             bitrate INTEGER,
+             error TEXT,
+             failures INTEGER,
+             checked_at REAL)'''
+
+# Content-Type -> codec name, as radio-browser reports them
+CODECS = {
+    'audio/mpeg': 'MP3',
+    'audio/mp3': 'MP3',
+    'audio/aac': 'AAC',
+    'audio/aacp': 'AAC+',
+    'audio/x-aac': 'AAC',
+    'audio/ogg': 'OGG',
+    'application/ogg': 'OGG',
+    'audio/opus': 'OPUS',
+    'audio/flac': 'FLAC',
+    'audio/x-flac': 'FLAC',
+    'application/vnd.apple.mpegurl': 'HLS',
+    'application/x-mpegurl': 'HLS',
+    'audio/x-mpegurl': 'PLAYLIST',
+    'audio/mpegurl': 'PLAYLIST',
+    'audio/x-scpls': 'PLAYLIST'
+}
+
+
+class ProbeResult:
+    __slots__ = ('uuid', 'url', 'ok', 'status', 'connect_ms', 'ttfb_ms', 'codec', 'bitrate', 'error')
+
+    def __init__(self, uuid, url):
+        self.uuid = uuid
+        self.url = url
+        self.ok = False
+        self.status = None
+        self.connect_ms = None
+        self.ttfb_ms = None
+        self.codec = None
+        self.bitrate = None
+        self.error = None
+
+
+class StreamProber:
+    """Periodically opens station streams and records how quickly they start.
+
+    Probes run on the shared background asyncio loop, at most
+    ``concurrency`` at a time, each limited to ``probe_timeout`` seconds;
+    a cycle stops starting new probes once ``cycle_budget`` seconds have
+    passed. The latest result per station is kept in memory for request-time
+    filtering and persisted to the ``stream_health`` table.
+    """
+
+    def __init__(self, get_targets, db_path=db.DB_PATH, interval=300, recheck=900,
+                 concurrency=20, probe_timeout=5, cycle_budget=60, max_targets=500,
+                 user_agent='NERV9-Radio/1.0'):
+        self.get_targets = get_targets
+        self.db_path = db_path
+        self.interval = interval
+        self.recheck = recheck
+        self.concurrency = concurrency
+        self.probe_timeout = probe_timeout
+        self.cycle_budget = cycle_budget
+        self.max_targets = max_targets
+        self.user_agent = user_agent
+        self._ssl = ssl.create_default_context()
+        self._lock = threading.Lock()
+        self._health = {}  # uuid -> (ok, ttfb_ms, checked_at)
+        self._started = False
+        self.cycles = 0
+        self.probes = 0
+        self.last_cycle_seconds = None
+        self.skipped_for_budget = 0
+
+    def _conn(self):
+        return db.get_connection(self.db_path)
+
+    def init_schema(self):
+        conn = self._conn()
+        with conn:
+            conn.execute(SCHEMA)
+        self.reload()
+
+    def reload(self):
+        """Read probe results saved since the last load, e.g. by another process"""
+        with self._lock:
+            since = max((health[2] for health in self._health.values()), default=0)
+        rows = self._conn().execute(
+            "SELECT uuid, ok, ttfb_ms, checked_at FROM stream_health WHERE checked_at > ?", (since,)).fetchall()
+        with self._lock:
+            for uuid, ok, ttfb_ms, checked_at in rows:
+                self._health[uuid] = (bool(ok), ttfb_ms, checked_at)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        background_loop.submit(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_cycle()
+            except Exception:
+                log.exception("Stream probe cycle failed")
+            await asyncio.sleep(self.interval)
+
+    def _due_targets(self):
+        now = time.time()
+        due = []
+        seen = set()
+        for uuid, url in self.get_targets():
+            if not uuid or not url or uuid in seen:
+                continue
+            seen.add(uuid)
+            health = self._health.get(uuid)
+            if health is None or now - health[2] >= self.recheck:
+                due.append((health[2] if health else 0, uuid, url))
+        # Never-probed and longest-unchecked stations first
+        due.sort()
+        return [(uuid, url) for _, uuid, url in due[:self.max_targets]]
+
+    async def run_cycle(self):
+        started = time.monotonic()
+        targets = await asyncio.to_thread(self._due_targets)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = []
+
+        async def probe(uuid, url):
+            async with semaphore:
+                if time.monotonic() - started > self.cycle_budget:
+                    self.skipped_for_budget += 1
+                    return
+                results.append(await self.probe(uuid, url))
+
+        await asyncio.gather(*(probe(uuid, url) for uuid, url in targets))
+        if results:
+            await asyncio.to_thread(self._save, results)
+        self.cycles += 1
+        self.last_cycle_seconds = time.monotonic() - started
+
+    async def probe(self, uuid, url):
+        result = ProbeResult(uuid, url)
+        self.probes += 1
+        try:
+            await asyncio.wait_for(self._probe(result, url), self.probe_timeout)
+        except asyncio.TimeoutError:
+            result.error = 'timeout'
+        except Exception as e:
+            result.error = str(e) or e.__class__.__name__
+        return result
+
+    async def _probe(self, result, url):
+        loop = asyncio.get_running_loop()
+        # Timings include any redirect hops, as a player would experience them
+        started = loop.time()
+        reader, writer, result.status, headers, connected_at = await open_stream(
+            url, self._ssl, self.user_agent)
+        try:
+            result.connect_ms = (connected_at - started) * 1000
+            content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+            result.codec = CODECS.get(content_type)
+            bitrate = headers.get('icy-br', '').split(',')[0].strip()
+            if bitrate.isdigit():
+                result.bitrate = int(bitrate)
+
+            if result.status == 200 and await reader.read(1):
+                result.ttfb_ms = (loop.time() - started) * 1000
+                result.ok = True
+            elif result.status != 200:
+                result.error = f"HTTP {result.status}"
+            else:
+                result.error = 'empty body'
+        finally:
+            writer.close()
+
+    @metrics.timed_db('prober.save')
+    def _save(self, results):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                """INSERT INTO stream_health
+                   (uuid, url, ok, status, connect_ms, ttfb_ms, codec, bitrate, error, failures, checked_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (uuid) DO UPDATE SET
+                       url=excluded.url, ok=excluded.ok, status=excluded.status,
+                       connect_ms=excluded.connect_ms, ttfb_ms=excluded.ttfb_ms,
+                       codec=excluded.codec, bitrate=excluded.bitrate, error=excluded.error,
+                       failures=CASE WHEN excluded.ok THEN 0 ELSE stream_health.failures + 1 END,
+                       checked_at=excluded.checked_at""",
+                [(r.uuid, r.url, int(r.ok), r.status, r.connect_ms, r.ttfb_ms, r.codec,
+                  r.bitrate, r.error, 0 if r.ok else 1, now) for r in results])
+        with self._lock:
+            for r in results:
+                self._health[r.uuid] = (r.ok, r.ttfb_ms, now)
+
+    def health(self, uuid):
+        """(ok, ttfb_ms, checked_at) from the latest probe, or None if never probed"""
+        return self._health.get(uuid)
+
+    def filter_and_rank(self, stations, uuid_key='uuid', drop_dead=False, rank=False):
+        """Drop stations whose last probe failed and/or order by measured startup time.
+
+        Stations that were never probed are kept, and rank after measured ones.
+        """
+        if drop_dead:
+            stations = [station for station in stations
+                        if (self._health.get(station[uuid_key]) or (True,))[0]]
+        if rank:
+            def startup(station):
+                health = self._health.get(station[uuid_key])
+                if health is None or health[1] is None:
+                    return float('inf')
+                return health[1]
+            stations = sorted(stations, key=startup)
+        return stations
+
+    def stats(self):
+        with self._lock:
+            known = len(self._health)
+            healthy = sum(1 for ok, _, _ in self._health.values() if ok)
+        return {
+            "stations_probed": known,
+            "healthy": healthy,
+            "cycles": self.cycles,
+            "probes": self.probes,
+            "last_cycle_seconds": self.last_cycle_seconds,
+            "skipped_for_budget": self.skipped_for_budget
+        }
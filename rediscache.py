@@ -0,0 +1,220 @@
+"""Cache backend for Redis (or anything speaking its RESP protocol), shared by every node"""
+import json
+import logging
+import queue
+import socket
+import struct
+import threading
+import time
+import uuid
+from urllib.parse import unquote, urlsplit
+
+from cachebackend import CacheBackend, decode_key, decode_value, encode_key
+
+log = logging.getLogger(__name__)
+
+# Stored values are the write time followed by the encoded value
+STORED_AT = struct.Struct('<d')
+
+
+class RedisError(Exception):
+    """An error reply from the server"""
+
+
+class RedisConnection:
+    """One RESP connection: send a command, read its reply"""
+
+    def __init__(self, host, port, db=0, password=None, timeout=1.0):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        if password:
+            self.command('AUTH', password)
+        if db:
+            self.command('SELECT', db)
+
+    def send(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode('utf-8')
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode('ascii')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(parts))
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Connection closed by the cache server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RedisError(rest.decode('utf-8', errors='replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by the cache server")
+            return data[:-2]
+        if kind == b'*':
+            count = int(rest)
+            return None if count < 0 else [self.read_reply() for _ in range(count)]
+        raise ConnectionError(f"Unexpected reply {line[:20]!r}")
+
+    def command(self, *args):
+        self.send(*args)
+        return self.read_reply()
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def parse_url(url):
+    """(host, port, db, password) from redis://[:password@]host[:port][/db]"""
+    parts = urlsplit(url)
+    if parts.scheme != 'redis':
+        raise ValueError(f"Unsupported cache URL {url!r}")
+    db = int(parts.path.strip('/') or 0)
+    return parts.hostname or '127.0.0.1', parts.port or 6379, db, unquote(parts.password) if parts.password else None
+
+
+class RedisCache(CacheBackend):
+    """Shares cached values between nodes through Redis.
+
+    Values are written with ``SET key value PX ttl`` under ``prefix``, and
+    every write or delete is published on ``prefix + 'invalidate'`` with
+    this node's id; the other nodes drop their in-process copy of the key
+    when the message arrives. Connections are pooled, and after a failure
+    the server is left alone for ``retry_interval`` seconds, with every
+    lookup a miss, so a cache outage never slows requests down.
+    """
+
+    name = 'redis'
+
+    def __init__(self, url='redis://127.0.0.1:6379/0', prefix='nerv9:', timeout=0.5, pool_size=16,
+                 retry_interval=5.0, compress_min_size=1024):
+        super().__init__(compress_min_size)
+        self.url = url
+        self.host, self.port, self.db, self.password = parse_url(url)
+        self.prefix = prefix
+        self.channel = f"{prefix}invalidate"
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.node_id = uuid.uuid4().hex
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._down_until = 0.0
+        self._subscriber = None
+        self.invalidations_sent = 0
+        self.invalidations_received = 0
+
+    def _connect(self, timeout):
+        return RedisConnection(self.host, self.port, self.db, self.password, timeout)
+
+    def _call(self, *args):
+        """Run one command on a pooled connection; None if the server is unavailable"""
+        if time.monotonic() < self._down_until:
+            return None
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = None
+        try:
+            if conn is None:
+                conn = self._connect(self.timeout)
+            reply = conn.command(*args)
+        except (OSError, ConnectionError, RedisError, ValueError) as e:
+            if conn is not None:
+                conn.close()
+            self.errors += 1
+            self._down_until = time.monotonic() + self.retry_interval
+            log.warning("Cache server call failed command=%s error=%r", args[0], str(e))
+            return None
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+        return reply
+
+    def get(self, key):
+        data = self._call('GET', self.prefix + encode_key(key))
+        if data is None:
+            self.misses += 1
+            return None
+        try:
+            stored_at = STORED_AT.unpack_from(data)[0]
+            value = decode_value(data[STORED_AT.size:])
+        except (struct.error, ValueError) as e:
+            self.errors += 1
+            log.warning("Undecodable cache value error=%r", str(e))
+            return None
+        self.hits += 1
+        return value, max(time.time() - stored_at, 0.0)
+
+    def set(self, key, value, ttl):
+        encoded_key = encode_key(key)
+        data = STORED_AT.pack(time.time()) + self.encode(value)
+        if self._call('SET', self.prefix + encoded_key, data, 'PX', int(ttl * 1000)) is not None:
+            self._publish(encoded_key)
+
+    def delete(self, key):
+        encoded_key = encode_key(key)
+        if self._call('DEL', self.prefix + encoded_key) is not None:
+            self._publish(encoded_key)
+
+    def _publish(self, encoded_key):
+        message = json.dumps({"node": self.node_id, "key": encoded_key})
+        if self._call('PUBLISH', self.channel, message) is not None:
+            self.invalidations_sent += 1
+
+    def subscribe(self, callback):
+        super().subscribe(callback)
+        if self._subscriber is None:
+            self._subscriber = threading.Thread(target=self._listen, name='cache-invalidations', daemon=True)
+            self._subscriber.start()
+
+    def _listen(self):
+        """Deliver other nodes' invalidations, reconnecting after errors"""
+        while True:
+            conn = None
+            try:
+                conn = self._connect(self.timeout)
+                conn.command('SUBSCRIBE', self.channel)
+                # Messages arrive whenever other nodes write; wait indefinitely
+                conn.sock.settimeout(None)
+                # Anything cached while we were not listening may be stale
+                self._notify(None)
+                while True:
+                    reply = conn.read_reply()
+                    if not isinstance(reply, list) or len(reply) != 3 or reply[0] != b'message':
+                        continue
+                    message = json.loads(reply[2])
+                    if message.get('node') == self.node_id:
+                        continue
+                    self.invalidations_received += 1
+                    self._notify(decode_key(message['key']))
+            except Exception as e:
+                log.warning("Cache invalidation listener disconnected error=%r", str(e))
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(self.retry_interval)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(
+            url=f"redis://{self.host}:{self.port}/{self.db}",
+            available=time.monotonic() >= self._down_until,
+            invalidations_sent=self.invalidations_sent,
+            invalidations_received=self.invalidations_received
+        )
+        return stats
@@ -0,0 +1,238 @@
+"""Fan-out relay: one upstream connection per station, shared by all its listeners"""
+import asyncio
+import logging
+import ssl
+import threading
+import time
+
+import background_loop
+from icy import open_stream
+
+log = logging.getLogger(__name__)
+
+# Playlists are not audio; the player has to fetch those itself
+RELAYABLE_TYPES = ('audio/', 'application/ogg')
+NOT_RELAYABLE_TYPES = ('audio/x-mpegurl', 'audio/mpegurl', 'audio/x-scpls')
+
+
+class RelayError(Exception):
+    """The station's upstream could not be opened for relaying"""
+
+
+class ListenerLagged(Exception):
+    """A listener fell further behind than the ring buffer holds"""
+
+
+class RingBuffer:
+    """Fixed number of the most recent chunks, numbered by a sequence counter.
+
+    Writers never wait on readers: old chunks are overwritten, and a reader
+    asking for a sequence number that has been overwritten gets
+    ListenerLagged.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._chunks = [None] * capacity
+        self.next_seq = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    @property
+    def oldest_seq(self):
+        return max(0, self.next_seq - self.capacity)
+
+    def append(self, chunk):
+        with self.cond:
+            self._chunks[self.next_seq % self.capacity] = chunk
+            self.next_seq += 1
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def read(self, seq, timeout):
+        """Chunks from ``seq`` onwards, waiting up to ``timeout`` for new data.
+
+        Returns an empty list on timeout and None once the buffer is closed
+        and drained.
+        """
+        with self.cond:
+            if seq >= self.next_seq and not self.closed:
+                self.cond.wait(timeout)
+            if seq < self.oldest_seq:
+                raise ListenerLagged()
+            if seq >= self.next_seq:
+                return None if self.closed else []
+            return [self._chunks[i % self.capacity] for i in range(seq, self.next_seq)]
+
+
+class Channel:
+    """An upstream station connection and its listeners"""
+
+    def __init__(self, uuid, url, capacity):
+        self.uuid = uuid
+        self.url = url
+        self.buffer = RingBuffer(capacity)
+        self.ready = threading.Event()
+        self.error = None
+        self.headers = {}
+        self.listeners = 0
+        self.idle_since = time.monotonic()
+        self.opened_at = time.monotonic()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped = 0
+
+
+class StreamRelay:
+    """Relays station streams so many listeners share one upstream connection.
+
+    Upstream connections are read on the shared background asyncio loop
+    into a per-station RingBuffer of ``buffer_chunks`` chunks. Each listener
+    follows the buffer at its own pace starting ``preroll_chunks`` behind
+    the head, so playback starts immediately; one that falls a whole buffer
+    behind is disconnected rather than holding anything up. An upstream
+    with no listeners for ``idle_timeout`` seconds, or that sends nothing
+    for ``read_timeout`` seconds, is closed.
+    """
+
+    def __init__(self, buffer_chunks=256, chunk_size=16384, preroll_chunks=8, idle_timeout=30,
+                 read_timeout=15, connect_timeout=10, max_channels=200,
+                 user_agent='NERV9-Radio/1.0'):
+        self.buffer_chunks = buffer_chunks
+        self.chunk_size = chunk_size
+        self.preroll_chunks = preroll_chunks
+        self.idle_timeout = idle_timeout
+        self.read_timeout = read_timeout
+        self.connect_timeout = connect_timeout
+        self.max_channels = max_channels
+        self.user_agent = user_agent
+        self._ssl = ssl.create_default_context()
+        self._lock = threading.Lock()
+        self._channels = {}
+        self.channels_opened = 0
+        self.upstream_failures = 0
+        self.idle_closed = 0
+        self.listeners_total = 0
+        self.listeners_dropped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _channel(self, uuid, url):
+        with self._lock:
+            channel = self._channels.get(uuid)
+            if channel is None or channel.buffer.closed:
+                if len(self._channels) >= self.max_channels:
+                    raise RelayError("Too many relayed stations")
+                channel = Channel(uuid, url, self.buffer_chunks)
+                self._channels[uuid] = channel
+                self.channels_opened += 1
+                background_loop.submit(self._pump(channel))
+            channel.listeners += 1
+            self.listeners_total += 1
+            return channel
+
+    def _release(self, channel):
+        with self._lock:
+            channel.listeners -= 1
+            if channel.listeners == 0:
+                channel.idle_since = time.monotonic()
+
+    def listen(self, uuid, url):
+        """Attach a listener to the station; returns (headers, chunk iterator).
+
+        Raises RelayError if the upstream cannot be opened.
+        """
+        channel = self._channel(uuid, url)
+        if not channel.ready.wait(self.connect_timeout) or channel.error:
+            self._release(channel)
+            raise RelayError(channel.error or "Upstream did not answer in time")
+        return channel.headers, self._iter_listener(channel)
+
+    def _iter_listener(self, channel):
+        buffer = channel.buffer
+        seq = max(buffer.oldest_seq, buffer.next_seq - self.preroll_chunks)
+        try:
+            while True:
+                chunks = buffer.read(seq, self.read_timeout)
+                if chunks is None:
+                    return
+                for chunk in chunks:
+                    channel.bytes_out += len(chunk)
+                    self.bytes_out += len(chunk)
+                    yield chunk
+                seq += len(chunks)
+        except ListenerLagged:
+            channel.dropped += 1
+            self.listeners_dropped += 1
+        finally:
+            self._release(channel)
+
+    async def _pump(self, channel):
+        writer = None
+        try:
+            reader, writer, status, headers, _ = await asyncio.wait_for(
+                open_stream(channel.url, self._ssl, self.user_agent), self.connect_timeout)
+            content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+            if status != 200:
+                raise RelayError(f"HTTP {status}")
+            if not content_type.startswith(RELAYABLE_TYPES) or content_type in NOT_RELAYABLE_TYPES:
+                raise RelayError(f"Cannot relay {content_type or 'unknown content'}")
+            channel.headers = {'Content-Type': content_type}
+            for name in ('icy-name', 'icy-br', 'icy-genre'):
+                if name in headers:
+                    channel.headers[name] = headers[name]
+            channel.ready.set()
+
+            while True:
+                if channel.listeners == 0 and time.monotonic() - channel.idle_since > self.idle_timeout:
+                    self.idle_closed += 1
+                    break
+                chunk = await asyncio.wait_for(reader.read(self.chunk_size), self.read_timeout)
+                if not chunk:
+                    break
+                channel.bytes_in += len(chunk)
+                self.bytes_in += len(chunk)
+                channel.buffer.append(chunk)
+        except Exception as e:
+            if not channel.ready.is_set():
+                channel.error = str(e) or e.__class__.__name__
+            self.upstream_failures += 1
+            log.warning("Relay upstream closed uuid=%s error=%r", channel.uuid, str(e) or e.__class__.__name__)
+        finally:
+            if writer is not None:
+                writer.close()
+            channel.ready.set()
+            channel.buffer.close()
+            with self._lock:
+                if self._channels.get(channel.uuid) is channel:
+                    del self._channels[channel.uuid]
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            channels = list(self._channels.values())
+        return {
+            "channels": len(channels),
+            "listeners": sum(channel.listeners for channel in channels),
+            "channels_opened": self.channels_opened,
+            "upstream_failures": self.upstream_failures,
+            "idle_closed": self.idle_closed,
+            "listeners_total": self.listeners_total,
+            "listeners_dropped": self.listeners_dropped,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "stations": [{
+                "uuid": channel.uuid,
+                "listeners": channel.listeners,
+                "dropped": channel.dropped,
+                "bytes_in": channel.bytes_in,
+                "bytes_out": channel.bytes_out,
+                "bytes_in_per_second": channel.bytes_in / max(now - channel.opened_at, 1e-3),
+                # Fan-out ratio: bytes sent to listeners per byte read upstream
+                "fan_out": channel.bytes_out / channel.bytes_in if channel.bytes_in else 0.0
+            } for channel in channels]
+        }
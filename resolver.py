@@ -0,0 +1,159 @@
+"""Resolve station URLs through redirects and playlists to the playable stream"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+from cache import TTLCache
+
+log = logging.getLogger(__name__)
+
+PLAYLIST_TYPES = {
+    'audio/x-scpls': 'pls',
+    'application/pls+xml': 'pls',
+    'audio/x-mpegurl': 'm3u',
+    'audio/mpegurl': 'm3u',
+    'application/x-mpegurl': 'm3u',
+    'application/vnd.apple.mpegurl': 'm3u'
+}
+
+PLAYLIST_EXTENSIONS = {
+    '.pls': 'pls',
+    '.m3u': 'm3u',
+    '.m3u8': 'm3u'
+}
+
+
+def parse_pls(text):
+    """Entry URLs of a PLS playlist, in FileN order"""
+    entries = []
+    for line in text.splitlines():
+        key, _, value = line.strip().partition('=')
+        if key.lower().startswith('file') and key[4:].isdigit() and value.strip():
+            entries.append((int(key[4:]), value.strip()))
+    return [url for _, url in sorted(entries)]
+
+
+def parse_m3u(text):
+    """Entry URLs of an M3U/M3U8 playlist"""
+    return [line.strip() for line in text.splitlines()
+            if line.strip() and not line.strip().startswith('#')]
+
+
+def is_hls(text):
+    # HLS playlists are streams in their own right; the <audio> element plays them directly
+    return '#EXT-X-' in text
+
+
+class StreamResolver:
+    """Follows redirects and playlist indirection, caching the result per station uuid.
+
+    ``peek`` never blocks: it returns the cached URL (fresh or stale) and
+    queues a background resolution on a miss, a stale entry or a changed
+    source URL. It is meant for stations being played; listings use
+    ``annotate``, which only reads what plays have already resolved.
+    """
+
+    def __init__(self, http, ttl=3600, stale_ttl=86400, maxsize=50000, workers=4,
+                 max_pending=1000, max_depth=3, max_playlist_bytes=65536):
+        self.http = http
+        self.max_depth = max_depth
+        self.max_pending = max_pending
+        self.max_playlist_bytes = max_playlist_bytes
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, stale_ttl=stale_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='resolver')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.resolved = 0
+        self.failures = 0
+        self.skipped = 0
+
+    def resolve(self, url, depth=0):
+        """Return the final stream URL for ``url``"""
+        response = self.http.get(url, timeout=5, stream=True)
+        try:
+            if response.status_code != 200:
+                raise ValueError(f"HTTP {response.status_code}")
+            final_url = response.url
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            extension = os.path.splitext(urlsplit(final_url).path)[1].lower()
+            kind = PLAYLIST_TYPES.get(content_type) or PLAYLIST_EXTENSIONS.get(extension)
+            if kind is None or depth >= self.max_depth:
+                return final_url
+            body = b''
+            for chunk in response.iter_content(chunk_size=8192):
+                body += chunk
+                if len(body) >= self.max_playlist_bytes:
+                    break
+        finally:
+            response.close()
+
+        text = body.decode('utf-8', errors='replace')
+        if kind == 'm3u' and is_hls(text):
+            return final_url
+        entries = parse_pls(text) if kind == 'pls' else parse_m3u(text)
+        if not entries:
+            raise ValueError("Empty playlist")
+        return self.resolve(urljoin(final_url, entries[0]), depth + 1)
+
+    def _resolve_into_cache(self, uuid, url):
+        try:
+            self._cache.set(uuid, (url, self.resolve(url)))
+            self.resolved += 1
+        except Exception as e:
+            self.failures += 1
+            # Cache the original so we do not retry a broken station on every request
+            self._cache.set(uuid, (url, url))
+            log.info("Could not resolve stream uuid=%s error=%r", uuid, str(e))
+        finally:
+            with self._lock:
+                self._pending.discard(uuid)
+
+    def schedule(self, uuid, url):
+        with self._lock:
+            if uuid in self._pending:
+                return
+            if len(self._pending) >= self.max_pending:
+                self.skipped += 1
+                return
+            self._pending.add(uuid)
+        self._executor.submit(self._resolve_into_cache, uuid, url)
+
+    def peek(self, uuid, url):
+        """Cached resolved URL for the station, or None; schedules resolution as needed"""
+        entry = self._cache.peek(uuid)
+        if entry is not None:
+            (source_url, resolved_url), fresh = entry
+            if source_url == url:
+                if not fresh:
+                    self.schedule(uuid, url)
+                return resolved_url
+        if url:
+            self.schedule(uuid, url)
+        return None
+
+    def refresh(self, uuid, url):
+        """Re-resolve the station in the background, keeping the old entry until done"""
+        if url:
+            self.schedule(uuid, url)
+
+    def cached(self, uuid, url):
+        """Resolved URL already cached for the station's current source URL, or None"""
+        entry = self._cache.peek(uuid)
+        if entry is not None:
+            source_url, resolved_url = entry[0]
+            if source_url == url:
+                return resolved_url
+        return None
+
+    def annotate(self, stations, uuid_key='uuid', url_key='url'):
+        """Copies of ``stations`` with ``url_resolved`` filled from the cache, without resolving anything"""
+        return [dict(station, url_resolved=self.cached(station[uuid_key], station[url_key]) or station[url_key])
+                for station in stations]
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return dict(self._cache.stats(), resolved=self.resolved, failures=self.failures,
+                    pending=pending, skipped=self.skipped)
@@ -0,0 +1,131 @@
+"""Fast JSON encoding and content-negotiated compression for /api/* responses"""
+import gzip
+import threading
+import time
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+from static_assets import brotli
+
+
+class ResponseStats:
+    """Payload size, encode time and compression counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.json_responses = 0
+        self.json_encode_ms = 0.0
+        self.responses = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.compress_ms = 0.0
+        self.by_encoding = {}
+
+    def record_encode(self, elapsed):
+        with self._lock:
+            self.json_responses += 1
+            self.json_encode_ms += elapsed * 1000
+
+    def record_body(self, raw_size, wire_size, encoding=None, elapsed=0.0):
+        with self._lock:
+            self.responses += 1
+            self.raw_bytes += raw_size
+            self.wire_bytes += wire_size
+            if encoding:
+                self.compressed += 1
+                self.compress_ms += elapsed * 1000
+                self.by_encoding[encoding] = self.by_encoding.get(encoding, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "json_encoder": "orjson" if orjson is not None else "json",
+                "json_responses": self.json_responses,
+                "json_encode_ms_avg": self.json_encode_ms / self.json_responses if self.json_responses else 0.0,
+                "responses": self.responses,
+                "compressed": self.compressed,
+                "by_encoding": dict(self.by_encoding),
+                "raw_bytes": self.raw_bytes,
+                "wire_bytes": self.wire_bytes,
+                "compression_ratio": self.wire_bytes / self.raw_bytes if self.raw_bytes else 1.0,
+                "compress_ms_avg": self.compress_ms / self.compressed if self.compressed else 0.0
+            }
+
+
+STATS = ResponseStats()
+
+# Images other than SVG are already compressed
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/', 'image/svg+xml')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Serializes jsonify() responses with orjson when it is installed"""
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        started = time.perf_counter()
+        if orjson is not None:
+            try:
+                body = orjson.dumps(obj)
+            except TypeError:
+                # Types orjson rejects (e.g. integers above 64 bits) go through the stdlib
+                body = self.dumps(obj, separators=(',', ':')).encode('utf-8')
+        else:
+            body = self.dumps(obj, separators=(',', ':')).encode('utf-8')
+        STATS.record_encode(time.perf_counter() - started)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=4)
+    return gzip.compress(data, compresslevel=5)
+
+
+def install(app, min_size=1024, prefix='/api/'):
+    """Use the fast encoder for the app and compress ``prefix`` responses of ``min_size`` bytes or more"""
+    app.json = FastJSONProvider(app)
+
+    @app.after_request
+    def compress_api_response(response):
+        if (not request.path.startswith(prefix) or response.direct_passthrough or
+                response.is_streamed or 'Content-Encoding' in response.headers or
+                response.status_code < 200 or response.status_code in (204, 304) or
+                not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+            return response
+
+        data = response.get_data()
+        response.vary.add('Accept-Encoding')
+        accepted = request.accept_encodings
+        encoding = None
+        if len(data) >= min_size:
+            if brotli is not None and accepted['br'] > 0:
+                encoding = 'br'
+            elif accepted['gzip'] > 0:
+                encoding = 'gzip'
+        if encoding is None:
+            STATS.record_body(len(data), len(data))
+            return response
+
+        started = time.perf_counter()
+        compressed = compress(data, encoding)
+        elapsed = time.perf_counter() - started
+        if len(compressed) >= len(data):
+            STATS.record_body(len(data), len(data))
+            return response
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # The compressed body is a different representation of the same content
+            response.set_etag(etag, weak=True)
+        STATS.record_body(len(data), len(compressed), encoding, elapsed)
+        return response
@@ -0,0 +1,138 @@
+"""Production entry point for the NERV9 Radio backend.
+
+    python serve.py --workers 4 --threads 16
+
+With gunicorn installed this runs a pre-fork master with ``--workers``
+processes, each serving ``--threads`` requests at a time. At most a
+quarter of them (or NERV9_MAX_STREAMS) may be long-lived streams, relay
+listeners and now-playing subscribers, so they cannot starve API
+requests. ``--worker-class gevent`` (experimental: the background asyncio
+loop and its thread coordination are untested under monkey-patching)
+serves up to ``--worker-connections`` requests per process instead, with
+no stream limit. Send the master SIGHUP to reload gracefully: new workers
+start, and old ones finish their in-flight requests within
+``--graceful-timeout``. Without gunicorn it falls back to one threaded
+process.
+
+Workers share search and popular results through a cache on /dev/shm (or,
+with NERV9_CACHE_BACKEND=redis and NERV9_REDIS_URL, with every node), and
+one of them (holding a lock file) runs the catalog sync and stream probes
+while the rest follow its results. Every option can also be set from the
+environment (NERV9_WORKERS, NERV9_THREADS, ...).
+"""
+import argparse
+import logging
+import os
+import signal
+import threading
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # fall back to a single threaded process
+    BaseApplication = None
+
+log = logging.getLogger('serve')
+
+
+def post_worker_init(worker):
+    import app
+    app.start_background_jobs()
+
+
+if BaseApplication is not None:
+    class GunicornApplication(BaseApplication):
+        """Runs the Flask app under gunicorn with settings from the command line"""
+
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+
+def parse_args():
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--bind', default=env('NERV9_BIND', f"0.0.0.0:{env('PORT', '5000')}"))
+    parser.add_argument('--workers', type=int, default=int(env('NERV9_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--worker-class', choices=('gthread', 'gevent'), default=env('NERV9_WORKER_CLASS', 'gthread'))
+    parser.add_argument('--threads', type=int, default=int(env('NERV9_THREADS', 16)),
+                        help='concurrent requests per gthread worker')
+    parser.add_argument('--worker-connections', type=int, default=int(env('NERV9_WORKER_CONNECTIONS', 1000)),
+                        help='concurrent requests per gevent worker')
+    parser.add_argument('--graceful-timeout', type=int, default=int(env('NERV9_GRACEFUL_TIMEOUT', 30)))
+    parser.add_argument('--timeout', type=int, default=int(env('NERV9_WORKER_TIMEOUT', 60)),
+                        help='seconds a silent worker is given before it is restarted')
+    parser.add_argument('--max-requests', type=int, default=int(env('NERV9_MAX_REQUESTS', 0)),
+                        help='recycle a worker after this many requests (0: never)')
+    parser.add_argument('--keepalive', type=int, default=int(env('NERV9_KEEPALIVE', 5)))
+    return parser.parse_args()
+
+
+def run_gunicorn(args):
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': args.worker_class,
+        'threads': args.threads,
+        'worker_connections': args.worker_connections,
+        'graceful_timeout': args.graceful_timeout,
+        'timeout': args.timeout,
+        'keepalive': args.keepalive,
+        'max_requests': args.max_requests,
+        # Spread recycling out so workers do not restart together
+        'max_requests_jitter': args.max_requests // 10,
+        # Each worker imports the app itself, after the fork, so no threads or
+        # sockets are shared across processes
+        'preload_app': False,
+        'post_worker_init': post_worker_init,
+        'accesslog': '-' if os.environ.get('NERV9_ACCESS_LOG', '0') == '1' else None,
+        'proc_name': 'nerv9-radio'
+    }
+    GunicornApplication(options).run()
+
+
+def run_threaded(args):
+    from werkzeug.serving import make_server
+
+    import app
+    if args.workers > 1:
+        log.warning("gunicorn is not installed; serving from one process with %d threads", args.threads)
+    app.start_background_jobs()
+    host, _, port = args.bind.rpartition(':')
+    server = make_server(host or '0.0.0.0', int(port), app.app, threaded=True)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it has to run elsewhere
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    log.info("Serving on http://%s", args.bind)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    args = parse_args()
+    if args.workers > 1:
+        # Set before the workers import the app, so they all use the host-wide cache
+        os.environ.setdefault('NERV9_SHARED_CACHE', '1')
+    if BaseApplication is None or args.worker_class != 'gevent':
+        # Each open stream pins a thread here; keep most of them for API requests
+        os.environ.setdefault('NERV9_MAX_STREAMS', str(max(args.threads // 4, 1)))
+    if BaseApplication is not None:
+        run_gunicorn(args)
+    else:
+        run_threaded(args)
+
+
+if __name__ == '__main__':
+    main()
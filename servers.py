@@ -0,0 +1,335 @@
+"""Latency-ranked radio-browser.info server selection"""
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from upstream import UpstreamUnavailable
+
+log = logging.getLogger(__name__)
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ServerState:
+    """Moving-average latency, error rate and circuit breaker for one mirror"""
+
+    def __init__(self, url, alpha=0.2, window=200):
+        self.url = url
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.breaker = CLOSED
+        self.opened_at = 0.0
+        self.cooldown = 0.0
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+
+    def p95(self):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+    def score(self):
+        # Unmeasured servers rank as moderately fast so they get tried
+        latency = self.latency if self.latency is not None else 0.5
+        return latency * (1 + 4 * self.error_rate)
+
+    def snapshot(self):
+        p95 = self.p95()
+        return {
+            "url": self.url,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "breaker": self.breaker,
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+
+class ServerManager:
+    """Discovers mirrors via DNS, ranks them and sends deadline-bounded requests.
+
+    A server that fails ``failure_threshold`` times in a row has its breaker
+    opened; after a cooldown one trial request is let through (half-open)
+    and its outcome closes or re-opens the breaker with a doubled cooldown.
+
+    The mirror list is resolved on first use and then refreshed every
+    ``rediscover_interval`` seconds off the request path, by
+    ``start_background_discovery`` or, failing that, by one background
+    thread started by the first request to find it out of date.
+    """
+
+    def __init__(self, http, fallback_servers, dns_name='all.api.radio-browser.info',
+                 static_servers=None, rediscover_interval=3600, failure_threshold=3,
+                 cooldown=30, max_cooldown=300, min_hedge_delay=0.05,
+                 max_hedge_delay=2.0, max_workers=32):
+        self.http = http
+        self.fallback_servers = list(fallback_servers)
+        self.dns_name = dns_name
+        self.static_servers = list(static_servers or [])
+        self.rediscover_interval = rediscover_interval
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upstream')
+        self._lock = threading.Lock()
+        # Held while resolving, so concurrent callers never resolve at once
+        self._discover_lock = threading.Lock()
+        self._servers = {}
+        self._discovered_at = None
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+
+    def discover(self):
+        """Resolve the mirror list from DNS, falling back to the known servers"""
+        with self._discover_lock:
+            return self._discover()
+
+    def _discover(self):
+        if self.static_servers:
+            urls = self.static_servers
+        else:
+            urls = []
+            try:
+                infos = socket.getaddrinfo(self.dns_name, 443, proto=socket.IPPROTO_TCP)
+                for ip in sorted({info[4][0] for info in infos}):
+                    try:
+                        host = socket.gethostbyaddr(ip)[0]
+                    except OSError:
+                        continue
+                    url = f"https://{host}"
+                    if url not in urls:
+                        urls.append(url)
+            except OSError as e:
+                log.warning("DNS discovery failed name=%s error=%r", self.dns_name, str(e))
+            if not urls:
+                urls = self.fallback_servers
+
+        with self._lock:
+            for url in urls:
+                if url not in self._servers:
+                    self._servers[url] = ServerState(url)
+            for url in list(self._servers):
+                if url not in urls:
+                    del self._servers[url]
+            self._discovered_at = time.monotonic()
+        return urls
+
+    def _ensure_discovered(self):
+        if self._discovered_at is None:
+            # Nothing to rank yet: the first callers wait for one resolution
+            with self._discover_lock:
+                if self._discovered_at is None:
+                    self._discover()
+        elif time.monotonic() - self._discovered_at > self.rediscover_interval:
+            # Reverse DNS for every mirror is slow; keep serving the current list meanwhile
+            self._rediscover_in_background()
+
+    def _rediscover_in_background(self):
+        if not self._discover_lock.acquire(blocking=False):
+            return
+        def run():
+            try:
+                self._discover()
+            except Exception:
+                log.exception("Server rediscovery failed")
+            finally:
+                self._discover_lock.release()
+        threading.Thread(target=run, name='server-discovery', daemon=True).start()
+
+    def start_background_discovery(self):
+        """Refresh the mirror list every ``rediscover_interval`` seconds in a background thread"""
+        def run():
+            while True:
+                time.sleep(self.rediscover_interval)
+                try:
+                    self.discover()
+                except Exception:
+                    log.exception("Server rediscovery failed")
+        thread = threading.Thread(target=run, name='server-rediscovery', daemon=True)
+        thread.start()
+        return thread
+
+    def ranked(self):
+        """Servers whose breaker allows a request, best first"""
+        self._ensure_discovered()
+        now = time.monotonic()
+        with self._lock:
+            available = []
+            for state in self._servers.values():
+                if state.breaker == OPEN and now - state.opened_at >= state.cooldown:
+                    state.breaker = HALF_OPEN
+                    state.trial_in_flight = False
+                if state.breaker == CLOSED:
+                    available.append(state)
+                elif state.breaker == HALF_OPEN and not state.trial_in_flight:
+                    available.append(state)
+            available.sort(key=ServerState.score)
+            if not available:
+                # Every breaker is open: try the least-bad servers anyway
+                available = sorted(self._servers.values(), key=ServerState.score)
+            return available
+
+    def ranked_urls(self):
+        return [state.url for state in self.ranked()]
+
+    def _record(self, state, elapsed, ok):
+        with self._lock:
+            state.requests += 1
+            state.error_rate += state.alpha * ((0.0 if ok else 1.0) - state.error_rate)
+            if ok:
+                state.samples.append(elapsed)
+                state.latency = elapsed if state.latency is None else \
+                    state.latency + state.alpha * (elapsed - state.latency)
+                state.consecutive_failures = 0
+                state.breaker = CLOSED
+                state.cooldown = 0.0
+            else:
+                state.failures += 1
+                state.consecutive_failures += 1
+                if state.breaker == HALF_OPEN or state.consecutive_failures >= self.failure_threshold:
+                    state.cooldown = min(max(state.cooldown * 2, self.base_cooldown), self.max_cooldown)
+                    state.breaker = OPEN
+                    state.opened_at = time.monotonic()
+            state.trial_in_flight = False
+
+    def _attempt(self, state, path, params, timeout):
+        with self._lock:
+            if state.breaker == HALF_OPEN:
+                state.trial_in_flight = True
+        started = time.perf_counter()
+        try:
+            response = self.http.get(f"{state.url}{path}", params=params, timeout=timeout)
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            self._record(state, elapsed, False)
+            metrics.observe_upstream(state.url, elapsed, e.__class__.__name__)
+            raise
+        elapsed = time.perf_counter() - started
+        # A 4xx is the request's fault, not the mirror's; only 5xx counts against it
+        ok = response.status_code < 500
+        self._record(state, elapsed, ok)
+        metrics.observe_upstream(state.url, elapsed, str(response.status_code))
+        if not ok:
+            raise UpstreamUnavailable(f"{state.url} returned {response.status_code}")
+        return response
+
+    def hedge_delay(self, state):
+        p95 = state.p95()
+        if p95 is None:
+            return self.max_hedge_delay / 4
+        return min(max(p95, self.min_hedge_delay), self.max_hedge_delay)
+
+    def request(self, path, params=None, timeout=15, deadline=20, hedge=False):
+        """GET ``path`` from the best available server within ``deadline`` seconds.
+
+        Failed attempts move on to the next server. With ``hedge`` a second
+        request is sent to the next-best server when the first has not
+        answered within its p95 latency; the first success wins. A 4xx
+        answer is returned as is, for the caller to check: it is neither
+        retried elsewhere nor counted against the server.
+        """
+        started = time.perf_counter()
+        try:
+            return self._request(path, params, timeout, deadline, hedge)
+        finally:
+            metrics.record_span('upstream', path, time.perf_counter() - started)
+
+    def _request(self, path, params, timeout, deadline, hedge):
+        expires = time.monotonic() + deadline
+        candidates = deque(self.ranked())
+        pending = {}
+        last_error = None
+
+        def launch():
+            state = candidates.popleft()
+            remaining = expires - time.monotonic()
+            future = self._executor.submit(self._attempt, state, path, params,
+                                           max(min(timeout, remaining), 0.1))
+            pending[future] = state
+            return state
+
+        while candidates or pending:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                break
+            if not pending:
+                launch()
+            primary = next(iter(pending.values()))
+            wait_for = remaining
+            if hedge and candidates and len(pending) == 1:
+                wait_for = min(remaining, self.hedge_delay(primary))
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            if not done:
+                if hedge and candidates and len(pending) == 1:
+                    with self._lock:
+                        self.hedged_requests += 1
+                    launch()
+                continue
+            for future in done:
+                state = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = f"{state.url}: {str(e)}"
+                    continue
+                if state is not primary:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return response
+
+        raise UpstreamUnavailable(last_error or f"Deadline exceeded for {path}")
+
+    def probe(self, path='/json/stats', timeout=3.0):
+        """Send one request to every server at once, seeding their latency and breakers.
+
+        Returns {url: seconds} for the servers that answered, fastest first.
+        """
+        self._ensure_discovered()
+        with self._lock:
+            states = list(self._servers.values())
+        futures = {}
+        for state in states:
+            futures[self._executor.submit(self._timed_attempt, state, path, timeout)] = state
+        answered = {}
+        done, _ = wait(futures, timeout=timeout + 1)
+        for future in done:
+            elapsed = future.result()
+            if elapsed is not None:
+                answered[futures[future].url] = elapsed
+        return dict(sorted(answered.items(), key=lambda item: item[1]))
+
+    def _timed_attempt(self, state, path, timeout):
+        started = time.perf_counter()
+        try:
+            self._attempt(state, path, None, timeout)
+        except Exception:
+            return None
+        return time.perf_counter() - started
+
+    def breaker_states(self):
+        with self._lock:
+            return {url: state.breaker for url, state in self._servers.items()}
+
+    def stats(self):
+        with self._lock:
+            servers = [state.snapshot() for state in self._servers.values()]
+        return {
+            "servers": servers,
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins
+        }
@@ -0,0 +1,111 @@
+"""Cross-process cache in a SQLite file on shared memory, shared by all workers on a host"""
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import db
+from cachebackend import CacheBackend, decode_value, encode_key
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS entries
+            (key TEXT PRIMARY KEY,
+             value BLOB,
+             stored_at REAL,
+             expires_at REAL)'''
+
+
+def default_path():
+    """A per-user file on /dev/shm where available, so the cache never touches disk"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, f"nerv9-cache-{os.getuid() if hasattr(os, 'getuid') else 'user'}.db")
+
+
+class SharedCache(CacheBackend):
+    """Encoded values in a SQLite file that every worker on the host reads and writes.
+
+    Expired rows are pruned every ``prune_every`` writes, along with the
+    oldest rows beyond ``maxsize``. Workers read through to the file on
+    every local miss, so no notifications are sent between them.
+    """
+
+    name = 'shared'
+
+    def __init__(self, path=None, maxsize=4096, prune_every=256, compress_min_size=1024):
+        super().__init__(compress_min_size)
+        self.path = path or default_path()
+        self.maxsize = maxsize
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self):
+        conn = db.get_connection(self.path)
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    with conn:
+                        conn.execute(SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def get(self, key):
+        try:
+            row = self._conn().execute("SELECT value, stored_at FROM entries WHERE key=? AND expires_at > ?",
+                                       (encode_key(key), time.time())).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value = decode_value(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            self.errors += 1
+            log.warning("Shared cache read failed error=%r", str(e))
+            return None
+        self.hits += 1
+        return value, max(time.time() - row[1], 0.0)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                             (encode_key(key), self.encode(value), now, now + ttl))
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % self.prune_every == 0
+            if prune:
+                self.prune()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.errors += 1
+            log.warning("Shared cache write failed error=%r", str(e))
+
+    def delete(self, key):
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM entries WHERE key=?", (encode_key(key),))
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.warning("Shared cache delete failed error=%r", str(e))
+
+    def prune(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+            conn.execute("""DELETE FROM entries WHERE key IN
+                            (SELECT key FROM entries ORDER BY stored_at DESC LIMIT -1 OFFSET ?)""",
+                         (self.maxsize,))
+
+    def stats(self):
+        stats = super().stats()
+        try:
+            stats["size"] = self._conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        except sqlite3.Error:
+            stats["size"] = None
+        stats.update(path=self.path, maxsize=self.maxsize)
+        return stats
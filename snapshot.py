@@ -0,0 +1,330 @@
+"""Persistent last-known-good station snapshot in a memory-mapped binary file"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no cross-process locking; fine for a single process
+    fcntl = None
+
+from suggest import fold
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'NERV9SNP'
+VERSION = 1
+
+# magic, version, station count, written at, search text length, string heap length
+HEADER = struct.Struct('<8sIIIII')
+STRING_FIELDS = ('uuid', 'name', 'url', 'country', 'language', 'tags', 'favicon', 'codec')
+# (offset, length) into the string heap per string field, then bitrate, votes, seen at
+RECORD = struct.Struct('<' + 'II' * len(STRING_FIELDS) + 'iiI')
+OFFSET = struct.Struct('<I')
+
+
+def search_text(station):
+    """Folded name and tags as stored in the search column"""
+    return f"{fold(station.get('name') or '')}\x1f{fold(station.get('tags') or '')}\n"
+
+
+class SnapshotView:
+    """Read-only view over one snapshot file.
+
+    Layout after the header, all little-endian: fixed-width records sorted
+    by votes (descending), record numbers sorted by uuid, the start offset
+    of each record's search text, the search text itself and the string
+    heap. Nothing is decoded up front; records are unpacked as they are read.
+    """
+
+    def __init__(self, data=b''):
+        self.data = data
+        self.count = 0
+        self.written_at = None
+        if len(data) < HEADER.size:
+            return
+        magic, version, count, written_at, text_length, heap_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a station snapshot")
+        self.records_at = HEADER.size
+        self.uuid_order_at = self.records_at + count * RECORD.size
+        self.text_offsets_at = self.uuid_order_at + count * OFFSET.size
+        self.text_at = self.text_offsets_at + (count + 1) * OFFSET.size
+        self.heap_at = self.text_at + text_length
+        if len(data) < self.heap_at + heap_length:
+            raise ValueError("Truncated station snapshot")
+        self.text_offsets = memoryview(data)[self.text_offsets_at:self.text_at].cast('I')
+        self.count = count
+        self.written_at = written_at
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return cls()
+            # The mapping outlives the file object, and the file being replaced
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _string(self, offset, length):
+        start = self.heap_at + offset
+        return bytes(self.data[start:start + length]).decode('utf-8')
+
+    def record(self, index, seen_at=False):
+        fields = RECORD.unpack_from(self.data, self.records_at + index * RECORD.size)
+        station = {name: self._string(fields[2 * i], fields[2 * i + 1])
+                   for i, name in enumerate(STRING_FIELDS)}
+        station['bitrate'], station['votes'] = fields[-3:-1]
+        if seen_at:
+            station['seen_at'] = fields[-1]
+        return station
+
+    def _uuid_at(self, position):
+        index = OFFSET.unpack_from(self.data, self.uuid_order_at + position * OFFSET.size)[0]
+        offset, length = struct.unpack_from('<II', self.data, self.records_at + index * RECORD.size)
+        return index, self._string(offset, length)
+
+    def get(self, uuid):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            index, found = self._uuid_at(middle)
+            if found == uuid:
+                return self.record(index)
+            if found < uuid:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def popular(self, limit):
+        return [self.record(index) for index in range(min(limit, self.count))]
+
+    def search(self, query, limit):
+        """Stations whose folded name or tags contain ``query``, by votes"""
+        needle = fold(query).encode('utf-8')
+        if not needle or not self.count:
+            return []
+        end = self.heap_at
+        position = self.text_at
+        stations = []
+        while len(stations) < limit:
+            position = self.data.find(needle, position, end)
+            if position < 0:
+                break
+            index = bisect_right(self.text_offsets, position - self.text_at) - 1
+            stations.append(self.record(index))
+            # Carry on from the next record, so each station matches once
+            position = self.text_at + self.text_offsets[index + 1]
+        return stations
+
+    def stations(self, seen_at=False):
+        return [self.record(index, seen_at) for index in range(self.count)]
+
+
+def encode(stations, written_at):
+    """Snapshot file contents for ``stations``, which must already be sorted by votes"""
+    heap = bytearray()
+    strings = {}
+    text = bytearray()
+    text_offsets = []
+    records = bytearray(len(stations) * RECORD.size)
+    for index, station in enumerate(stations):
+        fields = []
+        for name in STRING_FIELDS:
+            value = (station.get(name) or '').encode('utf-8')
+            offset = strings.get(value)
+            if offset is None:
+                # Countries, languages and codecs repeat; store each distinct string once
+                offset = strings[value] = len(heap)
+                heap += value
+            fields += (offset, len(value))
+        RECORD.pack_into(records, index * RECORD.size, *fields,
+                         int(station.get('bitrate') or 0), int(station.get('votes') or 0),
+                         int(station.get('seen_at') or written_at))
+        text_offsets.append(len(text))
+        text += search_text(station).encode('utf-8')
+    text_offsets.append(len(text))
+    uuid_order = sorted(range(len(stations)), key=lambda index: stations[index]['uuid'])
+    return b''.join((
+        HEADER.pack(MAGIC, VERSION, len(stations), int(written_at), len(text), len(heap)),
+        bytes(records),
+        struct.pack(f'<{len(uuid_order)}I', *uuid_order),
+        struct.pack(f'<{len(text_offsets)}I', *text_offsets),
+        bytes(text),
+        bytes(heap)
+    ))
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on ``path``, held for the block"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class StationSnapshot:
+    """Last-known-good stations, kept on disk so outages can be served from them.
+
+    ``merge`` records stations from successful upstream responses in
+    memory; ``flush`` folds them into the file. Stations not seen for
+    ``max_age`` seconds are dropped, then the least voted beyond
+    ``max_stations``. The new file is written beside the old one and
+    renamed over it, so readers (and a crash mid-write) only ever see a
+    complete snapshot. Reads go through the memory-mapped file. Several
+    processes can share one snapshot: flushes take a lock file and merge
+    into whatever the file holds at that moment.
+    """
+
+    def __init__(self, path, max_stations=20000, max_age=30 * 86400):
+        self.path = path
+        self.max_stations = max_stations
+        self.max_age = max_age
+        self._view = SnapshotView()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.loaded_ms = None
+        self.merged = 0
+        self.flushes = 0
+        self.evicted = 0
+        self.last_flush = None
+        self.last_flush_error = None
+
+    def load(self, seed=()):
+        """Map the snapshot file, writing one from ``seed`` if there is none yet"""
+        started = time.perf_counter()
+        try:
+            self._view = SnapshotView.open(self.path)
+        except FileNotFoundError:
+            if seed:
+                self.merge(seed)
+                self.flush()
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable station snapshot path=%s error=%r", self.path, str(e))
+            if seed:
+                self.merge(seed)
+                self.flush()
+        self.loaded_ms = (time.perf_counter() - started) * 1000
+        return self
+
+    def __len__(self):
+        return self._view.count
+
+    def merge(self, stations):
+        now = int(time.time())
+        with self._lock:
+            for station in stations:
+                if station.get('uuid') and station.get('url'):
+                    self._pending[station['uuid']] = dict(station, seen_at=now)
+                    self.merged += 1
+
+    def flush(self):
+        """Write pending stations into a new snapshot file; returns False if there were none"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return False
+            with file_lock(f"{self.path}.lock"):
+                return self._write(pending)
+
+    def _write(self, pending):
+        try:
+            # Another process may have written since this one last looked
+            self._view = SnapshotView.open(self.path)
+        except (OSError, ValueError):
+            pass
+        now = int(time.time())
+        stations = {station['uuid']: station for station in self._view.stations(seen_at=True)}
+        total = len(stations.keys() | pending.keys())
+        stations.update(pending)
+        stations = sorted((station for station in stations.values()
+                           if now - (station.get('seen_at') or now) <= self.max_age),
+                          key=lambda station: station.get('votes') or 0, reverse=True)
+        stations = stations[:self.max_stations]
+        self.evicted += total - len(stations)
+
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(encode(stations, now))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self._view = SnapshotView.open(self.path)
+        except OSError as e:
+            # Keep what we have; the stations are merged again on the next success
+            self.last_flush_error = str(e)
+            log.error("Could not write station snapshot error=%r", str(e))
+            return False
+        self.flushes += 1
+        self.last_flush = now
+        self.last_flush_error = None
+        return True
+
+    def reload(self):
+        """Map the file again, picking up snapshots written by other processes"""
+        try:
+            self._view = SnapshotView.open(self.path)
+        except (OSError, ValueError):
+            pass
+
+    def start_background_flush(self, interval=60):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    if not self.flush():
+                        self.reload()
+                except Exception as e:
+                    self.last_flush_error = str(e)
+                    log.exception("Station snapshot flush failed")
+
+        thread = threading.Thread(target=run, name='snapshot-flush', daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, uuid):
+        return self._view.get(uuid)
+
+    def popular(self, limit):
+        return self._view.popular(limit)
+
+    def search(self, query, limit):
+        return self._view.search(query, limit)
+
+    def stations(self):
+        return self._view.stations()
+
+    def stats(self):
+        view = self._view
+        try:
+            file_bytes = os.path.getsize(self.path)
+        except OSError:
+            file_bytes = 0
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "stations": view.count,
+            "file_bytes": file_bytes,
+            "written_at": view.written_at,
+            "pending": pending,
+            "merged": self.merged,
+            "flushes": self.flushes,
+            "evicted": self.evicted,
+            "loaded_ms": self.loaded_ms,
+            "last_flush": self.last_flush,
+            "last_flush_error": self.last_flush_error
+        }
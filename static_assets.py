@@ -0,0 +1,60 @@
+"""Prebuilt, precompressed static responses for the app shell"""
+import gzip
+import hashlib
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# For URLs that embed the content hash
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# For fixed URLs: cache, but revalidate with the ETag every time
+REVALIDATE = 'no-cache'
+
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()[:16]
+
+
+class StaticAsset:
+    """A response body encoded once, in identity, gzip and (if available) brotli form"""
+
+    def __init__(self, body, content_type):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.content_type = content_type
+        self.etag = content_hash(body)
+        self.encodings = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(body, quality=11)
+
+    def pick_encoding(self, accept_encodings):
+        """Smallest encoding the client accepts"""
+        best = 'identity'
+        for name, body in self.encodings.items():
+            if name != 'identity' and accept_encodings[name] > 0 and len(body) < len(self.encodings[best]):
+                best = name
+        return best
+
+    def response(self, request, cache_control=REVALIDATE):
+        encoding = self.pick_encoding(request.accept_encodings)
+        # Each encoding is a distinct representation, so each gets its own strong ETag
+        etag = self.etag if encoding == 'identity' else f"{self.etag}-{encoding}"
+        headers = {'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if etag in request.if_none_match:
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(self.encodings[encoding], content_type=self.content_type, headers=headers)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        return response
+
+    def sizes(self):
+        return {name: len(body) for name, body in self.encodings.items()}
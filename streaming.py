@@ -0,0 +1,87 @@
+"""Admission control for long-lived streaming responses (relayed audio, now-playing events)"""
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+def cooperative():
+    """True when requests run on greenlets (a gevent worker), where an open stream costs no thread"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading') and monkey.is_module_patched('socket')
+
+
+class StreamSlots:
+    """Bounds the streaming responses open at once in this process.
+
+    Under a threaded server every open stream holds a request thread for
+    as long as the client stays connected, so without a bound a handful of
+    listeners would starve API requests. ``limit`` None means unbounded,
+    for cooperative workers. Slots are released when the response is
+    closed, including when the client disconnects.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.open = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def acquire(self):
+        with self._lock:
+            if self.limit is not None and self.open >= self.limit:
+                self.rejected += 1
+                return False
+            self.open += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+    def wrap(self, iterable):
+        """``iterable`` holding an acquired slot until it is exhausted or closed"""
+        return SlotIterator(self, iterable)
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "open": self.open,
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+
+class SlotIterator:
+    """Releases its slot exactly once, even if iteration never started"""
+
+    def __init__(self, slots, iterable):
+        self.slots = slots
+        self.iterator = iter(iterable)
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            close = getattr(self.iterator, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.slots.release()
@@ -0,0 +1,118 @@
+"""Typeahead completions from an in-memory prefix index"""
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+
+
+def fold(text):
+    """Lower-case ``text`` and strip diacritics, so "Café" and "cafe" compare equal"""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(ch for ch in decomposed if not unicodedata.combining(ch)).split())
+
+
+class PrefixSnapshot:
+    """Immutable prefix index: sorted folded keys, each pointing at a weighted entry.
+
+    Station names are keyed at each of their first ``max_words`` word
+    starts, so "radio" completes "BBC Radio 1"; tags and countries are
+    keyed once. The top ``k`` entries of every prefix up to
+    ``precompute_length`` characters are computed at build time, since
+    those prefixes cover the largest key ranges.
+    """
+
+    def __init__(self, entries, k=10, precompute_length=3, max_words=4):
+        self.k = k
+        self.precompute_length = precompute_length
+        # Entries are (text, type, weight, uuid)
+        self.entries = entries
+        keys = []
+        for entry_id, (text, kind, _, _) in enumerate(entries):
+            words = fold(text).split()
+            starts = range(min(len(words), max_words)) if kind == 'station' else (0,)
+            keys.extend((' '.join(words[start:]), entry_id) for start in starts)
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.ids = [entry_id for _, entry_id in keys]
+        self.top = {}
+        for length in range(1, precompute_length + 1):
+            for prefix in {key[:length] for key in self.keys if len(key) >= length}:
+                self.top[prefix] = self._scan(prefix)
+
+    def _scan(self, prefix):
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+        entries = self.entries
+        # A station name can be keyed more than once under one prefix ("radio radio")
+        return heapq.nlargest(self.k, set(self.ids[start:end]), key=lambda entry_id: entries[entry_id][2])
+
+    def complete(self, prefix, k):
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        entry_ids = self.top.get(prefix) if len(prefix) <= self.precompute_length else None
+        if entry_ids is None:
+            entry_ids = self._scan(prefix)
+        return [self.entries[entry_id] for entry_id in entry_ids[:k]]
+
+
+class SuggestIndex:
+    """Serves completions from a PrefixSnapshot that can be rebuilt while in use.
+
+    A rebuild constructs a new snapshot off to the side and replaces the
+    reference in one assignment, so lookups never wait for it.
+    """
+
+    def __init__(self, k=10, precompute_length=3):
+        self.k = k
+        self.precompute_length = precompute_length
+        self._snapshot = PrefixSnapshot([], k, precompute_length)
+        self._rebuild_lock = threading.Lock()
+        self.rebuilds = 0
+        self.last_rebuild_ms = None
+        self.last_rebuild = None
+        self.lookups = 0
+
+    def rebuild(self, stations):
+        """Index station names (by votes) and their tags and countries (by summed votes)"""
+        with self._rebuild_lock:
+            started = time.perf_counter()
+            names = {}
+            groups = {'tag': {}, 'country': {}}
+            for station in stations:
+                name = ' '.join((station.get('name') or '').split())
+                votes = station.get('votes') or 0
+                if name and (name not in names or votes > names[name][2]):
+                    names[name] = (name, 'station', votes, station.get('uuid'))
+                for tag in (station.get('tags') or '').split(','):
+                    tag = tag.strip().lower()
+                    if tag:
+                        groups['tag'][tag] = groups['tag'].get(tag, 0) + votes + 1
+                country = (station.get('country') or '').strip()
+                if country:
+                    groups['country'][country] = groups['country'].get(country, 0) + votes + 1
+            entries = list(names.values())
+            for kind, weights in groups.items():
+                entries.extend((text, kind, weight, None) for text, weight in weights.items())
+            self._snapshot = PrefixSnapshot(entries, self.k, self.precompute_length)
+            self.rebuilds += 1
+            self.last_rebuild = time.time()
+            self.last_rebuild_ms = (time.perf_counter() - started) * 1000
+
+    def suggest(self, prefix, k=None):
+        self.lookups += 1
+        return [{"text": text, "type": kind, "uuid": uuid, "weight": weight}
+                for text, kind, weight, uuid in self._snapshot.complete(prefix, k or self.k)]
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "entries": len(snapshot.entries),
+            "keys": len(snapshot.keys),
+            "precomputed_prefixes": len(snapshot.top),
+            "rebuilds": self.rebuilds,
+            "last_rebuild": self.last_rebuild,
+            "last_rebuild_ms": self.last_rebuild_ms,
+            "lookups": self.lookups
+        }
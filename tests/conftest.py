@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+# The backend modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py opens its files at import; keep them out of the working tree
+_runtime = tempfile.mkdtemp(prefix='nerv9-tests-')
+os.environ.setdefault('NERV9_DB_PATH', os.path.join(_runtime, 'nerv9_radio.db'))
+os.environ.setdefault('NERV9_SNAPSHOT_PATH', os.path.join(_runtime, 'nerv9_stations.snapshot'))
+os.environ.setdefault('NERV9_FAVICON_DIR', os.path.join(_runtime, 'favicon_cache'))
+os.environ.setdefault('NERV9_LOG_LEVEL', 'warning')
+# Background jobs start on the first request; keep them off the network
+os.environ.setdefault('NERV9_RADIO_BROWSER_SERVERS', 'http://127.0.0.1:9')
+os.environ.setdefault('NERV9_CATALOG_SYNC', '0')
+os.environ.setdefault('NERV9_PROBER', '0')
+os.environ.setdefault('NERV9_WARMUP', '0')
@@ -0,0 +1,49 @@
+import pytest
+
+import app
+
+
+def test_first_request_prepares_the_app_under_any_wsgi_server():
+    client = app.app.test_client()
+    response = client.get('/api/health')
+    assert response.status_code == 200
+    assert response.json['ready']
+    # Tables exist without start_background_jobs() having been called by a launcher
+    assert client.get('/api/favorites?user_id=first-request').json['count'] == 0
+
+
+def raw_stations(count):
+    return [{'stationuuid': f'00000000-0000-0000-0000-{i:012x}', 'name': f'Station {i}',
+             'url': f'http://stream.invalid/{i}', 'votes': count - i} for i in range(count)]
+
+
+@pytest.mark.parametrize('limit, expected', [(-1, 1), (0, 1), (100000, app.MAX_STATIONS_LIMIT)])
+def test_station_list_limits_are_bounded(monkeypatch, limit, expected):
+    requested = []
+
+    def fetch(limit):
+        requested.append(limit)
+        return [app.format_station(station) for station in raw_stations(limit)]
+
+    app.STATION_CACHE.clear()
+    monkeypatch.setattr(app, 'fetch_popular_stations', fetch)
+    monkeypatch.setattr(app, 'fetch_search_results', lambda query, limit: fetch(limit))
+    client = app.app.test_client()
+    for path in (f'/api/stations/popular?limit={limit}', f'/api/stations/search?q=bounded&limit={limit}'):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.json['count'] == expected
+    assert requested == [expected, expected]
+
+
+def test_malformed_uuids_are_rejected_without_a_lookup(monkeypatch):
+    def lookup(uuid):
+        raise AssertionError(f"looked up {uuid!r}")
+
+    monkeypatch.setattr(app, 'lookup_station', lookup)
+    monkeypatch.setattr(app, 'RELAY_ENABLED', True)
+    client = app.app.test_client()
+    assert client.get('/api/favicon/not-a-station').status_code == 400
+    assert client.get('/api/stream/not-a-station').status_code == 400
+    assert client.get('/api/nowplaying/stream?uuid=not-a-station').status_code == 400
+    assert client.get('/api/nowplaying/stream').status_code == 400
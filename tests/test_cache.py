@@ -0,0 +1,30 @@
+from cache import TTLCache
+from cachebackend import MemoryBackend
+
+KEY = ('popular', '', 20)
+STATIONS = [{'uuid': 'a', 'name': 'Station A'}]
+
+
+def test_values_from_the_shared_tier_are_filled_in_every_cache():
+    backend = MemoryBackend()
+    filled = {'first': [], 'second': []}
+    first = TTLCache(shared=backend, on_fill=filled['first'].append)
+    second = TTLCache(shared=backend, on_fill=filled['second'].append)
+
+    assert first.get_or_load(KEY, lambda: STATIONS) == STATIONS
+
+    def unexpected_load():
+        raise AssertionError("the shared copy should have been used")
+
+    assert second.get_or_load(KEY, unexpected_load) == STATIONS
+    assert second.shared_hits == 1
+    assert filled == {'first': [STATIONS], 'second': [STATIONS]}
+
+
+def test_prefetched_shared_values_are_filled():
+    backend = MemoryBackend()
+    TTLCache(shared=backend).set(KEY, STATIONS)
+    filled = []
+    cache = TTLCache(shared=backend, on_fill=filled.append)
+    assert cache.prefetch(KEY, lambda: [], max_age=60) is False
+    assert filled == [STATIONS]
@@ -0,0 +1,92 @@
+import pytest
+
+from catalog import StationCatalog, iter_json_array
+
+
+def test_iter_json_array_yields_elements_split_across_chunks():
+    chunks = ['[{"a":', '1}, {"b"', ':2}', ']']
+    assert list(iter_json_array(chunks)) == [{'a': 1}, {'b': 2}]
+
+
+def test_iter_json_array_joins_numbers_split_across_chunks():
+    assert list(iter_json_array(['[12', '34]'])) == [1234]
+    assert list(iter_json_array(['[1, 2', ' ]'])) == [1, 2]
+
+
+def test_iter_json_array_empty_array():
+    assert list(iter_json_array(['  [', ' ]'])) == []
+
+
+@pytest.mark.parametrize('chunks', [
+    [],
+    ['['],
+    ['[{"a":1},{"b":2},{"c"'],
+    ['[{"a":1},{"b":2}'],
+    ['[1, 2'],
+])
+def test_iter_json_array_rejects_truncated_arrays(chunks):
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunks))
+
+
+def test_iter_json_array_rejects_non_arrays():
+    with pytest.raises(ValueError):
+        list(iter_json_array(['{"a": 1}']))
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.encoding = None
+
+    def iter_content(self, chunk_size=None, decode_unicode=False):
+        return iter(self.chunks)
+
+    def close(self):
+        pass
+
+
+class FakeHTTP:
+    def __init__(self):
+        self.chunks = []
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        return FakeResponse(self.chunks)
+
+
+def station(uuid):
+    return ('{"stationuuid": "%s", "name": "Station %s", "url": "http://stream.invalid/%s", '
+            '"changeuuid": "c-%s", "votes": 1, "lastcheckok": 1}' % (uuid, uuid, uuid, uuid))
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    http = FakeHTTP()
+    catalog = StationCatalog(str(tmp_path / 'catalog.db'), lambda: ['http://mirror.invalid'], http)
+    catalog.init_schema()
+    return catalog, http
+
+
+def test_full_sync_replaces_the_mirror(catalog):
+    catalog, http = catalog
+    http.chunks = ['[' + ','.join(station(uuid) for uuid in 'abc') + ']']
+    assert catalog.full_sync() == 3
+    http.chunks = ['[' + station('a') + ']']
+    assert catalog.full_sync() == 1
+    assert catalog.get('a') is not None
+    assert catalog.get('b') is None
+
+
+def test_truncated_full_sync_keeps_stations_it_did_not_receive(catalog):
+    catalog, http = catalog
+    http.chunks = ['[' + ','.join(station(uuid) for uuid in 'abc') + ']']
+    catalog.full_sync()
+    last_full_sync = catalog._get_meta('last_full_sync')
+
+    http.chunks = ['[' + station('a') + ',', station('b')[:20]]
+    with pytest.raises(ValueError):
+        catalog.full_sync()
+    assert all(catalog.get(uuid) is not None for uuid in 'abc')
+    assert catalog._get_meta('last_full_sync') == last_full_sync
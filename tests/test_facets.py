@@ -0,0 +1,89 @@
+import random
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from facets import FacetIndex, filters_from_args, station_matches
+
+STATIONS = [
+    {'uuid': 'a', 'name': 'Jazz DE', 'country': 'Germany', 'language': 'german', 'tags': 'jazz,blues',
+     'codec': 'MP3', 'bitrate': 128, 'votes': 50},
+    {'uuid': 'b', 'name': 'Jazz FR', 'country': 'France', 'language': 'french', 'tags': 'jazz',
+     'codec': 'AAC', 'bitrate': 64, 'votes': 90},
+    {'uuid': 'c', 'name': 'Rock DE', 'country': 'Germany', 'language': 'german,english', 'tags': 'rock',
+     'codec': 'MP3', 'bitrate': 320, 'votes': 70},
+    {'uuid': 'd', 'name': 'Blues FR', 'country': 'France', 'language': 'french', 'tags': 'Blues',
+     'codec': 'MP3', 'bitrate': 192, 'votes': 10},
+]
+
+
+@pytest.fixture
+def index():
+    index = FacetIndex()
+    index.load(STATIONS)
+    return index
+
+
+def uuids(index, filters, limit=10):
+    return [station['uuid'] for station in index.top(index.select(filters), limit)]
+
+
+def test_filters_from_args_splits_and_normalizes():
+    args = MultiDict([('tag', 'Jazz, blues'), ('tag', 'rock'), ('country', 'Germany'), ('min_bitrate', '128')])
+    assert filters_from_args(args) == {'tag': {'jazz', 'blues', 'rock'}, 'country': {'germany'}, 'min_bitrate': 128}
+
+
+def test_values_of_one_dimension_are_alternatives(index):
+    assert uuids(index, {'tag': {'rock', 'blues'}}) == ['c', 'a', 'd']
+
+
+def test_dimensions_intersect(index):
+    assert uuids(index, {'tag': {'jazz'}, 'country': {'germany'}}) == ['a']
+    assert uuids(index, {'language': {'german'}, 'codec': {'mp3'}, 'min_bitrate': 200}) == ['c']
+    assert uuids(index, {'tag': {'jazz'}, 'country': {'nowhere'}}) == []
+
+
+def test_restrict_keeps_the_list_order(index):
+    listed = [dict(STATIONS[3]), dict(STATIONS[0]), {'uuid': 'unindexed'}]
+    assert [s['uuid'] for s in index.restrict(listed, {'tag': {'blues'}})] == ['d', 'a']
+    assert index.restrict(listed, {}) == listed
+
+
+def test_facet_counts(index):
+    counts = index.facets(index.select({'country': {'france'}}))
+    assert dict(counts['tag']) == {'jazz': 1, 'blues': 1}
+    assert dict(counts['codec']) == {'mp3': 1, 'aac': 1}
+
+
+def test_upsert_and_remove_update_the_postings(index):
+    index.upsert([dict(STATIONS[1], tags='rock', votes=100)])
+    assert uuids(index, {'tag': {'rock'}}) == ['b', 'c']
+    assert uuids(index, {'tag': {'jazz'}}) == ['a']
+    index.remove(['c'])
+    assert uuids(index, {'tag': {'rock'}}) == ['b']
+    assert index.get('c') is None
+
+
+def test_select_agrees_with_a_linear_scan():
+    rng = random.Random(7)
+    countries = ['Germany', 'France', 'Japan', 'Brazil']
+    tags = ['jazz', 'rock', 'news', 'talk', 'pop', 'rare']
+    stations = [{'uuid': str(i), 'name': f'S{i}', 'country': rng.choice(countries),
+                 'tags': ','.join(rng.sample(tags, rng.randint(0, 3))), 'codec': rng.choice(['MP3', 'AAC']),
+                 'bitrate': rng.choice([64, 128, 192]), 'votes': rng.randint(0, 1000)} for i in range(400)]
+    # A small sparse ratio leaves rare values as slot arrays, exercising both posting kinds
+    index = FacetIndex(sparse_ratio=8, facet_candidates=2)
+    index.load(stations[:300])
+    index.upsert(stations[300:])
+    index.remove([str(i) for i in range(0, 400, 9)])
+    live = [s for s in stations if int(s['uuid']) % 9]
+    for _ in range(50):
+        filters = {'tag': set(rng.sample(tags, rng.randint(1, 2)))}
+        if rng.random() < 0.5:
+            filters['country'] = {rng.choice(countries).lower()}
+        if rng.random() < 0.3:
+            filters['min_bitrate'] = 128
+        expected = sorted((s for s in live if station_matches(s, filters)), key=lambda s: -s['votes'])
+        got = index.top(index.select(filters), len(live))
+        assert [s['votes'] for s in got] == [s['votes'] for s in expected]
+        assert {s['uuid'] for s in got} == {s['uuid'] for s in expected}
@@ -0,0 +1,94 @@
+import io
+
+import pytest
+
+import favicons
+from favicons import FaviconCache, check_public_url
+
+PUBLIC = 'http://93.184.216.34'
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def iter_content(self, chunk_size=None):
+        yield self.body
+
+    def close(self):
+        pass
+
+
+class FakeHTTP:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requested = []
+
+    def get(self, url, timeout=None, stream=False, allow_redirects=True):
+        assert not allow_redirects
+        self.requested.append(url)
+        return self.responses[url]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    def make(responses, **kwargs):
+        cache = FaviconCache(str(tmp_path / 'icons'), FakeHTTP(responses), db_path=str(tmp_path / 'favicons.db'),
+                             **kwargs)
+        cache.init_schema()
+        return cache
+    return make
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1/icon.png',
+    'http://localhost/icon.png',
+    'http://10.1.2.3/icon.png',
+    'http://192.168.0.1/icon.png',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://[::1]/icon.png',
+    'http://[::ffff:127.0.0.1]/icon.png',
+    'ftp://example.com/icon.png',
+])
+def test_non_public_urls_are_refused(url):
+    with pytest.raises(ValueError):
+        check_public_url(url)
+
+
+def test_public_addresses_are_allowed():
+    check_public_url(PUBLIC + '/icon.png')
+
+
+def test_private_hosts_are_never_requested(cache):
+    cache = cache({})
+    assert cache.get('a', 'http://127.0.0.1:8080/admin') is None
+    assert cache.http.requested == []
+    assert cache.failures == 1
+
+
+def test_redirects_to_private_hosts_are_refused(cache):
+    cache = cache({PUBLIC + '/icon.png': FakeResponse(302, headers={'Location': 'http://169.254.169.254/'})})
+    assert cache.get('a', PUBLIC + '/icon.png') is None
+    assert cache.http.requested == [PUBLIC + '/icon.png']
+
+
+def test_public_redirects_are_followed(cache, monkeypatch):
+    monkeypatch.setattr(favicons, 'Image', None)
+    cache = cache({
+        PUBLIC + '/icon.png': FakeResponse(301, headers={'Location': '/static/icon.png'}),
+        PUBLIC + '/static/icon.png': FakeResponse(200, b'\x89PNG', {'Content-Type': 'image/png'}),
+    })
+    body, content_type, _ = cache.get('a', PUBLIC + '/icon.png')
+    assert (body, content_type) == (b'\x89PNG', 'image/png')
+
+
+def test_oversized_images_are_rejected_before_decoding(cache):
+    Image = pytest.importorskip('PIL.Image')
+    out = io.BytesIO()
+    Image.new('1', (4096, 4096)).save(out, format='PNG')
+    cache = cache({PUBLIC + '/bomb.png': FakeResponse(200, out.getvalue(), {'Content-Type': 'image/png'})},
+                  max_pixels=1024 * 1024)
+    assert cache.get('a', PUBLIC + '/bomb.png') is None
+    assert cache.failures == 1
@@ -0,0 +1,144 @@
+import sqlite3
+
+import pytest
+
+import db
+from favorites import ADDED, EXISTS, INVALID, MIGRATIONS, NOT_FOUND, REMOVED, FavoritesStore
+
+
+def uid(name):
+    """A station uuid standing for ``name``"""
+    return '00000000-0000-0000-0000-' + name.encode().hex().rjust(12, '0')
+
+
+def favorite(name, **fields):
+    return dict({'station_uuid': uid(name), 'station_name': f"Station {name}",
+                 'station_url': f"http://stream.invalid/{name}"}, **fields)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = FavoritesStore(str(tmp_path / 'favorites.db'))
+    store.init_schema()
+    return store
+
+
+def test_migrates_a_legacy_table_in_place(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE favorites
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, station_uuid TEXT, station_name TEXT,
+                     station_url TEXT, country TEXT, language TEXT, tags TEXT, favicon TEXT, added_date TEXT)''')
+    conn.executemany("INSERT INTO favorites (user_id, station_uuid, station_name, station_url, added_date) "
+                     "VALUES (?, ?, ?, ?, ?)",
+                     [('u', 'a', 'A', 'http://a', '2024-01-01'),
+                      ('u', 'a', 'A again', 'http://a', '2024-01-02'),
+                      ('u', 'b', 'B', 'http://b', '2024-01-03')])
+    conn.commit()
+    conn.close()
+
+    store = FavoritesStore(path)
+    store.init_schema()
+    assert db.get_connection(path).execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+    # Duplicates collapse to the oldest row
+    assert sorted((f['station_uuid'], f['station_name']) for f in store.list('u')) == [('a', 'A'), ('b', 'B')]
+    assert store.version('u') == 1
+    # Running again is a no-op
+    store.init_schema()
+    assert len(store.list('u')) == 2
+
+
+def test_every_write_bumps_the_version_but_duplicates_do_not(store):
+    assert store.version('u') == 0
+    assert store.add('u', favorite('a'))
+    assert store.version('u') == 1
+    assert not store.add('u', favorite('a'))
+    assert store.version('u') == 1
+    assert [r['status'] for r in store.add_many('u', [favorite('a'), favorite('b'), favorite('b')])] == \
+        [EXISTS, ADDED, EXISTS]
+    assert store.version('u') == 2
+    # Other users are versioned separately
+    assert store.version('someone else') == 0
+
+
+def test_changes_since_a_version(store):
+    store.add('u', favorite('a'))
+    store.add('u', favorite('b'))
+    version = store.version('u')
+    first = {f['station_uuid']: f['id'] for f in store.list('u')}
+
+    store.add('u', favorite('c'))
+    assert store.remove('u', first[uid('a')])
+    changed, deleted = store.changes('u', version)
+    assert [f['station_uuid'] for f in changed] == [uid('c')]
+    assert deleted == [first[uid('a')]]
+
+    # From scratch there is nothing to delete
+    changed, deleted = store.changes('u', 0)
+    assert sorted(f['station_uuid'] for f in changed) == [uid('b'), uid('c')]
+    assert deleted == []
+    assert store.changes('u', store.version('u')) == ([], [])
+
+
+def test_removed_favorites_can_be_added_again(store):
+    store.add('u', favorite('a'))
+    favorite_id = store.list('u')[0]['id']
+    assert store.remove_many('u', [favorite_id, 12345]) == [
+        {"id": favorite_id, "status": REMOVED}, {"id": 12345, "status": NOT_FOUND}]
+    assert not store.remove('u', favorite_id)
+    assert store.list('u') == []
+    assert store.add('u', favorite('a'))
+    assert [f['station_uuid'] for f in store.list('u')] == [uid('a')]
+
+
+def test_favorites_etag_tracks_the_version():
+    import app
+    app.init_db()
+    client = app.app.test_client()
+    user = 'etag-test'
+
+    first = client.get(f'/api/favorites?user_id={user}')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert client.get(f'/api/favorites?user_id={user}', headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.post('/api/favorites', json=dict(favorite('a'), user_id=user)).status_code == 200
+    changed = client.get(f'/api/favorites?user_id={user}', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.json['version'] == 1
+
+    delta = client.get(f'/api/favorites?user_id={user}&since=0')
+    assert [f['station_uuid'] for f in delta.json['favorites']] == [uid('a')]
+    assert client.get(f'/api/favorites?user_id={user}&since=1').json['favorites'] == []
+
+
+@pytest.mark.parametrize('item, error', [
+    (favorite('a', station_uuid=['a']), 'station_uuid must be a string'),
+    (favorite('a', station_uuid={'uuid': 'a'}), 'station_uuid must be a string'),
+    (favorite('a', station_uuid='not-a-station'), 'station_uuid is not a station UUID'),
+    (favorite('a', station_name=7), 'station_name must be a string'),
+    (favorite('a', tags=['jazz']), 'tags must be a string'),
+])
+def test_batches_report_malformed_items(store, item, error):
+    assert store.add_many('u', [item, favorite('b')]) == [
+        {"status": INVALID, "error": error}, {"station_uuid": uid('b'), "status": ADDED}]
+
+
+def test_batch_route_reports_malformed_items_instead_of_failing():
+    import app
+    app.init_db()
+    client = app.app.test_client()
+    response = client.post('/api/favorites/batch', json={
+        'user_id': 'batch-test', 'favorites': [favorite('a', station_uuid=['a']), favorite('b')]})
+    assert response.status_code == 200
+    assert [result['status'] for result in response.json['results']] == [INVALID, ADDED]
+    assert client.post('/api/favorites/batch', json={'user_id': ['u'], 'favorites': []}).status_code == 400
+
+
+@pytest.mark.parametrize('body', ['not json', '[1, 2]', '"favorite"', '{"user_id": ["u"]}'])
+def test_add_route_answers_malformed_bodies_with_json(body):
+    import app
+    response = app.app.test_client().post('/api/favorites', data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert 'error' in response.json
@@ -0,0 +1,99 @@
+import socket
+import time
+
+import pytest
+
+from bench import resp_server
+from cache import TTLCache
+from cachebackend import COMPRESSED, encode_key
+from rediscache import STORED_AT, RedisCache
+
+KEY = ('search', 'jazz', 20)
+
+
+@pytest.fixture
+def server():
+    server = resp_server.serve(0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def backend(server, **kwargs):
+    port = server.server_address[1]
+    return RedisCache(f'redis://127.0.0.1:{port}/0', **kwargs)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_set_and_get_round_trip(server):
+    cache = backend(server)
+    cache.set(KEY, [{'name': 'Jazz FM'}], ttl=60)
+    value, age = cache.get(KEY)
+    assert value == [{'name': 'Jazz FM'}]
+    assert 0 <= age < 1
+    assert cache.get(('search', 'rock', 20)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_large_values_are_stored_compressed(server):
+    cache = backend(server, compress_min_size=1024)
+    stations = [{'name': f'Station {i}', 'tags': 'jazz,blues,soul'} for i in range(100)]
+    cache.set(KEY, stations, ttl=60)
+    stored = server.store.get((cache.prefix + encode_key(KEY)).encode('utf-8'))
+    assert stored[STORED_AT.size:][:1] == COMPRESSED
+    assert cache.get(KEY)[0] == stations
+    assert cache.stats()['compression_ratio'] < 0.5
+
+
+def test_values_expire_after_their_ttl(server):
+    cache = backend(server)
+    cache.set(KEY, ['soon gone'], ttl=0.05)
+    assert cache.get(KEY) is not None
+    time.sleep(0.1)
+    assert cache.get(KEY) is None
+
+
+def test_delete(server):
+    cache = backend(server)
+    cache.set(KEY, ['gone'], ttl=60)
+    cache.delete(KEY)
+    assert cache.get(KEY) is None
+
+
+def test_writes_invalidate_other_nodes(server):
+    local = TTLCache(shared=backend(server))
+    # The listener drops everything once it has subscribed
+    wait_for(lambda: local.invalidations >= 1)
+    local.set(KEY, ['old'])
+    assert local.get(KEY) == ['old']
+
+    other = backend(server)
+    other.set(KEY, ['new'], ttl=60)
+    wait_for(lambda: local.get(KEY) is None)
+    assert local.shared.invalidations_received == 1
+    # Its own writes are not echoed back
+    local.set(KEY, ['newer'])
+    time.sleep(0.05)
+    assert local.get(KEY) == ['newer']
+
+
+def test_unreachable_server_is_a_miss():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    cache = RedisCache(f'redis://127.0.0.1:{port}/0', retry_interval=60)
+    cache.set(KEY, ['lost'], ttl=60)
+    assert cache.get(KEY) is None
+    assert cache.errors == 1
+    # Left alone until the retry interval has passed
+    started = time.monotonic()
+    assert cache.get(KEY) is None
+    assert time.monotonic() - started < 0.05
+    assert cache.errors == 1
+    assert cache.stats()['available'] is False
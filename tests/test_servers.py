@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from servers import CLOSED, HALF_OPEN, OPEN, ServerManager
+from upstream import UpstreamUnavailable
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeHTTP:
+    """Answers each server with a fixed status, or raises for status None"""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        server = url.split('/json')[0]
+        self.calls.append(server)
+        status = self.statuses[server]
+        if status is None:
+            raise ConnectionError(f"{server} refused the connection")
+        return FakeResponse(status)
+
+
+def manager(statuses, **kwargs):
+    http = FakeHTTP(statuses)
+    return ServerManager(http, [], static_servers=list(statuses), **kwargs), http
+
+
+def test_server_errors_open_the_breaker():
+    servers, _ = manager({'http://a': 503}, failure_threshold=3)
+    for _ in range(3):
+        with pytest.raises(UpstreamUnavailable):
+            servers.request('/json/stats', deadline=1)
+    assert servers.breaker_states() == {'http://a': OPEN}
+
+
+def test_transport_errors_open_the_breaker():
+    servers, _ = manager({'http://a': None}, failure_threshold=2)
+    for _ in range(2):
+        with pytest.raises(UpstreamUnavailable):
+            servers.request('/json/stats', deadline=1)
+    assert servers.breaker_states() == {'http://a': OPEN}
+
+
+def test_client_errors_are_returned_without_penalising_the_server():
+    servers, http = manager({'http://a': 404, 'http://b': 200}, failure_threshold=3)
+    for _ in range(10):
+        assert servers.request('/json/url/not-a-station', deadline=1).status_code == 404
+    assert servers.breaker_states() == {'http://a': CLOSED, 'http://b': CLOSED}
+    # Not retried on the other server either
+    assert len(http.calls) == 10
+
+
+def test_failed_server_is_skipped_for_the_next():
+    servers, http = manager({'http://a': 503, 'http://b': 200}, failure_threshold=1, cooldown=60)
+    for _ in range(3):
+        assert servers.request('/json/stats', deadline=1).status_code == 200
+    # Tried at most once, then skipped while its breaker is open
+    assert http.calls.count('http://a') <= 1
+    assert http.calls.count('http://b') == 3
+
+
+def test_open_breaker_lets_one_trial_through_after_the_cooldown():
+    servers, http = manager({'http://a': 503}, failure_threshold=1, cooldown=60)
+    with pytest.raises(UpstreamUnavailable):
+        servers.request('/json/stats', deadline=1)
+    state = servers._servers['http://a']
+    assert state.breaker == OPEN
+    state.opened_at -= state.cooldown
+    assert [s.url for s in servers.ranked()] == ['http://a']
+    assert state.breaker == HALF_OPEN
+
+    http.statuses['http://a'] = 200
+    assert servers.request('/json/stats', deadline=1).status_code == 200
+    assert servers.breaker_states() == {'http://a': CLOSED}
+
+
+def test_failed_trial_doubles_the_cooldown():
+    servers, _ = manager({'http://a': 503}, failure_threshold=1, cooldown=30, max_cooldown=300)
+    with pytest.raises(UpstreamUnavailable):
+        servers.request('/json/stats', deadline=1)
+    state = servers._servers['http://a']
+    state.opened_at -= state.cooldown
+    with pytest.raises(UpstreamUnavailable):
+        servers.request('/json/stats', deadline=1)
+    assert state.breaker == OPEN
+    assert state.cooldown == 60
+
+
+def test_stale_server_lists_are_refreshed_once_off_the_request_path():
+    servers, _ = manager({'http://a': 200}, rediscover_interval=60)
+    servers.discover()
+    discovered = threading.Event()
+    calls = []
+
+    def slow_discover():
+        calls.append(1)
+        time.sleep(0.2)
+        servers._discovered_at = time.monotonic()
+        discovered.set()
+
+    servers._discover = slow_discover
+    servers._discovered_at -= 61
+    started = time.monotonic()
+    for _ in range(10):
+        assert servers.request('/json/stats', deadline=1).status_code == 200
+    assert time.monotonic() - started < 0.1
+    assert discovered.wait(2)
+    assert len(calls) == 1
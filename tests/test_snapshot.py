@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from snapshot import SnapshotView, StationSnapshot, encode
+
+
+def station(uuid, votes, **fields):
+    return dict({'uuid': uuid, 'name': f'Station {uuid}', 'url': f'http://stream.invalid/{uuid}',
+                 'country': 'Germany', 'language': 'german', 'tags': 'pop', 'favicon': '', 'codec': 'MP3',
+                 'bitrate': 128, 'votes': votes}, **fields)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'stations.snapshot')
+
+
+def test_round_trip_keeps_every_field(path):
+    stations = [station('b', 10, name='Café Zürich ☕', tags='jazz,lounge'), station('a', 99), station('c', 5)]
+    snapshot = StationSnapshot(path)
+    snapshot.merge(stations)
+    assert snapshot.flush()
+
+    reopened = StationSnapshot(path).load()
+    assert len(reopened) == 3
+    assert reopened.get('b') == stations[0]
+    assert reopened.get('missing') is None
+    assert [s['uuid'] for s in reopened.popular(10)] == ['a', 'b', 'c']
+    assert reopened.stations() == sorted(stations, key=lambda s: -s['votes'])
+
+
+def test_search_folds_and_matches_each_station_once(path):
+    snapshot = StationSnapshot(path)
+    snapshot.merge([station('a', 3, name='Cafe Jazz', tags='jazz'), station('b', 7, name='CAFÉ del Mar'),
+                    station('c', 5, name='Rock FM')])
+    snapshot.flush()
+    assert [s['uuid'] for s in snapshot.search('café', 10)] == ['b', 'a']
+    assert [s['uuid'] for s in snapshot.search('jazz', 10)] == ['a']
+    assert [s['uuid'] for s in snapshot.search('cafe', 1)] == ['b']
+    assert snapshot.search('', 10) == []
+
+
+def test_flushes_merge_with_what_other_processes_wrote(path):
+    first, second = StationSnapshot(path).load(), StationSnapshot(path).load()
+    first.merge([station('a', 1)])
+    first.flush()
+    second.merge([station('b', 2), station('a', 50, name='Renamed')])
+    second.flush()
+    first.reload()
+    assert [(s['uuid'], s['name']) for s in first.popular(10)] == [('a', 'Renamed'), ('b', 'Station b')]
+
+
+def test_least_voted_and_stale_stations_are_dropped(path, monkeypatch):
+    snapshot = StationSnapshot(path, max_stations=2, max_age=100)
+    snapshot.merge([station('a', 1), station('b', 2), station('c', 3)])
+    snapshot.flush()
+    assert [s['uuid'] for s in snapshot.popular(10)] == ['c', 'b']
+
+    later = time.time() + 101
+    monkeypatch.setattr('snapshot.time.time', lambda: later)
+    snapshot.merge([station('d', 0)])
+    snapshot.flush()
+    assert [s['uuid'] for s in snapshot.popular(10)] == ['d']
+    assert snapshot.evicted == 3
+
+
+def test_missing_or_unreadable_files_are_seeded(path):
+    assert StationSnapshot(path).load(seed=[station('seed', 1)]).get('seed') is not None
+    with open(path, 'wb') as f:
+        f.write(b'not a snapshot at all, just garbage bytes')
+    snapshot = StationSnapshot(path).load(seed=[station('again', 1)])
+    assert [s['uuid'] for s in snapshot.popular(10)] == ['again']
+
+
+def test_truncated_files_are_rejected():
+    data = encode([station('a', 1)], int(time.time()))
+    assert SnapshotView(data).get('a') is not None
+    with pytest.raises(ValueError):
+        SnapshotView(data[:-5])
@@ -0,0 +1,38 @@
+from streaming import StreamSlots
+
+
+def test_slots_are_bounded_and_released_when_the_stream_ends():
+    slots = StreamSlots(limit=1)
+    assert slots.acquire()
+    assert not slots.acquire()
+    assert list(slots.wrap(iter([b'a', b'b']))) == [b'a', b'b']
+    assert slots.acquire()
+    assert slots.stats()['rejected'] == 1
+
+
+def test_slot_is_released_when_the_client_disconnects_before_reading():
+    slots = StreamSlots(limit=1)
+    closed = []
+
+    def chunks():
+        try:
+            yield b'a'
+        finally:
+            closed.append(True)
+
+    assert slots.acquire()
+    stream = slots.wrap(chunks())
+    assert next(stream) == b'a'
+    stream.close()
+    stream.close()
+    assert closed == [True]
+    assert slots.open == 0
+
+    assert slots.acquire()
+    slots.wrap(chunks()).close()
+    assert slots.open == 0
+
+
+def test_unbounded_slots():
+    slots = StreamSlots(limit=None)
+    assert all(slots.acquire() for _ in range(1000))
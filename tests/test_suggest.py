@@ -0,0 +1,59 @@
+from suggest import SuggestIndex, fold
+
+STATIONS = [
+    {'uuid': 'r1', 'name': 'BBC Radio 1', 'tags': 'pop,charts', 'country': 'United Kingdom', 'votes': 900},
+    {'uuid': 'r4', 'name': 'BBC Radio 4', 'tags': 'news,talk', 'country': 'United Kingdom', 'votes': 500},
+    {'uuid': 'rf', 'name': 'Radio France Culture', 'tags': 'talk', 'country': 'France', 'votes': 300},
+    {'uuid': 'cf', 'name': 'Café del Mar', 'tags': 'chillout', 'country': 'Spain', 'votes': 200},
+    {'uuid': 'dup', 'name': 'BBC Radio 1', 'tags': 'pop', 'country': 'United Kingdom', 'votes': 5},
+]
+
+
+def index(**kwargs):
+    index = SuggestIndex(**kwargs)
+    index.rebuild(STATIONS)
+    return index
+
+
+def texts(results):
+    return [result['text'] for result in results]
+
+
+def test_completions_are_ordered_by_weight():
+    assert texts(index().suggest('bbc')) == ['BBC Radio 1', 'BBC Radio 4']
+
+
+def test_names_complete_from_later_words():
+    results = index().suggest('radio')
+    assert texts(results)[:3] == ['BBC Radio 1', 'BBC Radio 4', 'Radio France Culture']
+    assert results[0]['uuid'] == 'r1'
+
+
+def test_tags_and_countries_are_weighted_by_summed_votes():
+    results = index().suggest('unit')
+    assert [(r['text'], r['type'], r['weight']) for r in results] == [('United Kingdom', 'country', 1408)]
+
+
+def test_precomputed_and_scanned_prefixes_agree():
+    short = index(precompute_length=1)
+    full = index(precompute_length=6)
+    for prefix in ('b', 'bb', 'bbc r', 'ra', 'radio f', 'ta'):
+        assert short.suggest(prefix) == full.suggest(prefix)
+
+
+def test_matching_ignores_case_and_accents():
+    assert fold('  Café   DEL Mar ') == 'cafe del mar'
+    assert texts(index().suggest('CAFE')) == ['Café del Mar']
+
+
+def test_limit_and_empty_prefix():
+    assert len(index().suggest('r', 2)) == 2
+    assert index().suggest('   ') == []
+
+
+def test_route_clamps_the_limit(monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'SUGGEST', index(k=3))
+    client = app.app.test_client()
+    assert len(client.get('/api/stations/suggest?prefix=r&limit=-1').json['suggestions']) == 1
+    assert len(client.get('/api/stations/suggest?prefix=r&limit=1000').json['suggestions']) == 3
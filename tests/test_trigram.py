@@ -0,0 +1,53 @@
+from trigram import TrigramIndex, trigrams
+
+STATIONS = [
+    {'uuid': 'bbc', 'name': 'BBC Radio 1', 'tags': 'pop,charts', 'votes': 900},
+    {'uuid': 'fip', 'name': 'FIP', 'tags': 'eclectic,jazz', 'votes': 400},
+    {'uuid': 'kexp', 'name': 'KEXP 90.3 Seattle', 'tags': 'indie,alternative', 'votes': 300},
+    {'uuid': 'jazz', 'name': 'Smooth Jazz Florida', 'tags': 'smooth jazz', 'votes': 50},
+    {'uuid': 'cafe', 'name': 'Café Lounge', 'tags': 'chillout', 'votes': 20},
+]
+
+
+def index(**kwargs):
+    index = TrigramIndex(**kwargs)
+    index.rebuild(STATIONS)
+    return index
+
+
+def uuids(results):
+    return [uuid for uuid, _ in results]
+
+
+def test_trigrams_are_padded_per_word():
+    assert trigrams('Ab') == {'  a', ' ab', 'ab '}
+    assert trigrams('a, b') == trigrams('A B')
+
+
+def test_misspelled_names_still_match():
+    assert uuids(index().search('bbc radoi'))[0] == 'bbc'
+    assert uuids(index().search('kexp seatle'))[0] == 'kexp'
+    assert uuids(index().search('cafe lounge')) == ['cafe']
+
+
+def test_genre_queries_find_tagged_stations():
+    assert set(uuids(index().search('jazz'))) == {'fip', 'jazz'}
+
+
+def test_unrelated_queries_match_nothing():
+    assert index().search('zzzz qqqq') == []
+    assert index().search('') == []
+
+
+def test_scores_are_ordered_and_limited():
+    results = index(min_similarity=0.1).search('radio seattle jazz', limit=2)
+    assert len(results) == 2
+    assert results[0][1] >= results[1][1]
+
+
+def test_the_postings_budget_bounds_candidates_but_keeps_popular_matches():
+    stations = [{'uuid': str(i), 'name': f'Radio {i}', 'votes': i} for i in range(1000)]
+    index = TrigramIndex(max_postings=50, max_candidates=10)
+    index.rebuild(stations)
+    results = index.search('radio', limit=5)
+    assert uuids(results) == ['999', '998', '997', '996', '995']
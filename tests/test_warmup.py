@@ -0,0 +1,46 @@
+import time
+
+from warmup import Warmer
+
+
+def warmer(tmp_path, **kwargs):
+    warmer = Warmer(cache=None, loader_for=None, db_path=str(tmp_path / 'warmup.db'), **kwargs)
+    warmer.init_schema()
+    return warmer
+
+
+def request(warmer, query, hits):
+    for _ in range(hits):
+        warmer.record(('search', query, 20))
+
+
+def stored_queries(warmer):
+    return {row[0] for row in warmer._conn().execute("SELECT query FROM hot_queries")}
+
+
+def test_save_caps_the_table(tmp_path):
+    w = warmer(tmp_path, max_rows=3)
+    for hits, query in enumerate('abcde', 1):
+        request(w, query, hits)
+    w.save()
+    assert w.top() == [('search', query, 20) for query in 'edc']
+    assert len(stored_queries(w)) == 3
+
+
+def test_queries_that_become_popular_later_can_still_get_in(tmp_path, monkeypatch):
+    w = warmer(tmp_path, max_rows=3, top_queries=2)
+    clock = [time.time()]
+    monkeypatch.setattr('warmup.time.time', lambda: clock[0])
+    for query, hits in zip('abc', (100, 100, 90)):
+        request(w, query, hits)
+    w.save()
+
+    # A new query enters a full table, rather than being trimmed for having few hits yet
+    for _ in range(3):
+        clock[0] += 60
+        request(w, 'new', 80)
+        request(w, 'a', 1)
+        w.save()
+    # The stale key with the fewest hits made room
+    assert stored_queries(w) == {'a', 'b', 'new'}
+    assert w.top() == [('search', 'new', 20), ('search', 'a', 20)]
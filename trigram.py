@@ -0,0 +1,131 @@
+"""Typo-tolerant station search over a trigram inverted index"""
+import math
+import time
+from array import array
+from collections import Counter
+
+from suggest import fold
+
+
+def trigrams(text):
+    """Trigrams of each folded word, padded so word starts and ends count"""
+    grams = set()
+    for word in fold(text).replace(',', ' ').split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramState:
+    """One immutable build of the index"""
+
+    def __init__(self):
+        self.uuids = []
+        self.votes = array('l')
+        self.gram_ids = {}
+        self.postings = []     # gram id -> array of documents whose name or tags contain it
+        self.name_grams = []   # document -> packed array('I') of name trigram ids
+        self.tag_grams = []    # document -> packed array('I') of tag trigram ids
+        self.max_votes = 1.0
+
+    def _ids(self, doc, grams):
+        ids = array('I')
+        for gram in grams:
+            gram_id = self.gram_ids.get(gram)
+            if gram_id is None:
+                gram_id = self.gram_ids[gram] = len(self.postings)
+                self.postings.append(array('l'))
+            ids.append(gram_id)
+            posting = self.postings[gram_id]
+            if not posting or posting[-1] != doc:
+                posting.append(doc)
+        return ids.tobytes()
+
+    def add(self, station):
+        doc = len(self.uuids)
+        self.uuids.append(station['uuid'])
+        self.votes.append(station.get('votes') or 0)
+        self.name_grams.append(self._ids(doc, trigrams(station.get('name') or '')))
+        self.tag_grams.append(self._ids(doc, trigrams(station.get('tags') or '')))
+
+
+class TrigramIndex:
+    """Ranks stations by trigram similarity of name and tags, blended with votes.
+
+    A query first gathers candidates cheaply: it counts documents across
+    the postings of its trigrams, reading at most ``max_postings`` entries
+    in total (rare trigrams whole, the heads of common ones), and keeps the
+    ``max_candidates`` with the most hits. Only those are scored exactly
+    against their stored trigram ids, so the cost of a query is bounded
+    regardless of catalog size. Rebuilds create a new TrigramState and
+    swap it in.
+    """
+
+    def __init__(self, min_similarity=0.45, vote_weight=0.2, max_postings=2000, max_candidates=64):
+        self.min_similarity = min_similarity
+        self.vote_weight = vote_weight
+        self.max_postings = max_postings
+        self.max_candidates = max_candidates
+        self._state = TrigramState()
+        self.rebuilds = 0
+        self.last_rebuild_ms = None
+        self.queries = 0
+
+    def rebuild(self, stations):
+        started = time.perf_counter()
+        state = TrigramState()
+        # Documents are numbered by descending votes, so every posting lists popular stations first
+        for station in sorted(stations, key=lambda station: station.get('votes') or 0, reverse=True):
+            if station.get('uuid'):
+                state.add(station)
+        state.max_votes = math.log1p(max(state.votes, default=0)) or 1.0
+        self._state = state
+        self.rebuilds += 1
+        self.last_rebuild_ms = (time.perf_counter() - started) * 1000
+
+    def search(self, query, limit=50):
+        """[(uuid, score)] of the best matches for ``query``, best first"""
+        self.queries += 1
+        state = self._state
+        query_grams = trigrams(query)
+        if not query_grams or not state.uuids:
+            return []
+        size = len(query_grams)
+        query_ids = {state.gram_ids[gram] for gram in query_grams if gram in state.gram_ids}
+
+        hits = Counter()
+        budget = self.max_postings
+        postings = sorted((state.postings[gram_id] for gram_id in query_ids), key=len)
+        for remaining, posting in zip(range(len(postings), 0, -1), postings):
+            # Rare trigrams are read whole; common ones share what is left of the budget,
+            # contributing their most popular stations
+            take = min(len(posting), budget // remaining)
+            hits.update(posting[:take])
+            budget -= take
+
+        scored = []
+        for doc, _ in hits.most_common(self.max_candidates):
+            shared = len(query_ids.intersection(memoryview(state.name_grams[doc]).cast('I')))
+            name_size = len(state.name_grams[doc]) // 4
+            # Half "how much of the query is in the name", half "how alike are they"
+            similarity = 0.5 * shared / size + shared / (size + name_size)
+            if similarity < self.min_similarity and state.tag_grams[doc]:
+                # A query that names a genre should find stations tagged with it
+                tag_shared = len(query_ids.intersection(memoryview(state.tag_grams[doc]).cast('I')))
+                similarity = max(similarity, 0.8 * tag_shared / size)
+            if similarity < self.min_similarity:
+                continue
+            popularity = math.log1p(state.votes[doc]) / state.max_votes
+            scored.append((similarity * (1 - self.vote_weight + self.vote_weight * popularity), state.uuids[doc]))
+        scored.sort(reverse=True)
+        return [(uuid, score) for score, uuid in scored[:limit]]
+
+    def stats(self):
+        state = self._state
+        return {
+            "stations": len(state.uuids),
+            "trigrams": len(state.postings),
+            "rebuilds": self.rebuilds,
+            "last_rebuild_ms": self.last_rebuild_ms,
+            "queries": self.queries
+        }
@@ -0,0 +1,140 @@
+"""Shared keep-alive HTTP clients for radio-browser.info and station host calls"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when no radio-browser server returned a usable response"""
+
+
+class UpstreamStats:
+    """Per-host request latency and connection reuse counters.
+
+    With ``aggregate_as`` every host is counted under that one name, for
+    clients that talk to arbitrary third-party hosts.
+    """
+
+    def __init__(self, aggregate_as=None):
+        self.aggregate_as = aggregate_as
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host):
+        host = self.aggregate_as or host
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = {
+                "requests": 0,
+                "errors": 0,
+                "new_connections": 0,
+                "latency_total_ms": 0.0,
+                "latency_max_ms": 0.0
+            }
+        return entry
+
+    def new_connection(self, host):
+        with self._lock:
+            self._host(host)["new_connections"] += 1
+
+    def record(self, host, elapsed, error=False):
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            entry = self._host(host)
+            entry["requests"] += 1
+            if error:
+                entry["errors"] += 1
+            entry["latency_total_ms"] += elapsed_ms
+            entry["latency_max_ms"] = max(entry["latency_max_ms"], elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            hosts = {}
+            for host, entry in self._hosts.items():
+                requests_made = entry["requests"]
+                hosts[host] = dict(entry,
+                                   reused_connections=max(requests_made - entry["new_connections"], 0),
+                                   latency_avg_ms=entry["latency_total_ms"] / requests_made if requests_made else 0.0)
+            return hosts
+
+
+def _counting_pool(base, stats):
+    class CountingPool(base):
+        def _new_conn(self):
+            stats.new_connection(self.host)
+            return super()._new_conn()
+    return CountingPool
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools report every new connection"""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats)
+        }
+
+
+class UpstreamClient:
+    """Thread-safe client with per-host keep-alive pools, retries and backoff.
+
+    Each thread gets its own ``requests.Session`` but all sessions share one
+    adapter, so connections are pooled across threads. ``aggregate_as``
+    counts all hosts together (see UpstreamStats).
+    """
+
+    def __init__(self, headers=None, pool_connections=10, pool_maxsize=32,
+                 retries=1, backoff_factor=0.3, timeout=15, aggregate_as=None):
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.stats = UpstreamStats(aggregate_as)
+        retry = Retry(total=retries, connect=retries, read=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'HEAD']),
+                      raise_on_status=False)
+        self.adapter = PooledAdapter(self.stats, pool_connections=pool_connections,
+                                     pool_maxsize=pool_maxsize, max_retries=retry)
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self._local.session = session
+        return session
+
+    def get(self, url, params=None, timeout=None, stream=False, headers=None, allow_redirects=True):
+        """GET ``url`` over a pooled connection, recording its latency"""
+        host = urlsplit(url).hostname or url
+        started = time.perf_counter()
+        try:
+            response = self._session().get(url, params=params, headers=headers,
+                                           timeout=timeout or self.timeout, stream=stream,
+                                           allow_redirects=allow_redirects)
+        except Exception:
+            self.stats.record(host, time.perf_counter() - started, error=True)
+            raise
+        self.stats.record(host, time.perf_counter() - started, error=response.status_code >= 500)
+        return response
+
+    def stats_snapshot(self):
+        return {
+            "pool_connections": self.adapter._pool_connections,
+            "pool_maxsize": self.adapter._pool_maxsize,
+            "hosts": self.stats.snapshot()
+        }
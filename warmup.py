@@ -0,0 +1,281 @@
+"""Startup warm-up and scheduled refresh of the most requested station lists"""
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import db
+import metrics
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS hot_queries
+            (endpoint TEXT,
+             query TEXT,
+             size INTEGER,
+             hits INTEGER,
+             last_seen REAL,
+             PRIMARY KEY (endpoint, query, size))'''
+
+
+class Warmer:
+    """Fills the station cache before the app reports ready, then keeps hot keys fresh.
+
+    Warm-up probes the upstream servers, then loads the popular lists at
+    ``popular_limits`` and the ``top_queries`` most requested cache keys of
+    the last ``query_window`` seconds, ``concurrency`` at a time, for at most
+    ``timeout`` seconds. ``ready`` is set when it finishes, whatever loaded.
+
+    After that every hot key is reloaded once ``1 - refresh_ahead`` of the
+    cache ttl has passed, minus up to ``jitter`` of the ttl at random, so it
+    never goes stale and refreshes do not line up; a failed refresh is
+    retried after ``retry_interval`` seconds. A key another process has just
+    refreshed into the shared cache is taken from there instead.
+
+    Requested keys are counted in memory and added to the ``hot_queries``
+    table every ``save_interval`` seconds; the hot set is recomputed from it
+    every ``hot_interval`` seconds and at the next start. The table keeps the
+    ``max_rows`` most recently requested keys, so a query that becomes
+    popular later gets in and builds up hits while stale ones age out.
+    """
+
+    def __init__(self, cache, loader_for, probe=None, db_path=db.DB_PATH, popular_limits=(20, 50, 100),
+                 top_queries=50, query_window=7 * 86400, concurrency=8, timeout=30, refresh_ahead=0.2,
+                 jitter=0.1, retry_interval=30, save_interval=60, hot_interval=300, max_rows=5000):
+        self.cache = cache
+        self.loader_for = loader_for
+        self.probe = probe
+        self.db_path = db_path
+        self.popular_limits = tuple(popular_limits)
+        self.top_queries = top_queries
+        self.query_window = query_window
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.refresh_ahead = refresh_ahead
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self.save_interval = save_interval
+        self.hot_interval = hot_interval
+        self.max_rows = max_rows
+        self.ready = threading.Event()
+        self._created = time.monotonic()
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._due = {}  # hot key -> monotonic time of its next refresh
+        self._started = False
+        self.startup_seconds = None
+        self.warmup_seconds = None
+        self.servers_answered = None
+        self.keys_total = 0
+        self.keys_warmed = 0
+        self.warm_failures = 0
+        self.refreshes = 0
+        self.refreshes_skipped = 0
+        self.refresh_failures = 0
+        self.late_refreshes = 0
+        self.last_refresh_lag = None
+        self.max_refresh_lag = 0.0
+
+    def _conn(self):
+        return db.get_connection(self.db_path)
+
+    def init_schema(self):
+        conn = self._conn()
+        with conn:
+            conn.execute(SCHEMA)
+
+    def record(self, key):
+        """Count a request for cache key (endpoint, query, size)"""
+        with self._lock:
+            self._counts[key] += 1
+
+    @metrics.timed_db('hot_queries.save')
+    def save(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            if counts:
+                conn.executemany(
+                    """INSERT INTO hot_queries (endpoint, query, size, hits, last_seen) VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT (endpoint, query, size) DO UPDATE SET
+                           hits=hot_queries.hits + excluded.hits, last_seen=excluded.last_seen""",
+                    [(endpoint, query, size, hits, now) for (endpoint, query, size), hits in counts.items()])
+            conn.execute("DELETE FROM hot_queries WHERE last_seen < ?", (now - self.query_window,))
+            # Every distinct search adds a row; keep the most recently requested.
+            # By hits instead, a full table would drop every new key on arrival
+            conn.execute("""DELETE FROM hot_queries WHERE rowid IN
+                              (SELECT rowid FROM hot_queries ORDER BY last_seen DESC, hits DESC LIMIT -1 OFFSET ?)""",
+                         (self.max_rows,))
+
+    @metrics.timed_db('hot_queries.top')
+    def top(self):
+        rows = self._conn().execute(
+            "SELECT endpoint, query, size FROM hot_queries WHERE last_seen >= ? ORDER BY hits DESC LIMIT ?",
+            (time.time() - self.query_window, self.top_queries)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def hot_keys(self):
+        """The popular lists at the common limits, then the most requested keys"""
+        keys = [('popular', '', limit) for limit in self.popular_limits]
+        try:
+            self.save()
+            recent = self.top()
+        except Exception as e:
+            log.warning("Reading the most requested queries failed error=%r", str(e))
+            recent = []
+        return list(dict.fromkeys(keys + recent))
+
+    def start(self):
+        """Warm up and then refresh hot keys, in a background thread"""
+        if self._started:
+            return
+        self._started = True
+        thread = threading.Thread(target=self._run, name='cache-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self):
+        try:
+            self.warm()
+        except Exception:
+            log.exception("Cache warm-up failed")
+        finally:
+            self.ready.set()
+        self.refresh_forever()
+
+    def warm(self):
+        started = time.monotonic()
+        if self.probe is not None:
+            try:
+                answered = self.probe()
+                self.servers_answered = len(answered)
+                log.info("Probed upstream servers answered=%d fastest=%s",
+                         len(answered), next(iter(answered), None))
+            except Exception as e:
+                log.warning("Upstream probe failed error=%r", str(e))
+
+        keys = self.hot_keys()
+        self.keys_total = len(keys)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='warmup')
+        futures = {executor.submit(self._load, key): key for key in keys}
+        done, not_done = wait(futures, timeout=self.timeout)
+        # Loads still running finish in the background; they are not waited for
+        executor.shutdown(wait=False, cancel_futures=True)
+        for future in done:
+            if future.result():
+                self.keys_warmed += 1
+            else:
+                self.warm_failures += 1
+        self.warm_failures += len(not_done)
+
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._due[key] = self._next_due(key, now)
+        self.warmup_seconds = now - started
+        self.startup_seconds = now - self._created
+        log.info("Cache warm-up finished keys=%d warmed=%d seconds=%.2f",
+                 self.keys_total, self.keys_warmed, self.warmup_seconds)
+
+    def _load(self, key):
+        """Load ``key`` unless a fresh enough copy exists; False if loading failed"""
+        try:
+            self.cache.prefetch(key, self.loader_for(key), self._refresh_age())
+            return True
+        except Exception as e:
+            log.warning("Cache warm-up load failed key=%r error=%r", key, str(e))
+            return False
+
+    def _refresh_age(self):
+        return self.cache.ttl * (1 - self.refresh_ahead)
+
+    def _next_due(self, key, now):
+        age = self.cache.age(key)
+        if age is None:
+            # Not loaded (warm-up failed or timed out): try again soon
+            return now + random.uniform(0, self.retry_interval)
+        return now + max(self._refresh_age() - age, 0.0) - random.uniform(0, self.jitter * self.cache.ttl)
+
+    def refresh_forever(self):
+        last_save = last_hot = time.monotonic()
+        while True:
+            now = time.monotonic()
+            try:
+                if now - last_hot >= self.hot_interval:
+                    last_hot = last_save = now
+                    self._update_hot_keys(now)
+                elif now - last_save >= self.save_interval:
+                    last_save = now
+                    self.save()
+                self.refresh_due(now)
+            except Exception:
+                log.exception("Scheduled cache refresh failed")
+            with self._lock:
+                next_due = min(self._due.values(), default=now + self.save_interval)
+            time.sleep(min(max(next_due - time.monotonic(), 0.05), self.save_interval))
+
+    def _update_hot_keys(self, now):
+        keys = self.hot_keys()
+        with self._lock:
+            for key in list(self._due):
+                if key not in keys:
+                    del self._due[key]
+            for key in keys:
+                if key not in self._due:
+                    self._due[key] = self._next_due(key, now)
+
+    def refresh_due(self, now):
+        with self._lock:
+            due = [(key, at) for key, at in self._due.items() if at <= now]
+        for key, at in due:
+            age = self.cache.age(key)
+            failed = False
+            try:
+                # Scheduled refreshes fire up to the jitter early; only a copy younger
+                # than that (from another process) makes this one unnecessary
+                loaded = self.cache.prefetch(key, self.loader_for(key),
+                                             self._refresh_age() - self.jitter * self.cache.ttl)
+            except Exception as e:
+                failed = True
+                self.refresh_failures += 1
+                log.warning("Scheduled cache refresh failed key=%r error=%r", key, str(e))
+            else:
+                if loaded:
+                    self.refreshes += 1
+                else:
+                    self.refreshes_skipped += 1
+            finished = time.monotonic()
+            lag = finished - at
+            self.last_refresh_lag = lag
+            self.max_refresh_lag = max(self.max_refresh_lag, lag)
+            if age is None or age + (finished - now) >= self.cache.ttl:
+                self.late_refreshes += 1
+            metrics.REGISTRY.observe('nerv9_cache_refresh_lag_seconds', lag, endpoint=key[0])
+            with self._lock:
+                if key in self._due:
+                    self._due[key] = finished + self.retry_interval if failed else self._next_due(key, finished)
+
+    def stats(self):
+        with self._lock:
+            hot_keys = len(self._due)
+        return {
+            "ready": self.ready.is_set(),
+            "startup_seconds": self.startup_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "servers_answered": self.servers_answered,
+            "keys_total": self.keys_total,
+            "keys_warmed": self.keys_warmed,
+            "coverage": self.keys_warmed / self.keys_total if self.keys_total else None,
+            "warm_failures": self.warm_failures,
+            "hot_keys": hot_keys,
+            "refreshes": self.refreshes,
+            "refreshes_skipped": self.refreshes_skipped,
+            "refresh_failures": self.refresh_failures,
+            "late_refreshes": self.late_refreshes,
+            "last_refresh_lag_seconds": self.last_refresh_lag,
+            "max_refresh_lag_seconds": self.max_refresh_lag
+        }